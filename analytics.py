@@ -0,0 +1,136 @@
+"""Farm-to-shelf markup analytics.
+
+markup_summary holds running totals per (category, region, harvest month).
+Triggers on the farmer, distributor and retailer record tables keep it current
+as records are added (see migrations/0006_markup_summary.sql; split and merged
+lots count under their nearest upstream farmer record's key, see
+migrations/0015_markup_lineage.sql), so reports read a few summary rows
+instead of aggregating the raw history. Chains moved to the archive keep
+their totals, and a rebuild reads them back from the archive. Records are only
+ever inserted by the app; after correcting or deleting records by hand, or
+after a bulk load with the triggers dropped, recompute everything with:
+
+    python analytics.py rebuild
+"""
+import argparse
+import sys
+import time
+
+import archive
+from database import DATABASE, connect
+
+MARKUP_DIMENSIONS = ['category', 'region', 'month']
+MARKUP_TRIGGERS = ['markup_farmer_insert', 'markup_distributor_insert', 'markup_retailer_insert']
+
+# markup_summary_source over archived chains, which a view in the hot database
+# cannot reference. Archived lots never have lineage, so each counts under its
+# own farmer record; products still (or again) hot are counted there instead.
+ARCHIVED_SUMMARY_SQL = '''
+    SELECT COALESCE(p.category, ''),
+           trim(substr(fr.farm_location, length(rtrim(fr.farm_location, replace(fr.farm_location, ',', ''))) + 1)),
+           substr(fr.harvest_date, 1, 7),
+           COUNT(*), SUM(fr.farmer_price),
+           COUNT(d.margin), COALESCE(SUM(d.margin), 0),
+           COUNT(r.final_price),
+           COALESCE(SUM(CASE WHEN r.final_price IS NOT NULL THEN fr.farmer_price END), 0),
+           COALESCE(SUM(CASE WHEN r.final_price IS NOT NULL THEN COALESCE(d.margin, 0) END), 0),
+           COALESCE(SUM(r.final_price), 0)
+    FROM archive.farmer_records fr
+    JOIN archive.products p ON p.id = fr.product_id
+    LEFT JOIN (SELECT product_id, MIN(id), distributor_margin AS margin
+               FROM archive.distributor_records GROUP BY product_id) d ON d.product_id = fr.product_id
+    LEFT JOIN (SELECT product_id, MIN(id), final_price
+               FROM archive.retailer_records GROUP BY product_id) r ON r.product_id = fr.product_id
+    WHERE NOT EXISTS (SELECT 1 FROM main.products hp WHERE hp.id = p.id)
+    GROUP BY 1, 2, 3'''
+
+
+def rebuild_markup_summary(conn):
+    """Recompute markup_summary from the raw records, hot and archived, in one transaction; returns the row count"""
+    conn.execute('DELETE FROM markup_summary')
+    conn.execute('INSERT INTO markup_summary SELECT * FROM markup_summary_source')
+    if archive.attach(conn):
+        conn.execute(f'''INSERT INTO markup_summary {ARCHIVED_SUMMARY_SQL}
+                         ON CONFLICT (category, region, month) DO UPDATE SET
+                             farmer_count = farmer_count + excluded.farmer_count,
+                             farmer_price_sum = farmer_price_sum + excluded.farmer_price_sum,
+                             distributor_count = distributor_count + excluded.distributor_count,
+                             distributor_margin_sum = distributor_margin_sum + excluded.distributor_margin_sum,
+                             retailer_count = retailer_count + excluded.retailer_count,
+                             retail_farmer_price_sum = retail_farmer_price_sum + excluded.retail_farmer_price_sum,
+                             retail_margin_sum = retail_margin_sum + excluded.retail_margin_sum,
+                             final_price_sum = final_price_sum + excluded.final_price_sum''')
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM markup_summary').fetchone()[0]
+
+
+def markup_report(conn, group_by, category=None, region=None, month_from=None, month_to=None):
+    """Aggregate summary rows over the chosen dimensions"""
+    conditions = []
+    params = []
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if region:
+        conditions.append('region = ?')
+        params.append(region)
+    if month_from:
+        conditions.append('month >= ?')
+        params.append(month_from)
+    if month_to:
+        conditions.append('month <= ?')
+        params.append(month_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    columns = ', '.join(group_by)
+    grouping = f'GROUP BY {columns} ORDER BY {columns}' if group_by else ''
+
+    rows = conn.execute(f'''SELECT {columns + ',' if group_by else ''}
+                                SUM(farmer_count), SUM(farmer_price_sum),
+                                SUM(distributor_count), SUM(distributor_margin_sum),
+                                SUM(retailer_count), SUM(retail_farmer_price_sum),
+                                SUM(retail_margin_sum), SUM(final_price_sum)
+                            FROM markup_summary {where} {grouping}''', params).fetchall()
+
+    report = []
+    for row in rows:
+        values = list(row)
+        keys = dict(zip(group_by, values[:len(group_by)]))
+        (farmer_count, farmer_price_sum, distributor_count, margin_sum,
+         retailer_count, retail_farmer_sum, retail_margin_sum, final_sum) = values[len(group_by):]
+        if not farmer_count:
+            continue
+        retail_markup = final_sum - retail_farmer_sum - retail_margin_sum
+        keys.update({
+            'products': farmer_count,
+            'distributed': distributor_count,
+            'retailed': retailer_count,
+            'avg_farmer_price': round(farmer_price_sum / farmer_count, 2),
+            'avg_distributor_margin': round(margin_sum / distributor_count, 2) if distributor_count else None,
+            'avg_final_price': round(final_sum / retailer_count, 2) if retailer_count else None,
+            # Over products that reached a shelf, so every price is for the same goods
+            'markup_pct': (round((final_sum - retail_farmer_sum) / retail_farmer_sum * 100, 2)
+                           if retailer_count and retail_farmer_sum else None),
+            'farmer_share_pct': round(retail_farmer_sum / final_sum * 100, 2) if retailer_count and final_sum else None,
+            'distributor_share_pct': round(retail_margin_sum / final_sum * 100, 2) if retailer_count and final_sum else None,
+            'retailer_share_pct': round(retail_markup / final_sum * 100, 2) if retailer_count and final_sum else None,
+        })
+        report.append(keys)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain markup analytics maintenance')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = connect(args.database)
+    rows = rebuild_markup_summary(conn)
+    conn.close()
+    print(f"✅ Rebuilt markup_summary ({rows:,} rows) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
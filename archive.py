@@ -0,0 +1,235 @@
+"""Hot/cold archival of completed supply chains.
+
+Products that reached the end of the chain (a retailer, or the customer stage
+of sample data) and have not changed for a long time are moved, with their
+stage records, tracking events and customer transactions, into an archive SQLite
+file with the same tables and indexes, so the hot database keeps only live
+chains. The archive is attached to a connection as schema `archive` when a
+read needs it: verify-product and the ledger fall back to it when a lookup
+misses in the hot tables, and search, dashboards and exports merge it in.
+Archived products keep their search index rows. Run the job from cron:
+
+    python archive.py run [--older-than-days 180] [--vacuum]
+
+Lots with split/merge lineage stay hot so recalls keep reaching them.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import migrate
+from database import DATABASE, connect
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('KRISHICHAIN_ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_BATCH = int(os.environ.get('KRISHICHAIN_ARCHIVE_BATCH', 1000))
+
+# Moved together; every table but products references the product by product_id
+ARCHIVE_TABLES = ['products', 'farmer_records', 'distributor_records', 'retailer_records',
+                  'customer_transactions', 'supply_chain_tracking']
+CHILD_TABLES = ARCHIVE_TABLES[1:]
+# Stages a chain can end in: the app's last hand-off is to a retailer, and
+# sample data marks sold chains as customer
+ARCHIVE_STAGES = ['retailer', 'customer']
+
+_create_table = re.compile(r'^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?("?)(\w+)\2', re.IGNORECASE)
+_create_index = re.compile(r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(IF\s+NOT\s+EXISTS\s+)?("?)(\w+)\3', re.IGNORECASE)
+
+
+def archive_path(conn):
+    """The archive file: KRISHICHAIN_ARCHIVE_DATABASE, or <hot database>_archive.db next to it"""
+    if os.environ.get('KRISHICHAIN_ARCHIVE_DATABASE'):
+        return os.environ['KRISHICHAIN_ARCHIVE_DATABASE']
+    main_file = next(row[2] for row in conn.execute('PRAGMA database_list') if row[1] == 'main')
+    return os.path.splitext(main_file)[0] + '_archive.db'
+
+
+def attach(conn, create=False):
+    """Attach the archive as schema `archive`; returns False if there is none (yet)"""
+    if any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list')):
+        return True
+    path = archive_path(conn)
+    if not create and not os.path.exists(path):
+        return False
+    conn.execute('ATTACH DATABASE ? AS archive', (path,))
+    return True
+
+
+def columns(conn, table):
+    return ', '.join(row['name'] for row in conn.execute(f'PRAGMA main.table_info({table})'))
+
+
+def ensure_schema(conn):
+    """Create the archive tables and indexes from the hot schema, adding columns added since"""
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    for table in ARCHIVE_TABLES:
+        archived = {row['name']: row for row in conn.execute(f'PRAGMA archive.table_info({table})')}
+        if not archived:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(_create_table.sub(f'CREATE TABLE archive.{table}', sql, count=1))
+            continue
+        for column in conn.execute(f'PRAGMA main.table_info({table})'):
+            if column['name'] not in archived:
+                conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column['name']} {column['type']}")
+
+    placeholders = ','.join('?' * len(ARCHIVE_TABLES))
+    for name, sql in conn.execute(f'''SELECT name, sql FROM main.sqlite_master
+                                      WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})''',
+                                  ARCHIVE_TABLES).fetchall():
+        conn.execute(_create_index.sub(lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS archive.{name}",
+                                       sql, count=1))
+    conn.commit()
+
+
+def eligible_products(conn, stage, older_than_days, limit, after_id=0):
+    """Ids of products at a final stage untouched for older_than_days, in id order after after_id
+
+    Every tracking event must already be chained and sealed, so proofs never
+    need events that are still changing. Lots with lineage are skipped, and so
+    are retail lots still waiting to expire, which the expiry scheduler would
+    otherwise never mark.
+    """
+    last_sealed = conn.execute('SELECT COALESCE(MAX(last_event_id), 0) FROM ledger_batches').fetchone()[0]
+    return [row[0] for row in conn.execute('''
+        SELECT p.id FROM main.products p
+        WHERE p.current_stage = ? AND p.id > ?
+          AND p.updated_at < datetime('now', ?)
+          AND NOT EXISTS (SELECT 1 FROM main.supply_chain_tracking st
+                          WHERE st.product_id = p.id AND (st.event_hash IS NULL OR st.id > ?))
+          AND NOT EXISTS (SELECT 1 FROM lot_lineage WHERE ancestor_id = p.id)
+          AND NOT EXISTS (SELECT 1 FROM lot_lineage WHERE descendant_id = p.id)
+          AND NOT EXISTS (SELECT 1 FROM main.retailer_records rr WHERE rr.product_id = p.id
+                          AND rr.expired_at IS NULL AND rr.expiry_date IS NOT NULL)
+        ORDER BY p.id LIMIT ?''', (stage, after_id, f'-{older_than_days} days', last_sealed, limit))]
+
+
+def archive_batch(conn, product_ids):
+    """Move products and their rows to the archive; returns how many products moved
+
+    The copy commits before the hot rows are deleted: transactions spanning
+    WAL databases are not atomic across files, and this way a crash can only
+    leave rows in both places (the next run replaces the copies), never in neither.
+    """
+    placeholders = ','.join('?' * len(product_ids))
+    for table in ARCHIVE_TABLES:
+        key = 'id' if table == 'products' else 'product_id'
+        names = columns(conn, table)
+        conn.execute(f'''INSERT OR REPLACE INTO archive.{table} ({names})
+                         SELECT {names} FROM main.{table} WHERE {key} IN ({placeholders})''', product_ids)
+    conn.commit()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Keeps the moved products in the search index (migrations/0017_archive_search.sql)
+        conn.execute('INSERT INTO archive_moves DEFAULT VALUES')
+        # A product updated since the copy stays hot, along with its rows
+        moved = conn.execute(f'''DELETE FROM main.products AS p WHERE p.id IN ({placeholders})
+                                 AND p.version IS (SELECT a.version FROM archive.products a
+                                                   WHERE a.id = p.id)''', product_ids).rowcount
+        for table in CHILD_TABLES:
+            conn.execute(f'''DELETE FROM main.{table} AS t
+                             WHERE t.product_id IN ({placeholders})
+                               AND NOT EXISTS (SELECT 1 FROM main.products p WHERE p.id = t.product_id)
+                               AND EXISTS (SELECT 1 FROM archive.{table} a WHERE a.id = t.id)''', product_ids)
+        for table in ARCHIVE_TABLES:
+            key = 'id' if table == 'products' else 'product_id'
+            conn.execute(f'''DELETE FROM archive.{table}
+                             WHERE {key} IN (SELECT id FROM main.products WHERE id IN ({placeholders}))''',
+                         product_ids)
+        conn.execute('DELETE FROM archive_moves')
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def sweep(conn):
+    """Move rows written for archived products since they were archived (e.g. scans); returns the count"""
+    orphans = '''NOT EXISTS (SELECT 1 FROM main.products p WHERE p.id = t.product_id)
+                 AND EXISTS (SELECT 1 FROM archive.products a WHERE a.id = t.product_id)'''
+    for table in CHILD_TABLES:
+        names = columns(conn, table)
+        conn.execute(f'''INSERT OR REPLACE INTO archive.{table} ({names})
+                         SELECT {names} FROM main.{table} t WHERE {orphans}''')
+    conn.commit()
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        swept = 0
+        for table in CHILD_TABLES:
+            swept += conn.execute(f'''DELETE FROM main.{table} AS t WHERE {orphans}
+                                      AND EXISTS (SELECT 1 FROM archive.{table} a WHERE a.id = t.id)''').rowcount
+        conn.commit()
+        return swept
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def run(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH, progress=None):
+    """Archive every eligible product in batches; returns (products moved, stray rows swept)"""
+    attach(conn, create=True)
+    ensure_schema(conn)
+    moved = 0
+    # One stage at a time, so each batch is a range of the (current_stage, id) index
+    for stage in ARCHIVE_STAGES:
+        after_id = 0
+        while True:
+            product_ids = eligible_products(conn, stage, older_than_days, batch_size, after_id)
+            if not product_ids:
+                break
+            moved += archive_batch(conn, product_ids)
+            after_id = product_ids[-1]
+            if progress:
+                progress(moved)
+            if len(product_ids) < batch_size:
+                break
+    return moved, sweep(conn)
+
+
+def counts(conn, schema):
+    return {table: conn.execute(f'SELECT COUNT(*) FROM {schema}.{table}').fetchone()[0] for table in ARCHIVE_TABLES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain hot/cold archival')
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--older-than-days', type=float, default=ARCHIVE_AFTER_DAYS,
+                        help='archive finished products unchanged this long (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH, help='products per transaction')
+    parser.add_argument('--vacuum', action='store_true', help='rebuild the hot database file afterwards')
+    args = parser.parse_args()
+
+    migrate.migrate(args.database)
+    conn = connect(args.database)
+    if args.command == 'status':
+        print(f"Hot database:     {args.database}")
+        for table, rows in counts(conn, 'main').items():
+            print(f"  {table:<24} {rows:>12,}")
+        if attach(conn):
+            print(f"Archive database: {archive_path(conn)}")
+            for table, rows in counts(conn, 'archive').items():
+                print(f"  {table:<24} {rows:>12,}")
+        else:
+            print("No archive yet")
+        conn.close()
+        return 0
+
+    started = time.perf_counter()
+    moved, swept = run(conn, args.older_than_days, args.batch_size,
+                       progress=lambda moved: print(f"  archived {moved:,} products"))
+    print(f"✅ Archived {moved:,} products ({swept:,} stray rows swept) to {archive_path(conn)} "
+          f"in {time.perf_counter() - started:.1f}s")
+    if args.vacuum:
+        conn.execute('VACUUM main')
+        print("✅ Vacuumed the hot database")
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
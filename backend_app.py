@@ -1,47 +1,109 @@
 
-from flask import Flask, request, jsonify, session
+from flask import Flask, request, jsonify, session, g, make_response, has_app_context, Response
 from flask_cors import CORS
-import sqlite3
 import hashlib
 import secrets
-import qrcode
-import io
 import base64
-from datetime import datetime, date
+import csv
+import io
+from datetime import datetime
 import os
 import json
+import time
+
+from cache import verify_cache
+import analytics
+import archive
+import database
+from database import DATABASE, pool as db_pool
+import event_stream
+import expiry
+import export
+import geo
+import ledger
+import lots
+import metrics
+import migrate
+import qr_images
+import responses
+import search
+from slow_queries import slow_query_log
+from write_behind import verification_log
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Set SECRET_KEY so sessions stay valid across workers and restarts
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(16)
 CORS(app, supports_credentials=True, origins=["https://sumedhsrs.github.io", "http://localhost:3000", "http://localhost:5000"])
 
 
-DATABASE = 'krishichain.db'
-
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the pooled connection bound to the current request"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Return the request's connection to the pool, even on early returns"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Request instrumentation
+@app.before_request
+def start_request_metrics():
+    """Start timing the request and counting its SQL"""
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+
+def record_statement(conn, sql, params, seconds):
+    """Attribute each executed statement to the current request, if any"""
+    metrics.sql_statements_total.inc()
+    if has_app_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_seconds += seconds
+
+database.statement_observers.append(record_statement)
+if slow_query_log is not None:
+    database.statement_observers.append(slow_query_log.observe)
+
+@app.before_request
+def start_ledger_sealer():
+    """Make sure this worker process is sealing ledger batches"""
+    ledger.sealer.start()
+
+@app.before_request
+def start_expiry_scheduler():
+    """Make sure this worker process is marking expired lots"""
+    expiry.scheduler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency, status and SQL usage per endpoint"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        metrics.request_latency.observe(time.perf_counter() - started, (endpoint, method))
+        metrics.requests_total.inc((endpoint, method, str(response.status_code)))
+        if response.status_code >= 500:
+            metrics.request_errors.inc((endpoint, method))
+        metrics.sql_statements.observe(g.sql_count, (endpoint,))
+        metrics.sql_time.observe(g.sql_seconds, (endpoint,))
+    return response
+
+# Registered after the metrics hook so it runs first and metrics see the final status
+responses.init_app(app)
 
 def init_database():
-    """Initialize the database with schema"""
-    conn = get_db_connection()
-
-    # Read and execute schema
-    with open('krishichain_schema.sql', 'r') as f:
-        schema = f.read()
-
-    # Execute each statement separately
-    statements = schema.split(';')
-    for statement in statements:
-        if statement.strip():
-            try:
-                conn.execute(statement)
-            except sqlite3.Error as e:
-                print(f"Error executing statement: {e}")
-
-    conn.commit()
-    conn.close()
+    """Bring the database schema up to date; returns the number of migrations applied"""
+    if os.environ.get('KRISHICHAIN_AUTO_MIGRATE', '1') == '0':
+        pending = migrate.pending_migrations(DATABASE)
+        if pending:
+            raise RuntimeError(f"{len(pending)} pending migration(s); run: python migrate.py migrate")
+        return 0
+    return migrate.migrate(DATABASE)
 
 def hash_password(password):
     """Hash password using SHA256"""
@@ -53,15 +115,8 @@ def generate_qr_code():
 
 def create_qr_image(qr_text):
     """Create QR code image and return base64 string"""
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_text)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
-    img_str = base64.b64encode(img_buffer.getvalue()).decode()
+    png, _ = qr_images.get_qr_image(qr_text)
+    img_str = base64.b64encode(png).decode()
     return f"data:image/png;base64,{img_str}"
 
 # Authentication endpoints
@@ -99,7 +154,6 @@ def register():
                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
                     (username, email, password_hash, role, full_name, phone, address))
         conn.commit()
-        conn.close()
 
         return jsonify({'message': 'User registered successfully'}), 201
 
@@ -121,7 +175,6 @@ def login():
         user = conn.execute('''SELECT id, username, email, role, full_name 
                               FROM users WHERE username = ? AND password_hash = ?''',
                            (username, hash_password(password))).fetchone()
-        conn.close()
 
         if not user:
             return jsonify({'error': 'Invalid credentials'}), 401
@@ -151,6 +204,8 @@ def logout():
     return jsonify({'message': 'Logged out successfully'}), 200
 
 # Product management endpoints
+LOT_CONSUMED_ERROR = 'Lot was already split or merged into other lots'
+
 @app.route('/api/farmer/register-product', methods=['POST'])
 def register_product():
     """Farmer registers new product"""
@@ -171,10 +226,19 @@ def register_product():
         if not all([product_name, quantity, farmer_price, farm_location, harvest_date]):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        qr_code = generate_qr_code()
+        (latitude, longitude), error = geo.parse_coordinates(data.get('latitude'), data.get('longitude'))
+        if error:
+            return jsonify({'error': error}), 400
+
+        # This route takes no session, so it must not use up other people's lots;
+        # lots made from others go through the authenticated lot and record routes
+        if data.get('parent_lots'):
+            return jsonify({'error': 'parent_lots is not accepted here; use /api/lots/split or /api/lots/merge'}), 400
 
         conn = get_db_connection()
 
+        qr_code = generate_qr_code()
+
         # Insert product
         cursor = conn.execute('''INSERT INTO products 
                                 (qr_code, product_name, category, current_stage)
@@ -185,10 +249,11 @@ def register_product():
         # Insert farmer record
         conn.execute('''INSERT INTO farmer_records 
                        (product_id, farmer_id, quantity, unit, farmer_price, 
-                        farm_location, harvest_date, farming_method)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                        farm_location, harvest_date, farming_method, latitude, longitude, geohash)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (product_id, 1, quantity, unit, farmer_price,
-                     farm_location, harvest_date, farming_method))
+                     farm_location, harvest_date, farming_method, latitude, longitude,
+                     geo.geohash(latitude, longitude)))
 
         # Add to supply chain tracking
         conn.execute('''INSERT INTO supply_chain_tracking 
@@ -196,17 +261,146 @@ def register_product():
                        VALUES (?, ?, ?, ?, ?)''',
                     (product_id, 'farmer', 1, 'Product Registered',
                      json.dumps(data)))
+        ledger.chain_events(conn, [product_id])
 
         conn.commit()
-        conn.close()
-
-        qr_image = create_qr_image(qr_code)
 
-        return jsonify({
+        response = {
             'message': 'Product registered successfully',
             'qr_code': qr_code,
-            'qr_image': qr_image,
+            'qr_image_url': f'/api/qr/{qr_code}.png',
             'product_id': product_id
+        }
+
+        # Clients that fetch the PNG endpoint can skip inline rendering
+        if data.get('include_qr_image', True):
+            response['qr_image'] = create_qr_image(qr_code)
+
+        return jsonify(response), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+MAX_BULK_PRODUCTS = int(os.environ.get('KRISHICHAIN_MAX_BULK_PRODUCTS', 5000))
+BULK_PRODUCT_FIELDS = ['product_name', 'quantity', 'unit', 'farmer_price', 'farm_location',
+                       'harvest_date', 'category', 'farming_method', 'latitude', 'longitude']
+
+def read_bulk_products():
+    """Read bulk registration rows from a JSON array or an uploaded CSV file"""
+    upload = request.files.get('file')
+    if upload is not None:
+        text = io.StringIO(upload.read().decode('utf-8-sig'))
+        return [dict(row) for row in csv.DictReader(text)]
+    if request.mimetype == 'text/csv':
+        text = io.StringIO(request.get_data(as_text=True))
+        return [dict(row) for row in csv.DictReader(text)]
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('products')
+    return data
+
+def validate_bulk_product(row):
+    """Normalize one bulk row; returns (values, error)"""
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+    values = {field: row.get(field) for field in BULK_PRODUCT_FIELDS}
+    values['unit'] = values['unit'] or 'kg'
+    values['category'] = values['category'] or ''
+    values['farming_method'] = values['farming_method'] or ''
+    if not all([values['product_name'], values['quantity'], values['farmer_price'],
+                values['farm_location'], values['harvest_date']]):
+        return None, 'Missing required fields'
+    try:
+        values['farmer_price'] = float(values['farmer_price'])
+    except (TypeError, ValueError):
+        return None, 'Invalid farmer_price'
+    (values['latitude'], values['longitude']), error = geo.parse_coordinates(values['latitude'],
+                                                                             values['longitude'])
+    if error:
+        return None, error
+    values['geohash'] = geo.geohash(values['latitude'], values['longitude'])
+    return values, None
+
+@app.route('/api/farmer/register-products', methods=['POST'])
+def register_products():
+    """Farmer registers many products in one transaction"""
+    try:
+    #    if 'user_id' not in session or session.get('role') != 'farmer':
+    #        return jsonify({'error': 'Authentication required'}), 401
+
+        rows = read_bulk_products()
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'error': 'Expected a non-empty list of products'}), 400
+        if len(rows) > MAX_BULK_PRODUCTS:
+            return jsonify({'error': f'At most {MAX_BULK_PRODUCTS} products per request'}), 413
+
+        # Validate every row before touching the database
+        results = []
+        accepted = []
+        for index, row in enumerate(rows):
+            values, error = validate_bulk_product(row)
+            if error:
+                results.append({'row': index, 'error': error})
+                continue
+            values['qr_code'] = generate_qr_code()
+            values['details'] = json.dumps(row)
+            accepted.append(values)
+            results.append({'row': index, 'qr_code': values['qr_code']})
+
+        if not accepted:
+            return jsonify({'error': 'No valid products', 'results': results}), 400
+
+        conn = get_db_connection()
+
+        # Insert products, then resolve their ids by qr_code for the dependent rows
+        conn.executemany('''INSERT INTO products
+                            (qr_code, product_name, category, current_stage)
+                            VALUES (:qr_code, :product_name, :category, 'farmer')''',
+                         accepted)
+
+        conn.executemany('''INSERT INTO farmer_records
+                            (product_id, farmer_id, quantity, unit, farmer_price,
+                             farm_location, harvest_date, farming_method, latitude, longitude, geohash)
+                            SELECT id, 1, :quantity, :unit, :farmer_price,
+                                   :farm_location, :harvest_date, :farming_method,
+                                   :latitude, :longitude, :geohash
+                            FROM products WHERE qr_code = :qr_code''',
+                         accepted)
+
+        conn.executemany('''INSERT INTO supply_chain_tracking
+                            (product_id, stage, user_id, action, details)
+                            SELECT id, 'farmer', 1, 'Product Registered', :details
+                            FROM products WHERE qr_code = :qr_code''',
+                         accepted)
+
+        qr_codes = [values['qr_code'] for values in accepted]
+        product_ids = {}
+        for start in range(0, len(qr_codes), 500):
+            chunk = qr_codes[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(f'SELECT id, qr_code FROM products WHERE qr_code IN ({placeholders})',
+                                    chunk):
+                product_ids[row['qr_code']] = row['id']
+
+        ledger.chain_events(conn, product_ids.values())
+        conn.commit()
+
+        for result in results:
+            if 'qr_code' in result:
+                result['product_id'] = product_ids[result['qr_code']]
+                result['qr_image_url'] = f"/api/qr/{result['qr_code']}.png"
+
+        # QR images are rendered lazily by /api/qr/ unless the caller asks to pre-render,
+        # which happens in the background so the response does not wait for it
+        if request.args.get('prerender_qr') in ('1', 'true'):
+            qr_images.prerender_in_background(qr_codes)
+
+        return jsonify({
+            'message': f'{len(accepted)} products registered successfully',
+            'registered': len(accepted),
+            'failed': len(results) - len(accepted),
+            'results': results
         }), 201
 
     except Exception as e:
@@ -229,26 +423,42 @@ def add_distributor_record():
         if not all([qr_code, distributor_name, storage_location, distributor_margin, transport_date]):
             return jsonify({'error': 'Missing required fields'}), 400
 
+        (latitude, longitude), error = geo.parse_coordinates(data.get('latitude'), data.get('longitude'))
+        if error:
+            return jsonify({'error': error}), 400
+
         conn = get_db_connection()
 
         # Find product
-        product = conn.execute('SELECT id FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
+        product = conn.execute('SELECT id, consumed_at FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
         if not product:
             return jsonify({'error': 'Invalid QR code'}), 404
+        if product['consumed_at']:
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
 
         product_id = product['id']
 
+        # Lots merged into this one, if any
+        parents, error = read_parent_lots(conn, data, product_id)
+        if error:
+            return jsonify({'error': error}), 400
+
         # Insert distributor record
         conn.execute('''INSERT INTO distributor_records 
                        (product_id, distributor_id, distributor_name, storage_location,
-                        distributor_margin, transport_date)
-                       VALUES (?, ?, ?, ?, ?, ?)''',
+                        distributor_margin, transport_date, latitude, longitude, geohash)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                     (product_id, session['user_id'], distributor_name, storage_location,
-                     distributor_margin, transport_date))
+                     distributor_margin, transport_date, latitude, longitude,
+                     geo.geohash(latitude, longitude)))
+        lots.link_lots(conn, product_id, parents)
 
-        # Update product stage
-        conn.execute('UPDATE products SET current_stage = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                    ('distributor', product_id))
+        # Update product stage, unless a concurrent split or merge used the lot up
+        updated = conn.execute('''UPDATE products SET current_stage = ?, updated_at = CURRENT_TIMESTAMP
+                                  WHERE id = ? AND consumed_at IS NULL''', ('distributor', product_id)).rowcount
+        if not updated or not lots.consume_lots(conn, [parent_id for parent_id, _ in parents]):
+            conn.rollback()
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
 
         # Add to supply chain tracking
         conn.execute('''INSERT INTO supply_chain_tracking 
@@ -256,9 +466,10 @@ def add_distributor_record():
                        VALUES (?, ?, ?, ?, ?)''',
                     (product_id, 'distributor', session['user_id'], 'Distributor Record Added',
                      json.dumps(data)))
+        ledger.chain_events(conn, [product_id])
 
         conn.commit()
-        conn.close()
+        invalidate_verifications(conn, product_id, qr_code)
 
         return jsonify({'message': 'Distributor record added successfully'}), 201
 
@@ -281,24 +492,44 @@ def add_retailer_record():
         if not all([qr_code, shop_name, final_price, retail_location]):
             return jsonify({'error': 'Missing required fields'}), 400
 
+        (latitude, longitude), error = geo.parse_coordinates(data.get('latitude'), data.get('longitude'))
+        if error:
+            return jsonify({'error': error}), 400
+        expiry_date, error = expiry.parse_expiry_date(data.get('expiry_date'))
+        if error:
+            return jsonify({'error': error}), 400
+
         conn = get_db_connection()
 
         # Find product
-        product = conn.execute('SELECT id FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
+        product = conn.execute('SELECT id, consumed_at FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
         if not product:
             return jsonify({'error': 'Invalid QR code'}), 404
+        if product['consumed_at']:
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
 
         product_id = product['id']
 
+        # Lots merged into this one, if any
+        parents, error = read_parent_lots(conn, data, product_id)
+        if error:
+            return jsonify({'error': error}), 400
+
         # Insert retailer record
         conn.execute('''INSERT INTO retailer_records 
-                       (product_id, retailer_id, shop_name, final_price, retail_location)
-                       VALUES (?, ?, ?, ?, ?)''',
-                    (product_id, session['user_id'], shop_name, final_price, retail_location))
-
-        # Update product stage
-        conn.execute('UPDATE products SET current_stage = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                    ('retailer', product_id))
+                       (product_id, retailer_id, shop_name, final_price, retail_location,
+                        latitude, longitude, geohash, expiry_date)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (product_id, session['user_id'], shop_name, final_price, retail_location,
+                     latitude, longitude, geo.geohash(latitude, longitude), expiry_date))
+        lots.link_lots(conn, product_id, parents)
+
+        # Update product stage, unless a concurrent split or merge used the lot up
+        updated = conn.execute('''UPDATE products SET current_stage = ?, updated_at = CURRENT_TIMESTAMP
+                                  WHERE id = ? AND consumed_at IS NULL''', ('retailer', product_id)).rowcount
+        if not updated or not lots.consume_lots(conn, [parent_id for parent_id, _ in parents]):
+            conn.rollback()
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
 
         # Add to supply chain tracking
         conn.execute('''INSERT INTO supply_chain_tracking 
@@ -306,149 +537,985 @@ def add_retailer_record():
                        VALUES (?, ?, ?, ?, ?)''',
                     (product_id, 'retailer', session['user_id'], 'Retailer Record Added',
                      json.dumps(data)))
+        ledger.chain_events(conn, [product_id])
 
         conn.commit()
-        conn.close()
+        invalidate_verifications(conn, product_id, qr_code)
+        expiry.scheduler.notify(expiry_date)
 
         return jsonify({'message': 'Retailer record added successfully'}), 201
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/verify-product/<qr_code>', methods=['GET'])
-def verify_product(qr_code):
-    """Verify product and get complete supply chain information"""
+def read_parent_lots(conn, data, child_id=None):
+    """Resolve a request's optional parent_lots to [(parent_id, quantity)]; returns (parents, error)
+
+    Entries are QR codes or {"qr_code": ..., "quantity": ...} objects.
+    """
+    entries = data.get('parent_lots') or []
+    if not isinstance(entries, list):
+        return None, 'parent_lots must be a list'
+    wanted = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'qr_code': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('qr_code'), str):
+            return None, 'parent_lots entries must be QR codes or objects with a qr_code'
+        wanted.append((entry['qr_code'], entry.get('quantity')))
+
+    found = lots.find_lots(conn, list(dict.fromkeys(qr_code for qr_code, _ in wanted)))
+    unknown = [qr_code for qr_code, _ in wanted if qr_code not in found]
+    if unknown:
+        return None, f"Unknown parent lot(s): {', '.join(unknown)}"
+    consumed = [qr_code for qr_code in found if found[qr_code]['consumed_at']]
+    if consumed:
+        return None, f"Lot(s) already split or merged: {', '.join(consumed)}"
+    # A lot named twice is linked once, with the first quantity given; without
+    # one, the whole lot went in, since it is used up either way
+    parents = {}
+    for qr_code, quantity in wanted:
+        parent_id = found[qr_code]['id']
+        if parent_id not in parents and quantity is None:
+            available = lots.lot_quantity(conn, parent_id)
+            quantity = f'{available:g}' if available is not None else None
+        parents.setdefault(parent_id, quantity)
+    parents = list(parents.items())
+    if child_id is not None and any(lots.creates_cycle(conn, parent_id, child_id) for parent_id, _ in parents):
+        return None, 'A lot cannot descend from itself'
+    # Otherwise the descendant's share would be counted twice
+    if len(parents) > 1 and lots.related_lots(conn, [parent_id for parent_id, _ in parents]):
+        return None, 'parent_lots cannot include a lot together with one made from it'
+    return parents, None
+
+def invalidate_verifications(conn, product_id, qr_code):
+    """Drop this worker's cached verification of a lot and of every lot made from it
+
+    Other workers notice the change through the product versions (see current_versions).
+    """
+    verify_cache.invalidate(qr_code)
+    for descendant in lots.descendant_qr_codes(conn, product_id):
+        verify_cache.invalidate(descendant)
+
+def create_lot(conn, source, product_name=None):
+    """Insert a new lot carrying over a source lot's product details; returns (product_id, qr_code)"""
+    qr_code = generate_qr_code()
+    cursor = conn.execute('''INSERT INTO products
+                            (qr_code, product_name, category, description, current_stage)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (qr_code, product_name or source['product_name'], source['category'],
+                          source['description'], source['current_stage']))
+    return cursor.lastrowid, qr_code
+
+LOT_ROLES = ('farmer', 'distributor', 'retailer')
+
+@app.route('/api/lots/split', methods=['POST'])
+def split_lot():
+    """Split a lot into smaller lots, each with its own QR code"""
     try:
+        if 'user_id' not in session or session.get('role') not in LOT_ROLES:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        data = request.json
+        qr_code = data.get('qr_code')
+        quantities = data.get('quantities')
+
+        if not qr_code or not isinstance(quantities, list) or not quantities:
+            return jsonify({'error': 'Missing required fields'}), 400
+        if len(quantities) > MAX_BULK_PRODUCTS:
+            return jsonify({'error': f'At most {MAX_BULK_PRODUCTS} lots per split'}), 413
+
         conn = get_db_connection()
 
-        # Get product information
-        product = conn.execute('SELECT * FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
-        if not product:
+        parent = lots.find_lots(conn, [qr_code]).get(qr_code)
+        if not parent:
             return jsonify({'error': 'Invalid QR code'}), 404
+        if parent['consumed_at']:
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
+
+        amounts = [lots.parse_quantity(quantity) for quantity in quantities]
+        if None in amounts:
+            return jsonify({'error': 'quantities must be positive numbers'}), 400
+        available = lots.lot_quantity(conn, parent['id'])
+        if available is not None and sum(amounts) > available * (1 + 1e-9):
+            return jsonify({'error': f'quantities add up to {sum(amounts):g}, more than the lot holds ({available:g})'}), 400
+
+        children = []
+        for quantity in quantities:
+            child_id, child_qr_code = create_lot(conn, parent)
+            lots.link_lots(conn, child_id, [(parent['id'], quantity)])
+            children.append({'product_id': child_id, 'qr_code': child_qr_code, 'quantity': quantity,
+                             'qr_image_url': f'/api/qr/{child_qr_code}.png'})
+
+        # Both sides of the split appear in the tracking history
+        events = [(child['product_id'], session['role'], session['user_id'], 'Lot Split',
+                   json.dumps({'split_from': qr_code, 'quantity': child['quantity']}))
+                  for child in children]
+        events.append((parent['id'], session['role'], session['user_id'], 'Lot Split Into',
+                       json.dumps({'lots': [child['qr_code'] for child in children],
+                                   'quantities': quantities})))
+        conn.executemany('''INSERT INTO supply_chain_tracking
+                            (product_id, stage, user_id, action, details)
+                            VALUES (?, ?, ?, ?, ?)''', events)
+        if not lots.consume_lots(conn, [parent['id']]):
+            conn.rollback()
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
+        ledger.chain_events(conn, [product_id for product_id, *_ in events])
 
-        product_id = product['id']
+        conn.commit()
+        invalidate_verifications(conn, parent['id'], qr_code)
+
+        return jsonify({
+            'message': f'Lot split into {len(children)} lots',
+            'lots': children
+        }), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lots/merge', methods=['POST'])
+def merge_lots():
+    """Merge several lots into a new lot with its own QR code"""
+    try:
+        if 'user_id' not in session or session.get('role') not in LOT_ROLES:
+            return jsonify({'error': 'Authentication required'}), 401
 
-        # Get farmer record
-        farmer_record = conn.execute('''
-            SELECT fr.*, u.full_name as farmer_name 
-            FROM farmer_records fr 
-            JOIN users u ON fr.farmer_id = u.id 
-            WHERE fr.product_id = ?
-        ''', (product_id,)).fetchone()
-
-        # Get distributor record
-        distributor_record = conn.execute('''
-            SELECT dr.*, u.full_name as distributor_user_name 
-            FROM distributor_records dr 
-            JOIN users u ON dr.distributor_id = u.id 
-            WHERE dr.product_id = ?
-        ''', (product_id,)).fetchone()
-
-        # Get retailer record
-        retailer_record = conn.execute('''
-            SELECT rr.*, u.full_name as retailer_user_name 
-            FROM retailer_records rr 
-            JOIN users u ON rr.retailer_id = u.id 
-            WHERE rr.product_id = ?
-        ''', (product_id,)).fetchone()
-
-        # Get supply chain tracking
-        tracking = conn.execute('''
-            SELECT st.*, u.full_name as user_name 
-            FROM supply_chain_tracking st 
-            JOIN users u ON st.user_id = u.id 
-            WHERE st.product_id = ? 
-            ORDER BY st.timestamp ASC
-        ''', (product_id,)).fetchall()
-
-        conn.close()
-
-        # Format response
-        result = {
+        data = request.json
+        conn = get_db_connection()
+
+        parents, error = read_parent_lots(conn, data)
+        if error:
+            return jsonify({'error': error}), 400
+        if len(parents) < 2:
+            return jsonify({'error': 'parent_lots must name at least two lots'}), 400
+
+        # The merged lot takes its product details from the first parent
+        qr_codes = list(dict.fromkeys(entry if isinstance(entry, str) else entry['qr_code']
+                                      for entry in data['parent_lots']))
+        source = lots.find_lots(conn, qr_codes[:1])[qr_codes[0]]
+        product_id, qr_code = create_lot(conn, source, data.get('product_name'))
+        lots.link_lots(conn, product_id, parents)
+
+        events = [(product_id, session['role'], session['user_id'], 'Lots Merged',
+                   json.dumps({'merged_from': qr_codes}))]
+        events += [(parent_id, session['role'], session['user_id'], 'Lot Merged Into',
+                    json.dumps({'lot': qr_code, 'quantity': quantity}))
+                   for parent_id, quantity in parents]
+        conn.executemany('''INSERT INTO supply_chain_tracking
+                            (product_id, stage, user_id, action, details)
+                            VALUES (?, ?, ?, ?, ?)''', events)
+        parent_ids = [parent_id for parent_id, _ in parents]
+        if not lots.consume_lots(conn, parent_ids):
+            conn.rollback()
+            return jsonify({'error': LOT_CONSUMED_ERROR}), 409
+        ledger.chain_events(conn, [product_id] + parent_ids)
+
+        conn.commit()
+        for parent_id, parent_qr_code in zip(parent_ids, qr_codes):
+            invalidate_verifications(conn, parent_id, parent_qr_code)
+
+        return jsonify({
+            'message': f'{len(parent_ids)} lots merged successfully',
             'qr_code': qr_code,
-            'product_name': product['product_name'],
-            'category': product['category'],
-            'current_stage': product['current_stage'],
-            'farmer': dict(farmer_record) if farmer_record else None,
-            'distributor': dict(distributor_record) if distributor_record else None,
-            'retailer': dict(retailer_record) if retailer_record else None,
-            'tracking': [dict(row) for row in tracking]
+            'qr_image_url': f'/api/qr/{qr_code}.png',
+            'product_id': product_id
+        }), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lots/<qr_code>/recall', methods=['GET'])
+def recall_lot(qr_code):
+    """Every lot made, directly or not, from a lot; ?stage=retailer lists the shelves to clear"""
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        conn = get_db_connection()
+        lot = lots.find_lots(conn, [qr_code]).get(qr_code)
+        if not lot:
+            return jsonify({'error': 'Invalid QR code'}), 404
+
+        affected = lots.recall(conn, lot['id'], request.args.get('stage'))
+        return jsonify({
+            'qr_code': qr_code,
+            'affected': affected,
+            'count': len(affected)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Verification queries per schema ('main', or 'archive' for archived chains), built once from the live table definitions
+verification_sql = {}
+
+def json_object_sql(conn, table, alias, extra_columns=(), overrides=None):
+    """Build a json_object(...) expression over every column of a table"""
+    overrides = overrides or {}
+    columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+    pairs = [f"'{name}', {overrides.get(name, f'{alias}.{name}')}" for name in columns]
+    pairs += [f"'{name}', {expr}" for name, expr in extra_columns]
+    return f"json_object({', '.join(pairs)})"
+
+def build_verification_sql(conn, schema='main'):
+    """Build the statement that fetches products and their whole chains (callers add the WHERE)"""
+    farmer = json_object_sql(conn, 'farmer_records', 'fr', [('farmer_name', 'u.full_name')])
+    distributor = json_object_sql(conn, 'distributor_records', 'dr',
+                                  [('distributor_user_name', 'u.full_name')])
+    retailer = json_object_sql(conn, 'retailer_records', 'rr',
+                               [('retailer_user_name', 'u.full_name')])
+    # Embed details as JSON rather than as a JSON-encoded string
+    tracking = json_object_sql(conn, 'supply_chain_tracking', 'st', [('user_name', 'st.user_name')],
+                               {'details': 'CASE WHEN json_valid(st.details) THEN json(st.details) '
+                                           'ELSE st.details END'})
+
+    def chain(alias, schema):
+        """Stage records and tracking history of the product aliased `alias`, stored in `schema`"""
+        return {
+            'farmer': f'''(SELECT {farmer} FROM {schema}.farmer_records fr
+                            JOIN users u ON fr.farmer_id = u.id
+                            WHERE fr.product_id = {alias}.id LIMIT 1)''',
+            'distributor': f'''(SELECT {distributor} FROM {schema}.distributor_records dr
+                                 JOIN users u ON dr.distributor_id = u.id
+                                 WHERE dr.product_id = {alias}.id LIMIT 1)''',
+            'retailer': f'''(SELECT {retailer} FROM {schema}.retailer_records rr
+                              JOIN users u ON rr.retailer_id = u.id
+                              WHERE rr.product_id = {alias}.id LIMIT 1)''',
+            'tracking': f'''(SELECT json_group_array({tracking}) FROM (
+                                SELECT t.*, u.full_name AS user_name
+                                FROM {schema}.supply_chain_tracking t
+                                JOIN users u ON t.user_id = u.id
+                                WHERE t.product_id = {alias}.id
+                                ORDER BY t.timestamp ASC
+                             ) st)''',
         }
 
-        # Log customer verification
+    product = chain('p', schema)
+    # Lots with lineage are never archived, so ancestors are always hot
+    ancestor = chain('a', 'main')
+    return f'''
+        SELECT p.*,
+            {product['farmer']} AS farmer_json,
+            {product['distributor']} AS distributor_json,
+            {product['retailer']} AS retailer_json,
+            {product['tracking']} AS tracking_json,
+            (SELECT json_group_array(json(lot)) FROM (
+                SELECT json_object('qr_code', a.qr_code, 'product_name', a.product_name,
+                                   'category', a.category, 'current_stage', a.current_stage,
+                                   'depth', l.depth,
+                                   'farmer', json({ancestor['farmer']}),
+                                   'distributor', json({ancestor['distributor']}),
+                                   'retailer', json({ancestor['retailer']}),
+                                   'tracking', json({ancestor['tracking']})) AS lot
+                FROM lot_lineage l
+                JOIN main.products a ON a.id = l.ancestor_id
+                WHERE l.descendant_id = p.id
+                ORDER BY l.depth, a.id
+             )) AS upstream_json
+        FROM {schema}.products p
+    '''
+
+def get_verification_sql(conn, schema='main'):
+    if schema not in verification_sql:
+        verification_sql[schema] = build_verification_sql(conn, schema)
+    return verification_sql[schema]
+
+def format_verification(product):
+    """Turn a row from the verification statement into the verify-product payload"""
+    farmer_json = product['farmer_json']
+    distributor_json = product['distributor_json']
+    retailer_json = product['retailer_json']
+    retailer = json.loads(retailer_json) if retailer_json else None
+
+    return {
+        'qr_code': product['qr_code'],
+        'product_name': product['product_name'],
+        'category': product['category'],
+        'current_stage': product['current_stage'],
+        'updated_at': product['updated_at'],
+        'farmer': json.loads(farmer_json) if farmer_json else None,
+        'distributor': json.loads(distributor_json) if distributor_json else None,
+        'retailer': retailer,
+        # Set once the expiry scheduler has marked the retail lot
+        'expired': bool(retailer and retailer.get('expired_at')),
+        'tracking': json.loads(product['tracking_json']),
+        # Every lot this one was split or merged from, nearest first
+        'upstream': json.loads(product['upstream_json'])
+    }
+
+def load_verification(conn, qr_code):
+    """Assemble the verification payload for a QR code; returns (product_id, result) or None"""
+    # Product, stage records and tracking history in one round trip
+    product = conn.execute(get_verification_sql(conn) + ' WHERE p.qr_code = ?', (qr_code,)).fetchone()
+    if not product and archive.attach(conn):
+        # Completed chains moved out of the hot database
+        product = conn.execute(get_verification_sql(conn, 'archive') + ' WHERE p.qr_code = ?',
+                               (qr_code,)).fetchone()
+    if not product:
+        return None
+    return product['id'], format_verification(product)
+
+def load_verifications(conn, qr_codes):
+    """Assemble payloads for many QR codes with set-based lookups; returns {qr_code: (product_id, result)}"""
+    found = {}
+    for schema in ('main', 'archive'):
+        missing = [qr_code for qr_code in qr_codes if qr_code not in found]
+        if not missing or (schema == 'archive' and not archive.attach(conn)):
+            break
+        sql = get_verification_sql(conn, schema)
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for product in conn.execute(f'{sql} WHERE p.qr_code IN ({placeholders})', chunk):
+                found[product['qr_code']] = (product['id'], format_verification(product))
+    return found
+
+def current_versions(conn, qr_codes):
+    """{qr_code: (product_id, version)} of hot and archived products, from indexed lookups only
+
+    The version moves with every write that changes a verification payload:
+    the product's version counter (bumped on every update, see
+    migrations/0014_product_versions.sql), its upstream lots' (expiry, later
+    splits) and the newest tracking event here or upstream. Cached payloads are
+    checked against it, so writes made by another worker are seen at once.
+    Archived chains have no lineage and no longer change; their version is
+    marked as archived so it never matches the one the product had while hot.
+    """
+    versions = {}
+    for start in range(0, len(qr_codes), 500):
+        chunk = qr_codes[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'''
+                SELECT p.id, p.qr_code, p.version,
+                       (SELECT SUM(a.version) FROM lot_lineage l JOIN products a ON a.id = l.ancestor_id
+                        WHERE l.descendant_id = p.id) AS upstream_version,
+                       max(COALESCE((SELECT MAX(id) FROM supply_chain_tracking WHERE product_id = p.id), 0),
+                           COALESCE((SELECT MAX(st.id) FROM lot_lineage l
+                                     JOIN supply_chain_tracking st ON st.product_id = l.ancestor_id
+                                     WHERE l.descendant_id = p.id), 0)) AS last_event_id
+                FROM products p WHERE p.qr_code IN ({placeholders})''', chunk):
+            versions[row['qr_code']] = (row['id'], (row['version'], row['upstream_version'],
+                                                    row['last_event_id']))
+
+    missing = [qr_code for qr_code in qr_codes if qr_code not in versions]
+    if not missing or not archive.attach(conn):
+        return versions
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'''
+                SELECT p.id, p.qr_code, p.version,
+                       (SELECT MAX(id) FROM archive.supply_chain_tracking WHERE product_id = p.id) AS last_event_id
+                FROM archive.products p WHERE p.qr_code IN ({placeholders})''', chunk):
+            versions[row['qr_code']] = (row['id'], ('archived', row['version'], row['last_event_id']))
+    return versions
+
+@app.route('/api/verify-product/<qr_code>', methods=['GET'])
+def verify_product(qr_code):
+    """Verify product and get complete supply chain information"""
+    try:
+        fields = responses.requested_fields()
+        conn = get_db_connection()
+        product_id, version = current_versions(conn, [qr_code]).get(qr_code, (None, None))
+        etag = verification_etag(qr_code, version)
+
+        verification = None
+        if not (version and request.if_none_match.contains_weak(etag)):
+            # Serve repeated scans from the read-through cache while the product is unchanged
+            cached = verify_cache.get(qr_code)
+            if cached is not None and cached[2] == version:
+                verification = cached
+            else:
+                loaded = load_verification(conn, qr_code)
+                if loaded is None:
+                    return jsonify({'error': 'Invalid QR code'}), 404
+                verification = (*loaded, version)
+                verify_cache.set(qr_code, verification)
+            product_id, result, _ = verification
+
+        # Log customer verification through the write-behind buffer
         if 'user_id' in session:
+            verification_log.put((product_id, session['user_id'],
+                                  datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')))
+
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify(responses.select_fields(result, fields))
+        response.set_etag(etag, weak=True)
+        # Scanners may keep the payload but must revalidate it
+        response.cache_control.no_cache = True
+        return response
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def verification_etag(qr_code, version):
+    """ETag of a verify-product response, derived from the product's version"""
+    return responses.etag_for(qr_code, *(version or ()), request.args.get('fields', ''))
+
+def send_qr_image(qr_code, fmt):
+    """Serve a rendered QR image with a strong ETag and long-lived caching"""
+    try:
+        box_size = request.args.get('size', qr_images.DEFAULT_BOX_SIZE, type=int)
+        if not qr_images.MIN_BOX_SIZE <= box_size <= qr_images.MAX_BOX_SIZE:
+            return jsonify({'error': 'Invalid size'}), 400
+
+        image = qr_images.get_qr_image(qr_code, fmt, box_size, render=False)
+        if image is None:
+            # Only render images for products that actually exist
             conn = get_db_connection()
-            conn.execute('''INSERT INTO customer_transactions 
-                           (product_id, customer_id, verification_date)
-                           VALUES (?, ?, CURRENT_TIMESTAMP)''',
-                        (product_id, session['user_id']))
-            conn.commit()
-            conn.close()
+            product = conn.execute('SELECT id FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
+            if not product:
+                return jsonify({'error': 'Invalid QR code'}), 404
+            image = qr_images.get_qr_image(qr_code, fmt, box_size)
+
+        data, etag = image
+        response = make_response(data)
+        response.mimetype = qr_images.MIMETYPES[fmt]
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/qr/<qr_code>.png', methods=['GET'])
+def get_qr_png(qr_code):
+    """Get QR code image as PNG"""
+    return send_qr_image(qr_code, 'png')
+
+@app.route('/api/qr/<qr_code>.svg', methods=['GET'])
+def get_qr_svg(qr_code):
+    """Get QR code image as SVG"""
+    return send_qr_image(qr_code, 'svg')
+
+MAX_BATCH_VERIFY = int(os.environ.get('KRISHICHAIN_MAX_BATCH_VERIFY', 500))
+
+@app.route('/api/verify-products', methods=['POST'])
+def verify_products():
+    """Verify many products in one request, e.g. a whole pallet"""
+    try:
+        data = request.get_json(silent=True)
+        qr_codes = data.get('qr_codes') if isinstance(data, dict) else data
+        if not isinstance(qr_codes, list) or not qr_codes:
+            return jsonify({'error': 'Expected a non-empty list of qr_codes'}), 400
+        if not all(isinstance(qr_code, str) for qr_code in qr_codes):
+            return jsonify({'error': 'qr_codes must be strings'}), 400
+        qr_codes = list(dict.fromkeys(qr_codes))
+        if len(qr_codes) > MAX_BATCH_VERIFY:
+            return jsonify({'error': f'At most {MAX_BATCH_VERIFY} QR codes per request'}), 413
+
+        # Serve what we can from the cache, then resolve the rest in one set-based query
+        conn = get_db_connection()
+        versions = current_versions(conn, qr_codes)
+        verifications = {}
+        missing = []
+        for qr_code in qr_codes:
+            version = versions.get(qr_code, (None, None))[1]
+            cached = verify_cache.get(qr_code)
+            if cached is not None and cached[2] == version:
+                verifications[qr_code] = cached[:2]
+            else:
+                missing.append(qr_code)
+        if missing:
+            loaded = load_verifications(conn, missing)
+            for qr_code, verification in loaded.items():
+                verify_cache.set(qr_code, (*verification, versions.get(qr_code, (None, None))[1]))
+            verifications.update(loaded)
+
+        fields = responses.requested_fields()
+        results = {}
+        not_found = []
+        for qr_code in qr_codes:
+            if qr_code in verifications:
+                results[qr_code] = responses.select_fields(verifications[qr_code][1], fields)
+            else:
+                results[qr_code] = {'error': 'Invalid QR code'}
+                not_found.append(qr_code)
+
+        # Log customer verification through the write-behind buffer
+        if 'user_id' in session:
+            verified_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            for product_id, _ in verifications.values():
+                verification_log.put((product_id, session['user_id'], verified_at))
 
-        return jsonify(result), 200
+        return jsonify({
+            'results': results,
+            'found': len(qr_codes) - len(not_found),
+            'not_found': not_found
+        }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+@app.route('/api/products/search', methods=['GET'])
+def search_products():
+    """Full-text product search over names, categories, descriptions and farm details"""
+    try:
+        text = request.args.get('q', '').strip()
+        if not search.fts_query(text):
+            return jsonify({'error': 'Search query q is required'}), 400
+
+        limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+        if not 1 <= limit <= SEARCH_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {SEARCH_MAX_LIMIT}'}), 400
+        # Deep pages are not served; refine the query instead
+        max_results = search.RANK_CANDIDATES
+        offset = request.args.get('offset', 0, type=int)
+        if not 0 <= offset < max_results:
+            return jsonify({'error': f'offset must be between 0 and {max_results - 1}'}), 400
+        limit = min(limit, max_results - offset)
+
+        # Fetch one extra row to know whether there is another page
+        results, order = search.search_products(get_db_connection(), text, limit + 1, offset)
+        next_offset = None
+        if len(results) > limit:
+            results = results[:limit]
+            if offset + limit < max_results:
+                next_offset = offset + limit
+
+        return jsonify({
+            'query': text,
+            'order': order,
+            'results': responses.select_fields(results, responses.requested_fields()),
+            'next_offset': next_offset
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+EXPIRING_DEFAULT_DAYS = 7
+EXPIRING_MAX_DAYS = 365
+EXPIRED_DEFAULT_DAYS = 30
+EXPIRING_DEFAULT_LIMIT = 100
+EXPIRING_MAX_LIMIT = 1000
+
+@app.route('/api/retailer/expiring', methods=['GET'])
+def expiring_lots():
+    """The retailer's lots on the shelf expiring within `days` or expired within `expired_days`"""
+    try:
+        if 'user_id' not in session or session.get('role') != 'retailer':
+            return jsonify({'error': 'Authentication required'}), 401
+
+        days = request.args.get('days', EXPIRING_DEFAULT_DAYS, type=int)
+        if not 0 <= days <= EXPIRING_MAX_DAYS:
+            return jsonify({'error': f'days must be between 0 and {EXPIRING_MAX_DAYS}'}), 400
+        expired_days = request.args.get('expired_days', EXPIRED_DEFAULT_DAYS, type=int)
+        if not 0 <= expired_days <= EXPIRING_MAX_DAYS:
+            return jsonify({'error': f'expired_days must be between 0 and {EXPIRING_MAX_DAYS}'}), 400
+        limit = request.args.get('limit', EXPIRING_DEFAULT_LIMIT, type=int)
+        if not 1 <= limit <= EXPIRING_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {EXPIRING_MAX_LIMIT}'}), 400
+
+        results = expiry.expiring_lots(get_db_connection(), session['user_id'], days, expired_days, limit)
+        return jsonify({
+            'days': days,
+            'expired_days': expired_days,
+            'expired': sum(1 for result in results if result['expired']),
+            'expiring': sum(1 for result in results if not result['expired']),
+            'results': responses.select_fields(results, responses.requested_fields())
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+NEARBY_DEFAULT_RADIUS_KM = 50
+NEARBY_MAX_RADIUS_KM = float(os.environ.get('KRISHICHAIN_NEARBY_MAX_RADIUS_KM', 200))
+NEARBY_DEFAULT_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+
+@app.route('/api/products/nearby', methods=['GET'])
+def nearby_products():
+    """Products whose farm, storage or retail location lies within radius_km of lat/lon, nearest first"""
+    try:
+        (latitude, longitude), error = geo.parse_coordinates(request.args.get('lat'), request.args.get('lon'))
+        if error:
+            return jsonify({'error': error}), 400
+        if latitude is None:
+            return jsonify({'error': 'lat and lon are required'}), 400
+
+        radius_km = request.args.get('radius_km', NEARBY_DEFAULT_RADIUS_KM, type=float)
+        # Written so NaN fails too
+        if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+            return jsonify({'error': f'radius_km must be more than 0 and at most {NEARBY_MAX_RADIUS_KM:g}'}), 400
+        kind = request.args.get('kind', 'farm')
+        if kind not in geo.LOCATION_KINDS:
+            return jsonify({'error': f"kind must be one of: {', '.join(geo.LOCATION_KINDS)}"}), 400
+        limit = request.args.get('limit', NEARBY_DEFAULT_LIMIT, type=int)
+        if not 1 <= limit <= NEARBY_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {NEARBY_MAX_LIMIT}'}), 400
+
+        results = geo.nearby(get_db_connection(), kind, latitude, longitude, radius_km, limit)
+        return jsonify({
+            'kind': kind,
+            'latitude': latitude,
+            'longitude': longitude,
+            'radius_km': radius_km,
+            'results': responses.select_fields(results, responses.requested_fields())
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+DASHBOARD_DEFAULT_LIMIT = 100
+DASHBOARD_MAX_LIMIT = 1000
+
+# role -> (record table, alias, owner column, extra record columns)
+DASHBOARD_QUERIES = {
+    'farmer': ('farmer_records', 'fr', 'farmer_id',
+               'fr.quantity, fr.farmer_price, fr.harvest_date'),
+    'distributor': ('distributor_records', 'dr', 'distributor_id',
+                    'dr.distributor_name, dr.transport_date, dr.storage_location'),
+    'retailer': ('retailer_records', 'rr', 'retailer_id',
+                 'rr.shop_name, rr.final_price, rr.retail_location'),
+}
+
+def encode_cursor(*values):
+    """Encode keyset values as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a dashboard cursor into (created_at, id); raises ValueError if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+    # Valid JSON of another shape would otherwise fail later, in the query
+    if (not isinstance(values, list) or len(values) != 2 or not isinstance(values[0], str)
+            or not isinstance(values[1], int) or isinstance(values[1], bool)):
+        raise ValueError('Invalid cursor')
+    return values
+
 @app.route('/api/dashboard/<role>', methods=['GET'])
 def get_dashboard(role):
-    """Get dashboard data for specific role"""
+    """Get dashboard data for specific role, newest first, one keyset page at a time"""
     try:
         if 'user_id' not in session or session.get('role') != role:
             return jsonify({'error': 'Authentication required'}), 401
 
-        conn = get_db_connection()
-        user_id = session['user_id']
-
-        if role == 'farmer':
-            products = conn.execute('''
-                SELECT p.*, fr.quantity, fr.farmer_price, fr.harvest_date
-                FROM products p 
-                JOIN farmer_records fr ON p.id = fr.product_id
-                WHERE fr.farmer_id = ?
-                ORDER BY p.created_at DESC
-            ''', (user_id,)).fetchall()
-
-        elif role == 'distributor':
-            products = conn.execute('''
-                SELECT p.*, dr.distributor_name, dr.transport_date, dr.storage_location
-                FROM products p 
-                JOIN distributor_records dr ON p.id = dr.product_id
-                WHERE dr.distributor_id = ?
-                ORDER BY dr.created_at DESC
-            ''', (user_id,)).fetchall()
-
-        elif role == 'retailer':
-            products = conn.execute('''
-                SELECT p.*, rr.shop_name, rr.final_price, rr.retail_location
-                FROM products p 
-                JOIN retailer_records rr ON p.id = rr.product_id
-                WHERE rr.retailer_id = ?
-                ORDER BY rr.created_at DESC
-            ''', (user_id,)).fetchall()
+        if role not in DASHBOARD_QUERIES:
+            return jsonify({'products': [], 'next_cursor': None}), 200
+
+        limit = request.args.get('limit', DASHBOARD_DEFAULT_LIMIT, type=int)
+        if not 1 <= limit <= DASHBOARD_MAX_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {DASHBOARD_MAX_LIMIT}'}), 400
+
+        table, alias, owner_column, columns = DASHBOARD_QUERIES[role]
+        conditions = [f'{alias}.{owner_column} = ?']
+        params = [session['user_id']]
 
+        # Resume strictly after the last row of the previous page
+        after = request.args.get('after')
+        if after:
+            try:
+                after_created_at, after_id = decode_cursor(after)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            conditions.append(f'({alias}.created_at, {alias}.id) < (?, ?)')
+            params += [after_created_at, after_id]
+
+        # Optional filters
+        if request.args.get('stage'):
+            conditions.append('p.current_stage = ?')
+            params.append(request.args['stage'])
+        if request.args.get('category'):
+            conditions.append('p.category = ?')
+            params.append(request.args['category'])
+        if request.args.get('from'):
+            conditions.append(f'{alias}.created_at >= ?')
+            params.append(request.args['from'])
+        if request.args.get('to'):
+            # Inclusive of the whole end day when only a date is given
+            conditions.append(f"{alias}.created_at < date(?, '+1 day')"
+                              if len(request.args['to']) == 10 else f'{alias}.created_at <= ?')
+            params.append(request.args['to'])
+
+        conn = get_db_connection()
+        if archive.attach(conn):
+            # Archived chains stay on the dashboard: SQLite merges each side's index range.
+            # Product columns are listed in hot order, since the archive may have added them in another
+            product_columns = ', '.join(f"p.{row['name']}" for row in conn.execute('PRAGMA main.table_info(products)'))
+            branches = []
+            for schema in ('main', 'archive'):
+                where = list(conditions)
+                if schema == 'archive':
+                    # An archive run copies rows before deleting them; skip the ones still hot
+                    where.append('NOT EXISTS (SELECT 1 FROM main.products hp WHERE hp.id = p.id)')
+                branches.append(f'''SELECT {product_columns}, {columns},
+                                           {alias}.id AS record_id, {alias}.created_at AS record_created_at
+                                    FROM {schema}.{table} {alias}
+                                    JOIN {schema}.products p ON p.id = {alias}.product_id
+                                    WHERE {' AND '.join(where)}''')
+            products = conn.execute(f'''{' UNION ALL '.join(branches)}
+                                        ORDER BY record_created_at DESC, record_id DESC
+                                        LIMIT ?''', params * 2 + [limit + 1]).fetchall()
         else:
-            products = []
+            products = conn.execute(f'''
+                SELECT p.*, {columns},
+                       {alias}.id AS record_id, {alias}.created_at AS record_created_at
+                FROM {table} {alias}
+                JOIN products p ON p.id = {alias}.product_id
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {alias}.created_at DESC, {alias}.id DESC
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            next_cursor = encode_cursor(last['record_created_at'], last['record_id'])
 
-        conn.close()
+        return jsonify({
+            'products': responses.select_fields([dict(row) for row in products],
+                                                responses.requested_fields()),
+            'next_cursor': next_cursor
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+@app.route('/api/export/tracking', methods=['GET'])
+def export_tracking():
+    """Stream supply chain history with its stage records as NDJSON or CSV"""
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_MIMETYPES:
+            return jsonify({'error': f"format must be one of {', '.join(EXPORT_MIMETYPES)}"}), 400
+
+        conditions = []
+        params = []
+        if request.args.get('from'):
+            conditions.append('st.timestamp >= ?')
+            params.append(request.args['from'])
+        if request.args.get('to'):
+            # Inclusive of the whole end day when only a date is given
+            conditions.append("st.timestamp < date(?, '+1 day')"
+                              if len(request.args['to']) == 10 else 'st.timestamp <= ?')
+            params.append(request.args['to'])
+        if request.args.get('farmer_id'):
+            farmer_id = request.args.get('farmer_id', type=int)
+            if farmer_id is None:
+                return jsonify({'error': 'farmer_id must be an integer'}), 400
+            conditions.append('st.product_id IN (SELECT product_id FROM {schema}.farmer_records WHERE farmer_id = ?)')
+            params.append(farmer_id)
+
+        # Resume after the last event a previous, interrupted export delivered
+        after = ('', 0)
+        after_id = request.args.get('after_id', type=int)
+        if request.args.get('after_id') and after_id is None:
+            return jsonify({'error': 'after_id must be an integer'}), 400
+        if after_id is not None:
+            conn = get_db_connection()
+            event = conn.execute('SELECT timestamp FROM supply_chain_tracking WHERE id = ?', (after_id,)).fetchone()
+            if not event and archive.attach(conn):
+                event = conn.execute('SELECT timestamp FROM archive.supply_chain_tracking WHERE id = ?',
+                                     (after_id,)).fetchone()
+            if not event:
+                return jsonify({'error': 'Unknown after_id'}), 400
+            after = (event['timestamp'], after_id)
+
+        # Rows are read and encoded as the client consumes them, on a connection of the export's own
+        compress = 'gzip' in request.accept_encodings
+        response = Response(export.generate_export(DATABASE, fmt, conditions, params, after, compress),
+                            mimetype=EXPORT_MIMETYPES[fmt])
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.headers['Content-Disposition'] = f'attachment; filename=tracking.{fmt}'
+        # Ask proxies to pass the stream through instead of buffering it
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Roles whose stage tracking events are recorded under; customers only verify products
+STREAM_ROLES = ['farmer', 'distributor', 'retailer']
+
+@app.route('/api/events/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events feed of new tracking events, filtered by role, user or product"""
+    try:
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        role = request.args.get('role')
+        if role and role not in STREAM_ROLES:
+            return jsonify({'error': f"role must be one of {', '.join(STREAM_ROLES)}"}), 400
+        user_id = request.args.get('user_id', type=int)
+
+        product_id = None
+        qr_code = request.args.get('qr_code')
+        if qr_code:
+            product = get_db_connection().execute('SELECT id FROM products WHERE qr_code = ?',
+                                                  (qr_code,)).fetchone()
+            if not product:
+                return jsonify({'error': 'Invalid QR code'}), 404
+            product_id = product['id']
+
+        # EventSource sends Last-Event-ID when it reconnects; the query parameter covers the first connect
+        after_id = None
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_event_id:
+            try:
+                after_id = int(last_event_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+        # Open streams pin a worker thread under gthread; past the cap, send clients elsewhere or later
+        newest = event_stream.feed.subscribe()
+        if newest is None:
+            response = jsonify({'error': 'Too many open event streams, retry later'})
+            response.headers['Retry-After'] = str(event_stream.RETRY_MS // 1000)
+            return response, 503
+
+        response = Response(event_stream.feed.stream(newest, after_id, role, user_id, product_id),
+                            mimetype='text/event-stream')
+        # The server closes the response even if the client left before the body started
+        response.call_on_close(event_stream.feed.unsubscribe)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Metrics endpoint
+def collect_cache_stats(field):
+    caches = {'verify': verify_cache, 'qr_image': qr_images.memory_cache}
+    return [((name,), cache.stats()[field]) for name, cache in caches.items()]
+
+metrics.registry.register(metrics.Gauge(
+    'krishichain_cache_hits_total', 'In-process cache hits', ('cache',),
+    lambda: collect_cache_stats('hits'), kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_cache_misses_total', 'In-process cache misses', ('cache',),
+    lambda: collect_cache_stats('misses'), kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_cache_entries', 'Entries held by in-process caches', ('cache',),
+    lambda: collect_cache_stats('size')))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_write_behind_rows', 'Verification log rows by state', ('state',),
+    lambda: [((state,), value) for state, value in verification_log.stats().items()]))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_expired_lots_total', 'Retail lots marked expired by this process', (),
+    lambda: [((), expiry.scheduler.expired)], kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_db_pool_idle_connections', 'Idle pooled SQLite connections', (),
+    lambda: [((), db_pool.idle_count())]))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_event_stream_subscribers', 'Open /api/events/stream connections', (),
+    lambda: [((), event_stream.feed.subscriber_count())]))
+metrics.registry.register(metrics.Gauge(
+    'krishichain_event_stream_polls_total', 'Queries made by the shared event feed tail', (),
+    lambda: [((), event_stream.feed.polls)], kind='counter'))
+
+@app.route('/api/analytics/markup', methods=['GET'])
+def markup_analytics():
+    """Farm-to-shelf markup by category, region and harvest month, read from maintained summaries"""
+    try:
+        group_by = [name for name in request.args.get('group_by', 'category').split(',') if name]
+        unknown = [name for name in group_by if name not in analytics.MARKUP_DIMENSIONS]
+        if unknown:
+            return jsonify({'error': f"Cannot group by {', '.join(unknown)}; "
+                                     f"use {', '.join(analytics.MARKUP_DIMENSIONS)}"}), 400
+
+        report = analytics.markup_report(get_db_connection(), list(dict.fromkeys(group_by)),
+                                         category=request.args.get('category'),
+                                         region=request.args.get('region'),
+                                         month_from=request.args.get('from'),
+                                         month_to=request.args.get('to'))
+
+        return jsonify({'group_by': group_by, 'rows': report}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ledger/<qr_code>', methods=['GET'])
+def product_ledger(qr_code):
+    """Recompute a product's hash chain so customers can check it was not altered"""
+    try:
+        conn = get_db_connection()
+        schema = 'main'
+        product = conn.execute('SELECT id FROM products WHERE qr_code = ?', (qr_code,)).fetchone()
+        if not product and archive.attach(conn):
+            schema = 'archive'
+            product = conn.execute('SELECT id FROM archive.products WHERE qr_code = ?', (qr_code,)).fetchone()
+        if not product:
+            return jsonify({'error': 'Invalid QR code'}), 404
+
+        events = ledger.verify_chain(conn, product['id'], schema)
+        for event in events:
+            event['proof_url'] = f"/api/ledger/proof/{event['event_id']}"
 
         return jsonify({
-            'products': [dict(row) for row in products]
+            'qr_code': qr_code,
+            'valid': all(event['valid'] for event in events),
+            'events': events
         }), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ledger/proof/<int:event_id>', methods=['GET'])
+def ledger_proof(event_id):
+    """Merkle inclusion proof for one tracking event"""
+    try:
+        proof = ledger.event_proof(get_db_connection(), event_id)
+        if proof is None:
+            return jsonify({'error': 'Event not found'}), 404
+        if not proof['sealed']:
+            # Chained but not yet part of a sealed batch
+            response = jsonify(proof)
+            response.headers['Retry-After'] = str(int(ledger.SEAL_INTERVAL) or 60)
+            return response, 202
+        return jsonify(proof), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Per-process metrics in Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/slow-queries', methods=['GET'])
+def get_slow_queries():
+    """Slow statement shapes seen by this worker, with their query plans"""
+    if slow_query_log is None:
+        return jsonify({'error': 'Slow query log is disabled; set KRISHICHAIN_SLOW_QUERY_MS'}), 404
+    return jsonify({
+        'threshold_ms': slow_query_log.threshold * 1000,
+        'queries': slow_query_log.summary()
+    }), 200
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'KrishiChain API is running'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'message': 'KrishiChain API is running',
+        'verify_cache': verify_cache.stats(),
+        'verification_log': verification_log.stats()
+    }), 200
 
 def create_app():
     """Application factory function"""
-    if not os.path.exists(DATABASE):
-        init_database()
-        print("Database initialized!")
+    applied = init_database()
+    if applied:
+        print(f"Database migrated ({applied} migration(s) applied)")
     return app
 
 if __name__ == '__main__':
@@ -458,22 +1525,32 @@ if __name__ == '__main__':
     print("- POST /api/login - User login")
     print("- POST /api/logout - User logout")
     print("- POST /api/farmer/register-product - Register product")
+    print("- POST /api/farmer/register-products - Bulk register products (JSON array or CSV)")
     print("- POST /api/distributor/add-record - Add distributor record")
     print("- POST /api/retailer/add-record - Add retailer record")
+    print("- GET /api/retailer/expiring - Lots on the shelf expiring soon or expired (?days=&expired_days=)")
     print("- GET /api/verify-product/<qr_code> - Verify product")
-    print("- GET /api/dashboard/<role> - Get dashboard data")
+    print("- POST /api/lots/split - Split a lot into smaller lots")
+    print("- POST /api/lots/merge - Merge lots into a new lot")
+    print("- GET /api/lots/<qr_code>/recall - Every lot made from a lot (?stage=retailer)")
+    print("- POST /api/verify-products - Verify many products at once")
+    print("- GET /api/analytics/markup - Markup by category, region and month")
+    print("- GET /api/ledger/<qr_code> - Verify a product's hash chain")
+    print("- GET /api/ledger/proof/<event_id> - Merkle inclusion proof for an event")
+    print("- GET /api/qr/<qr_code>.png - QR code image (PNG, ?size=)")
+    print("- GET /api/qr/<qr_code>.svg - QR code image (SVG)")
+    print("- GET /api/products/search - Search products (?q=&limit=&offset=)")
+    print("- GET /api/products/nearby - Products near a point (?lat=&lon=&radius_km=&kind=farm|storage|retail)")
+    print("- GET /api/dashboard/<role> - Get dashboard data (?limit=&after=&stage=&category=&from=&to=)")
+    print("- GET /api/events/stream - Server-Sent Events feed of tracking events (?role=&user_id=&qr_code=)")
+    print("- GET /api/export/tracking - Stream tracking history (?format=ndjson|csv&from=&to=&farmer_id=&after_id=)")
     print("- GET /api/health - Health check")
+    print("- GET /api/metrics - Prometheus metrics")
+    print("- GET /api/debug/slow-queries - Slow query summary (when KRISHICHAIN_SLOW_QUERY_MS is set)")
     
+    print("For production, serve with: gunicorn -c gunicorn.conf.py wsgi:app")
+
+    create_app()
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
     app.run(host='0.0.0.0', port=port, debug=debug)
-
-# Initialize database when module loads
-if not os.path.exists(DATABASE):
-    init_database()
-    print("Database initialized!")
-    
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
-
@@ -0,0 +1,390 @@
+"""Endpoint benchmarks for the KrishiChain API.
+
+Seeds databases at several sizes (reusing them between runs), drives every route
+through the Flask test client or a real gunicorn server, and reports throughput
+and p50/p95/p99 latency. Results can be saved as a JSON baseline and compared
+against a previous one, failing when a regression exceeds the threshold.
+
+    python benchmark.py --sizes 1000,100000 --save baseline.json
+    python benchmark.py --sizes 1000,100000 --compare baseline.json --threshold 0.2
+    python benchmark.py --sizes 100000 --server --workers 4 --concurrency 16
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from insert_sample_data import CROPS, seed_database
+import migrate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'password123'
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+# Database fixtures
+def prepare_database(data_dir, products, seed):
+    """Create (or reuse) a seeded database with the given number of products"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(data_dir, f'bench_{products}_{seed}.db'))
+    if os.path.exists(path):
+        return path
+
+    # Build the schema with the app's migrations, then bulk-load synthetic data
+    migrate.migrate(path)
+    seed_database(path, users=max(100, products // 100), products=products, seed=seed)
+    return path
+
+
+def load_fixture(path, rng, sample_size=2000):
+    """Pick users and QR codes from a seeded database for the scenarios to use"""
+    conn = sqlite3.connect(path)
+    users = {}
+    for role in ['farmer', 'distributor', 'retailer', 'customer']:
+        row = conn.execute("SELECT username FROM users WHERE role = ? AND username LIKE 'seed_%' "
+                           "ORDER BY id LIMIT 1", (role,)).fetchone()
+        users[role] = row[0]
+
+    low, high = conn.execute('SELECT MIN(id), MAX(id) FROM products').fetchone()
+    ids = [rng.randint(low, high) for _ in range(sample_size)]
+    codes = [row[0] for row in conn.execute(
+        f"SELECT qr_code FROM products WHERE id IN ({','.join('?' * len(ids))})", ids)]
+
+    def codes_at_stage(stage):
+        return [row[0] for row in conn.execute(
+            'SELECT qr_code FROM products WHERE current_stage = ? LIMIT ?', (stage, sample_size))]
+
+    # Seeded retail lots not split or merged yet, so a reused database still has some to use up
+    unused_lots = [row[0] for row in conn.execute(
+        '''SELECT qr_code FROM products
+           WHERE current_stage = 'retailer' AND consumed_at IS NULL AND id NOT IN (SELECT child_id FROM lot_links)
+           ORDER BY id LIMIT ?''', (2 * sample_size,))]
+
+    low, high = conn.execute('SELECT MIN(id), MAX(id) FROM supply_chain_tracking').fetchone()
+    ids = [rng.randint(low, high) for _ in range(sample_size)]
+    events = conn.execute(f"SELECT id, date(timestamp) FROM supply_chain_tracking "
+                          f"WHERE id IN ({','.join('?' * len(ids))})", ids).fetchall()
+
+    fixture = {
+        'users': users,
+        'codes': codes,
+        'farmer_stage_codes': codes_at_stage('farmer'),
+        'distributor_stage_codes': codes_at_stage('distributor'),
+        'split_codes': unused_lots[0::2],
+        'merge_codes': unused_lots[1::2],
+        'event_ids': [event_id for event_id, _ in events],
+        'event_days': [event_day for _, event_day in events],
+    }
+    conn.close()
+    return fixture
+
+
+# Scenarios: (name, role to log in as, request builder)
+def product_body(rng):
+    return {'product_name': 'Bench Wheat', 'quantity': str(rng.randint(10, 1000)), 'unit': 'kg',
+            'farmer_price': round(rng.uniform(10, 100), 2), 'farm_location': 'Karnal, Haryana',
+            'harvest_date': '2025-03-01', 'category': 'Grains', 'include_qr_image': False}
+
+
+SCENARIOS = [
+    ('health', None, lambda f, rng, i: ('GET', '/api/health', None)),
+    ('register', None, lambda f, rng, i: ('POST', '/api/register', {
+        'username': f'bench_{os.getpid()}_{i}_{rng.random()}', 'email': f'bench_{i}_{rng.random()}@x',
+        'password': PASSWORD, 'role': 'customer', 'full_name': 'Bench User'})),
+    ('login', None, lambda f, rng, i: ('POST', '/api/login', {
+        'username': f['users']['customer'], 'password': PASSWORD})),
+    ('register-product', None, lambda f, rng, i: ('POST', '/api/farmer/register-product',
+                                                  product_body(rng))),
+    ('register-product-inline-qr', None, lambda f, rng, i: ('POST', '/api/farmer/register-product',
+                                                            dict(product_body(rng), include_qr_image=True))),
+    ('register-products-x100', None, lambda f, rng, i: ('POST', '/api/farmer/register-products',
+                                                        [product_body(rng) for _ in range(100)])),
+    ('distributor-add-record', 'distributor', lambda f, rng, i: ('POST', '/api/distributor/add-record', {
+        'qr_code': f['farmer_stage_codes'][i % len(f['farmer_stage_codes'])],
+        'distributor_name': 'Bench Distributor', 'storage_location': 'Delhi Warehouse',
+        'distributor_margin': 5.0, 'transport_date': '2025-03-03'})),
+    ('retailer-add-record', 'retailer', lambda f, rng, i: ('POST', '/api/retailer/add-record', {
+        'qr_code': f['distributor_stage_codes'][i % len(f['distributor_stage_codes'])],
+        'shop_name': 'Bench Mart', 'final_price': 50.0, 'retail_location': 'Mumbai Central'})),
+    ('lots-split', 'retailer', lambda f, rng, i: ('POST', '/api/lots/split', {
+        'qr_code': f['split_codes'][i % len(f['split_codes'])], 'quantities': ['20', '20']})),
+    ('lots-merge', 'retailer', lambda f, rng, i: ('POST', '/api/lots/merge', {
+        'parent_lots': [f['merge_codes'][2 * i % len(f['merge_codes'])],
+                        f['merge_codes'][(2 * i + 1) % len(f['merge_codes'])]]})),
+    ('verify-product', None, lambda f, rng, i: ('GET', f"/api/verify-product/{rng.choice(f['codes'])}", None)),
+    ('verify-product-hot', None, lambda f, rng, i: ('GET', f"/api/verify-product/{f['codes'][0]}", None)),
+    ('verify-product-customer', 'customer', lambda f, rng, i: (
+        'GET', f"/api/verify-product/{rng.choice(f['codes'])}", None)),
+    ('verify-products-x50', None, lambda f, rng, i: ('POST', '/api/verify-products', rng.sample(f['codes'], 50))),
+    ('qr-png', None, lambda f, rng, i: ('GET', f"/api/qr/{rng.choice(f['codes'][:50])}.png", None)),
+    ('products-nearby', None, lambda f, rng, i: (
+        'GET', f"/api/products/nearby?lat={29.69 + rng.uniform(-0.5, 0.5):.4f}"
+               f"&lon={76.99 + rng.uniform(-0.5, 0.5):.4f}&radius_km=50", None)),
+    ('products-search', None, lambda f, rng, i: (
+        'GET', f"/api/products/search?q={quote(rng.choice(CROPS)[0])}", None)),
+    ('analytics-markup', None, lambda f, rng, i: ('GET', '/api/analytics/markup?group_by=category,region', None)),
+    ('ledger-chain', None, lambda f, rng, i: ('GET', f"/api/ledger/{rng.choice(f['codes'])}", None)),
+    ('ledger-proof', None, lambda f, rng, i: ('GET', f"/api/ledger/proof/{rng.choice(f['event_ids'])}", None)),
+    ('lots-recall', 'retailer', lambda f, rng, i: (
+        'GET', f"/api/lots/{rng.choice(f['codes'])}/recall?stage=retailer", None)),
+    ('retailer-expiring', 'retailer', lambda f, rng, i: ('GET', '/api/retailer/expiring?days=30', None)),
+    ('export-tracking-day', 'retailer', lambda f, rng, i: (
+        'GET', '/api/export/tracking?from={0}&to={0}'.format(rng.choice(f['event_days'])), None)),
+    ('dashboard-farmer', 'farmer', lambda f, rng, i: ('GET', '/api/dashboard/farmer', None)),
+    ('dashboard-distributor', 'distributor', lambda f, rng, i: ('GET', '/api/dashboard/distributor', None)),
+    ('dashboard-retailer', 'retailer', lambda f, rng, i: ('GET', '/api/dashboard/retailer', None)),
+    ('logout', None, lambda f, rng, i: ('POST', '/api/logout', None)),
+]
+
+
+# Clients
+class TestClient:
+    """Adapter over the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        # Buffered, so streamed bodies (exports) are produced within the timing
+        return self.client.open(path, method=method, json=body, buffered=True).status_code
+
+
+class HTTPClient:
+    """Minimal keep-alive HTTP client that carries the session cookie"""
+
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, path, body=payload, headers=headers)
+        response = self.conn.getresponse()
+        response.read()
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        return response.status
+
+
+def run_scenario(make_client, fixture, name, role, build, requests, warmup, concurrency, seed):
+    """Run one scenario across `concurrency` clients and summarize its latencies"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_client = max(1, requests // concurrency)
+
+    def worker(worker_index):
+        rng = random.Random(f'{seed}:{name}:{worker_index}')
+        client = make_client()
+        if role:
+            client.request('POST', '/api/login', {'username': fixture['users'][role], 'password': PASSWORD})
+        offset = worker_index * (per_client + warmup)
+        for i in range(warmup):
+            client.request(*build(fixture, rng, offset + i))
+        local, local_errors = [], 0
+        for i in range(warmup, warmup + per_client):
+            method, path, body = build(fixture, rng, offset + i)
+            started = time.perf_counter()
+            status = client.request(method, path, body)
+            local.append(time.perf_counter() - started)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        worker(0)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, range(concurrency)))
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def run_in_process(args):
+    """Benchmark one database through the Flask test client (run in a child process)"""
+    import backend_app
+    app = backend_app.create_app()
+    fixture = load_fixture(os.environ['KRISHICHAIN_DATABASE'], random.Random(args.seed))
+    results = {}
+    for name, role, build in selected_scenarios(args):
+        results[name] = run_scenario(lambda: TestClient(app), fixture, name, role, build,
+                                     args.requests, args.warmup, args.concurrency, args.seed)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_against_server(args, path):
+    """Benchmark one database through a real multi-worker gunicorn server"""
+    port = free_port()
+    env = dict(os.environ, KRISHICHAIN_DATABASE=path)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                               '--workers', str(args.workers), '--threads', str(args.threads),
+                               '--preload', '--log-level', 'warning', 'wsgi:app'],
+                              cwd=HERE, env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                HTTPClient('127.0.0.1', port).request('GET', '/api/health')
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('gunicorn did not start')
+                time.sleep(0.2)
+
+        fixture = load_fixture(path, random.Random(args.seed))
+        results = {}
+        for name, role, build in selected_scenarios(args):
+            results[name] = run_scenario(lambda: HTTPClient('127.0.0.1', port), fixture, name, role, build,
+                                         args.requests, args.warmup, args.concurrency, args.seed)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def selected_scenarios(args):
+    if not args.scenarios:
+        return SCENARIOS
+    wanted = set(args.scenarios.split(','))
+    return [scenario for scenario in SCENARIOS if scenario[0] in wanted]
+
+
+# Baselines
+def compare(results, baseline, threshold):
+    """Return regressions where p95 latency rose or throughput fell by more than `threshold`"""
+    regressions = []
+    for size, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get(size, {}).get(name)
+            if not previous:
+                continue
+            if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(f"{size}/{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+            if previous['rps'] and current['rps'] < previous['rps'] * (1 - threshold):
+                regressions.append(f"{size}/{name}: throughput {previous['rps']} -> {current['rps']} req/s")
+    return regressions
+
+
+def print_table(size, scenarios):
+    print(f"\n== {size} products ==")
+    print(f"{'scenario':<28}{'req':>7}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in scenarios.items():
+        print(f"{name:<28}{r['requests']:>7}{r['errors']:>6}{r['rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the KrishiChain API endpoints')
+    parser.add_argument('--sizes', default='1000,100000', help='comma-separated product counts to seed')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'bench_data'),
+                        help='where seeded databases are kept between runs')
+    parser.add_argument('--requests', type=int, default=500, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per client first')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients')
+    parser.add_argument('--scenarios', help='comma-separated subset of scenarios to run')
+    parser.add_argument('--server', action='store_true', help='benchmark a real gunicorn server')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write results to this JSON baseline file')
+    parser.add_argument('--compare', help='compare results against this JSON baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative regression before failing (default: %(default)s)')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        json.dump(run_in_process(args), sys.stdout)
+        return 0
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        # Fresh copy per run so write scenarios do not skew later runs
+        source = prepare_database(args.data_dir, size, args.seed)
+        path = source[:-len('.db')] + '.run.db'
+        source_conn = sqlite3.connect(source)
+        target_conn = sqlite3.connect(path)
+        source_conn.backup(target_conn)
+        source_conn.close()
+        target_conn.close()
+        try:
+            if args.server:
+                results[str(size)] = run_against_server(args, path)
+            else:
+                child = [a for a in sys.argv[1:] if a != '--server'] + ['--single']
+                output = subprocess.run([sys.executable, os.path.abspath(__file__)] + child, cwd=HERE,
+                                        env=dict(os.environ, KRISHICHAIN_DATABASE=path),
+                                        check=True, stdout=subprocess.PIPE).stdout
+                results[str(size)] = json.loads(output.decode().strip().splitlines()[-1])
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        print_table(size, results[str(size)])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"- {line}")
+            return 1
+        print(f"\n✅ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
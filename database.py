@@ -0,0 +1,129 @@
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to no inter-process locking
+    fcntl = None
+
+DATABASE = os.environ.get('KRISHICHAIN_DATABASE', 'krishichain.db')
+
+# Connection tuning, applied once when a pooled connection is opened
+BUSY_TIMEOUT_MS = int(os.environ.get('KRISHICHAIN_BUSY_TIMEOUT_MS', 5000))
+CACHE_SIZE_KB = int(os.environ.get('KRISHICHAIN_CACHE_SIZE_KB', 65536))
+MMAP_SIZE = int(os.environ.get('KRISHICHAIN_MMAP_SIZE', 256 * 1024 * 1024))
+STATEMENT_CACHE_SIZE = 256
+POOL_SIZE = int(os.environ.get('KRISHICHAIN_POOL_SIZE', 16))
+
+# Callables notified as observer(conn, sql, params, seconds) after every statement
+statement_observers = []
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection that times execute()/executemany() and reports to statement_observers"""
+
+    def execute(self, sql, parameters=()):
+        if not statement_observers:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            for observer in statement_observers:
+                observer(self, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not statement_observers:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            for observer in statement_observers:
+                observer(self, sql, None, elapsed)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive advisory lock on `path` across processes"""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def connect(path=None):
+    """Open a tuned SQLite connection (WAL journal, busy timeout, cache/mmap pragmas)"""
+    conn = sqlite3.connect(path or DATABASE,
+                           timeout=BUSY_TIMEOUT_MS / 1000.0,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False,
+                           factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections, owned by one worker process"""
+
+    def __init__(self, path=None, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+
+    def acquire(self):
+        """Take an idle connection, opening a new one if none is available"""
+        with self._lock:
+            # Connections must never cross a fork (e.g. preloaded gunicorn workers)
+            if self._pid != os.getpid():
+                self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.close()
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+pool = ConnectionPool()
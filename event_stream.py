@@ -0,0 +1,204 @@
+"""Server-Sent Events change feed of tracking events.
+
+Each process runs one tail thread, and only while somebody is subscribed.
+The thread reads new supply_chain_tracking rows by id, encodes each event once
+into a shared in-memory backlog, and wakes every subscriber. A thousand open
+dashboards therefore cost one indexed query per poll, not one query each.
+
+SQLite has a single writer, so ids become visible in increasing order and an
+id works as a resume cursor (SSE Last-Event-ID). A client resuming from
+before the backlog is caught up from the database first.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+
+from database import connect
+
+POLL_INTERVAL = float(os.environ.get('KRISHICHAIN_EVENTS_POLL_INTERVAL', 0.5))
+BACKLOG = int(os.environ.get('KRISHICHAIN_EVENTS_BACKLOG', 10000))
+HEARTBEAT = float(os.environ.get('KRISHICHAIN_EVENTS_HEARTBEAT', 15))
+# Streams end after this long so threads are freed; EventSource reconnects with Last-Event-ID
+MAX_STREAM_SECONDS = float(os.environ.get('KRISHICHAIN_EVENTS_MAX_SECONDS', 600))
+# Open streams allowed per process (0: no limit); see gunicorn.conf.py and gunicorn_stream.conf.py
+MAX_STREAMS = int(os.environ.get('KRISHICHAIN_EVENTS_MAX_STREAMS', 0))
+FETCH_LIMIT = 1000
+# Ask EventSource clients to reconnect after this many milliseconds
+RETRY_MS = 3000
+
+_event_sql = '''SELECT st.id, st.product_id, p.qr_code, st.stage, st.user_id, st.action,
+                       st.details, st.timestamp
+                FROM supply_chain_tracking st
+                JOIN products p ON p.id = st.product_id
+                WHERE st.id > ? ORDER BY st.id LIMIT ?'''
+
+
+class Event:
+    """One tracking event, with its SSE message encoded once for every subscriber"""
+
+    __slots__ = ('id', 'product_id', 'stage', 'user_id', 'message')
+
+    def __init__(self, row):
+        event_id, product_id, qr_code, stage, user_id, action, details, timestamp = row
+        self.id = event_id
+        self.product_id = product_id
+        self.stage = stage
+        self.user_id = user_id
+        try:
+            details = json.loads(details) if details else None
+        except ValueError:
+            pass
+        data = json.dumps({'event_id': event_id, 'qr_code': qr_code, 'stage': stage, 'user_id': user_id,
+                           'action': action, 'details': details, 'timestamp': timestamp},
+                          separators=(',', ':'), ensure_ascii=False)
+        self.message = f'id: {event_id}\nevent: tracking\ndata: {data}\n\n'
+
+
+def fetch_events(conn, after_id, limit=FETCH_LIMIT):
+    return [Event(row) for row in conn.execute(_event_sql, (after_id, limit))]
+
+
+class EventFeed:
+    """Shared tail of supply_chain_tracking for all subscribers in this process"""
+
+    def __init__(self, path=None, poll_interval=POLL_INTERVAL, backlog=BACKLOG):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+        self.polls = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._events = []
+        self._ids = []
+        self._floor = None  # every event with a larger id is in _events
+        self._pid = None
+
+    def _start(self):
+        # The tail thread does not survive a fork, so start one per process
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._events, self._ids, self._floor = [], [], None
+            threading.Thread(target=self._run, name='event-feed', daemon=True).start()
+
+    def subscribe(self, timeout=10):
+        """Register a subscriber; returns the id of the newest event, where a fresh stream starts
+
+        Returns None instead when MAX_STREAMS subscribers are already open.
+        """
+        with self._cond:
+            if MAX_STREAMS and self._subscribers >= MAX_STREAMS:
+                return None
+            self._subscribers += 1
+            self._start()
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._floor is not None, timeout):
+                self._subscribers -= 1
+                raise RuntimeError('Event feed is not available')
+            return self._ids[-1] if self._ids else self._floor
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def subscriber_count(self):
+        return self._subscribers
+
+    def _run(self):
+        conn = connect(self.path)
+        last_id = None
+        try:
+            while True:
+                with self._cond:
+                    if not self._subscribers:
+                        # Nobody is listening: drop the backlog and restart from the newest event on wake
+                        self._events, self._ids, self._floor = [], [], None
+                        last_id = None
+                        while not self._subscribers:
+                            self._cond.wait()
+                try:
+                    if last_id is None:
+                        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM supply_chain_tracking').fetchone()[0]
+                        with self._cond:
+                            self._floor = last_id
+                            self._cond.notify_all()
+                    events = fetch_events(conn, last_id)
+                    self.polls += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Event feed poll failed: {e}")
+                    events = []
+                if events:
+                    last_id = events[-1].id
+                    self._append(events)
+                if len(events) < FETCH_LIMIT:
+                    time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+
+    def _append(self, events):
+        with self._cond:
+            self._events.extend(events)
+            self._ids.extend(event.id for event in events)
+            if len(self._events) > 2 * self.backlog:
+                dropped = len(self._events) - self.backlog
+                self._floor = self._ids[dropped - 1]
+                del self._events[:dropped]
+                del self._ids[:dropped]
+            self._cond.notify_all()
+
+    def events_after(self, after_id, timeout):
+        """Buffered events after after_id, waiting up to timeout for one; None if after_id predates the backlog"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if after_id < self._floor:
+                    return None
+                start = bisect.bisect_right(self._ids, after_id)
+                remaining = deadline - time.monotonic()
+                if start < len(self._ids) or remaining <= 0:
+                    return self._events[start:]
+                self._cond.wait(remaining)
+
+    def stream(self, newest, after_id=None, stage=None, user_id=None, product_id=None,
+               max_seconds=MAX_STREAM_SECONDS, heartbeat=HEARTBEAT):
+        """Yield SSE messages for matching events after after_id (from newest on if None)
+
+        The caller subscribes first, so a full process can refuse the request
+        before any response starts, and unsubscribes when the response closes.
+        """
+        def matches(event):
+            return ((stage is None or event.stage == stage) and
+                    (user_id is None or event.user_id == user_id) and
+                    (product_id is None or event.product_id == product_id))
+
+        cursor = newest if after_id is None else after_id
+        yield f'retry: {RETRY_MS}\n\n'
+        ends = time.monotonic() + max_seconds
+        last_sent = time.monotonic()
+        while time.monotonic() < ends:
+            events = self.events_after(cursor, min(heartbeat, max(ends - time.monotonic(), 0)))
+            if events is None:
+                # Resuming from before the backlog: catch up from the database first
+                conn = connect(self.path)
+                try:
+                    events = fetch_events(conn, cursor)
+                finally:
+                    conn.close()
+            for event in events:
+                if matches(event):
+                    yield event.message
+                    last_sent = time.monotonic()
+            if events:
+                cursor = events[-1].id
+            # Keep idle connections open and reveal disconnected clients; the id line moves the
+            # client's Last-Event-ID past events it filtered out, so a reconnect does not rescan them
+            if time.monotonic() - last_sent >= heartbeat:
+                yield f': keepalive\nid: {cursor}\n\n'
+                last_sent = time.monotonic()
+        yield f'id: {cursor}\n\n'
+
+
+feed = EventFeed()
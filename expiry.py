@@ -0,0 +1,196 @@
+"""Lot expiry: a due-queue over retailer_records.expiry_date.
+
+A retail lot expires at the end of its expiry_date (UTC). Records still
+waiting to expire are kept in a partial index ordered by date (see
+migrations/0013_expiry_indexes.sql), so the next due date is the first index
+entry and the rows that became due are a prefix of it. A scheduler thread in
+each process sleeps until the next lot is due, or until a retailer adds a lot
+that expires sooner, then sets expired_at on the due records only. It can also
+run from cron instead (set KRISHICHAIN_EXPIRY_MAX_SLEEP=0):
+
+    python expiry.py run
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import lots
+from cache import verify_cache
+from database import DATABASE, connect
+
+EXPIRY_BATCH = int(os.environ.get('KRISHICHAIN_EXPIRY_BATCH', 1000))
+# Longest the scheduler sleeps without looking, which bounds how late it notices
+# lots added by other processes; 0 disables the in-process scheduler
+MAX_SLEEP = float(os.environ.get('KRISHICHAIN_EXPIRY_MAX_SLEEP', 300))
+
+
+def parse_expiry_date(value):
+    """Validate an optional YYYY-MM-DD expiry date; returns (date string or None, error)"""
+    if value in (None, ''):
+        return None, None
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').date().isoformat(), None
+    except ValueError:
+        return None, 'expiry_date must be a date (YYYY-MM-DD)'
+
+
+def next_due(conn):
+    """Earliest expiry_date still waiting to expire, or None"""
+    return conn.execute('''SELECT MIN(expiry_date) FROM retailer_records
+                           WHERE expired_at IS NULL AND expiry_date IS NOT NULL''').fetchone()[0]
+
+
+def seconds_until(expiry_date):
+    """Seconds until a lot with this expiry date is due (the UTC midnight after it); None if unparseable"""
+    try:
+        due = datetime.strptime(expiry_date, '%Y-%m-%d') + timedelta(days=1)
+    except (TypeError, ValueError):
+        return None
+    return (due - datetime.utcnow()).total_seconds()
+
+
+def expire_due(conn, limit=EXPIRY_BATCH):
+    """Mark up to `limit` lots whose expiry date has passed; returns how many were marked
+
+    Runs in one write transaction, so workers sharing the database never mark
+    a lot twice. The product row is updated too, which moves its version and so
+    the ETag of its verify-product response.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''SELECT rr.id, rr.product_id, p.qr_code
+                               FROM retailer_records rr JOIN products p ON p.id = rr.product_id
+                               WHERE rr.expired_at IS NULL AND rr.expiry_date < date('now')
+                               ORDER BY rr.expiry_date LIMIT ?''', (limit,)).fetchall()
+        conn.executemany('UPDATE retailer_records SET expired_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         [(row['id'],) for row in rows])
+        conn.executemany('UPDATE products SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         [(product_id,) for product_id in {row['product_id'] for row in rows}])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for row in rows:
+        verify_cache.invalidate(row['qr_code'])
+        for descendant in lots.descendant_qr_codes(conn, row['product_id']):
+            verify_cache.invalidate(descendant)
+    return len(rows)
+
+
+def expire_all(conn):
+    """Mark every due lot, one batch per transaction; returns how many were marked"""
+    total = 0
+    while True:
+        marked = expire_due(conn)
+        total += marked
+        if marked < EXPIRY_BATCH:
+            return total
+
+
+def expiring_lots(conn, retailer_id, days, expired_days, limit):
+    """A retailer's lots still on the shelf that expire within `days` or expired within `expired_days`
+
+    Soonest (or longest expired) first, leaving out lots used up by a split or
+    merge; both bounds keep the read to one range of the (retailer_id,
+    expiry_date) index.
+    """
+    rows = conn.execute('''SELECT p.qr_code, p.product_name, p.category, rr.shop_name, rr.retail_location,
+                                  rr.final_price, rr.expiry_date, rr.expired_at,
+                                  CAST(julianday(rr.expiry_date) - julianday('now', 'start of day')
+                                       AS INTEGER) AS days_left
+                           FROM retailer_records rr JOIN products p ON p.id = rr.product_id
+                           WHERE rr.retailer_id = ?
+                             AND rr.expiry_date BETWEEN date('now', ?) AND date('now', ?)
+                             AND p.current_stage = 'retailer' AND p.consumed_at IS NULL
+                           ORDER BY rr.expiry_date, rr.id
+                           LIMIT ?''', (retailer_id, f'-{expired_days} days', f'+{days} days', limit)).fetchall()
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['expired'] = result['expired_at'] is not None
+        results.append(result)
+    return results
+
+
+class ExpiryScheduler:
+    """Background thread that sleeps until the next lot is due and then marks the due lots"""
+
+    def __init__(self, max_sleep=MAX_SLEEP):
+        self.max_sleep = max_sleep
+        self.expired = 0
+        self.runs = 0
+        self.failed = 0
+        self.next_due = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    def start(self):
+        # The scheduler thread does not survive a fork, so start one per process
+        if self.max_sleep <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            threading.Thread(target=self._run, name='expiry-scheduler', daemon=True).start()
+
+    def notify(self, expiry_date):
+        """Wake the scheduler early if a newly added lot expires before the one it is waiting for"""
+        if expiry_date and (self.next_due is None or expiry_date < self.next_due):
+            self._wake.set()
+
+    def _run(self):
+        conn = connect()
+        try:
+            while not self._stopping:
+                self._wake.clear()
+                timeout = self.max_sleep
+                try:
+                    self.expired += expire_all(conn)
+                    self.runs += 1
+                    self.next_due = next_due(conn)
+                    seconds = seconds_until(self.next_due) if self.next_due else None
+                    if seconds is not None:
+                        # Never spin if the clock is a moment behind the database's
+                        timeout = min(max(seconds, 1.0), self.max_sleep)
+                except sqlite3.Error as e:
+                    self.failed += 1
+                    print(f"Expiry run failed: {e}")
+                self._wake.wait(timeout)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+
+scheduler = ExpiryScheduler()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain lot expiry')
+    parser.add_argument('command', choices=['run', 'status'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    conn = connect(args.database)
+    if args.command == 'run':
+        print(f"✅ Marked {expire_all(conn):,} expired lots")
+    due = next_due(conn)
+    waiting = conn.execute('''SELECT COUNT(*) FROM retailer_records
+                              WHERE expired_at IS NULL AND expiry_date IS NOT NULL''').fetchone()[0]
+    print(f"{waiting:,} lots waiting to expire; next due after {due or '-'}")
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
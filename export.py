@@ -0,0 +1,140 @@
+"""Streaming export of supply chain history.
+
+Rows are read in keyset chunks ordered by (timestamp, id): each chunk is its
+own short statement, consumed with fetchmany(), so memory stays bounded by the
+chunk size, no read snapshot is held open for the length of the download (WAL
+checkpoints keep running) and an interrupted export resumes from the last
+event_id the client received. Once chains have been archived (see archive.py)
+each chunk merges the hot and archived history, so exports stay complete.
+"""
+import csv
+import io
+import os
+import zlib
+
+import archive
+from database import connect
+from responses import GZIP_LEVEL
+
+EXPORT_CHUNK = int(os.environ.get('KRISHICHAIN_EXPORT_CHUNK', 5000))
+FETCH_SIZE = 500
+# Flush output in pieces of about this many bytes
+BUFFER_SIZE = 64 * 1024
+
+# (output name, SQL expression) for every exported column
+EXPORT_COLUMNS = [
+    ('event_id', 'st.id'),
+    ('timestamp', 'st.timestamp'),
+    ('qr_code', 'p.qr_code'),
+    ('product_name', 'p.product_name'),
+    ('category', 'p.category'),
+    ('stage', 'st.stage'),
+    ('action', 'st.action'),
+    ('user_id', 'st.user_id'),
+    ('details', 'st.details'),
+    ('prev_hash', 'st.prev_hash'),
+    ('event_hash', 'st.event_hash'),
+    ('farmer_id', 'fr.farmer_id'),
+    ('farm_location', 'fr.farm_location'),
+    ('farmer_price', 'fr.farmer_price'),
+    ('harvest_date', 'fr.harvest_date'),
+    ('farming_method', 'fr.farming_method'),
+    ('distributor_name', 'dr.distributor_name'),
+    ('distributor_margin', 'dr.distributor_margin'),
+    ('transport_date', 'dr.transport_date'),
+    ('shop_name', 'rr.shop_name'),
+    ('final_price', 'rr.final_price'),
+    ('retail_location', 'rr.retail_location'),
+]
+
+# The stage record written together with each event, from the event's own schema
+STAGE_JOINS = '''
+    JOIN {schema}.products p ON p.id = st.product_id
+    LEFT JOIN {schema}.farmer_records fr ON fr.id = (
+        SELECT id FROM {schema}.farmer_records WHERE product_id = st.product_id ORDER BY id LIMIT 1)
+    LEFT JOIN {schema}.distributor_records dr ON st.stage = 'distributor' AND dr.id = (
+        SELECT id FROM {schema}.distributor_records WHERE product_id = st.product_id ORDER BY id LIMIT 1)
+    LEFT JOIN {schema}.retailer_records rr ON st.stage = 'retailer' AND rr.id = (
+        SELECT id FROM {schema}.retailer_records WHERE product_id = st.product_id ORDER BY id LIMIT 1)
+'''
+
+
+def export_sql(fmt, conditions, schemas=('main',)):
+    """One keyset chunk over the schemas; NDJSON lines are built by SQLite, with details embedded as JSON
+
+    Conditions may name {schema}. Each schema's rows come from a range of its
+    timestamp index, and SQLite merges the sorted branches. Callers pass the
+    filter and position parameters once per schema.
+    """
+    if fmt == 'ndjson':
+        pairs = [f"'{name}', CASE WHEN json_valid({expr}) THEN json({expr}) ELSE {expr} END"
+                 if name == 'details' else f"'{name}', {expr}" for name, expr in EXPORT_COLUMNS]
+        columns = f"json_object({', '.join(pairs)})"
+    else:
+        columns = ', '.join(expr for _, expr in EXPORT_COLUMNS)
+    branches = []
+    for schema in schemas:
+        where = [condition.format(schema=schema) for condition in conditions]
+        where.append('(st.timestamp, st.id) > (?, ?)')
+        if schema != 'main':
+            # An archive run copies rows before deleting them; skip the ones the hot side still exports
+            where.append('''NOT EXISTS (SELECT 1 FROM main.supply_chain_tracking h
+                                        JOIN main.products hp ON hp.id = h.product_id WHERE h.id = st.id)''')
+        branches.append(f'''SELECT st.timestamp, st.id, {columns}
+               FROM {schema}.supply_chain_tracking st {STAGE_JOINS.format(schema=schema)}
+               WHERE {' AND '.join(where)}''')
+    return f"{' UNION ALL '.join(branches)} ORDER BY 1, 2 LIMIT ?"
+
+
+def iter_rows(path, fmt, conditions, params, after):
+    """Yield export rows chunk by chunk, starting after the (timestamp, id) position `after`"""
+    conn = connect(path)
+    try:
+        schemas = ('main', 'archive') if archive.attach(conn) else ('main',)
+        sql = export_sql(fmt, conditions, schemas)
+        position = after
+        while True:
+            cursor = conn.execute(sql, (params + list(position)) * len(schemas) + [EXPORT_CHUNK])
+            count = 0
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                count += len(rows)
+                for row in rows:
+                    yield row
+                position = (rows[-1][0], rows[-1][1])
+            if count < EXPORT_CHUNK:
+                return
+    finally:
+        conn.close()
+
+
+def generate_export(path, fmt, conditions, params, after, compress=False):
+    """Yield the encoded export body in buffered pieces, gzip-compressed on request"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow([name for name, _ in EXPORT_COLUMNS])
+
+    for row in iter_rows(path, fmt, conditions, params, after):
+        if writer is None:
+            buffer.write(row[2])
+            buffer.write('\n')
+        else:
+            writer.writerow(row[2:])
+        if buffer.tell() >= BUFFER_SIZE:
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = buffer.getvalue().encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
@@ -0,0 +1,240 @@
+"""Proximity search over farm, storage and retail locations.
+
+Farmer, distributor and retailer records can carry a latitude/longitude,
+stored together with the point's geohash: the cell of a grid that halves
+longitude and latitude in turn, written in base 32, so points close together
+share a prefix. A nearby query covers the bounding box of the search circle
+with a few geohash cells, reads the points in them with one range scan each of
+the covering geohash index (migrations/0011_location_indexes.sql), and keeps
+and orders only those within the exact great-circle distance. The app writes
+the geohash with the coordinates; after editing coordinates by hand, recompute
+the geohashes with:
+
+    python geo.py rebuild
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import time
+
+from database import DATABASE, connect
+
+EARTH_RADIUS_KM = 6371.0088
+# 9 characters are cells of about 5 x 5 m
+GEOHASH_PRECISION = 9
+# Coarsen the cells until the bounding box is covered by at most this many
+MAX_COVER_CELLS = 16
+# The search radius starts here and doubles until enough products are found
+NEARBY_START_KM = float(os.environ.get('KRISHICHAIN_NEARBY_START_KM', 0.5))
+
+_base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# kind -> (record table, location text column, extra record columns)
+LOCATION_KINDS = {
+    'farm': ('farmer_records', 'farm_location', 'r.farmer_id, r.farming_method, r.harvest_date'),
+    'storage': ('distributor_records', 'storage_location', 'r.distributor_name, r.transport_date'),
+    'retail': ('retailer_records', 'retail_location', 'r.shop_name, r.final_price'),
+}
+
+
+def parse_coordinates(latitude, longitude):
+    """Validate an optional coordinate pair; returns ((latitude, longitude), error)
+
+    Both values are None when neither is given or on error; giving only one is an error.
+    """
+    if latitude in (None, '') and longitude in (None, ''):
+        return (None, None), None
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return (None, None), 'latitude and longitude must both be numbers'
+    # Written so NaN fails too
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return (None, None), 'latitude must be between -90 and 90 and longitude between -180 and 180'
+    return (latitude, longitude), None
+
+
+def grid_size(precision):
+    """(rows, columns) of the geohash grid at a precision; longitude gets the odd bit"""
+    bits = 5 * precision
+    return 2 ** (bits // 2), 2 ** ((bits + 1) // 2)
+
+
+def cell_of(latitude, longitude, precision):
+    """(row, column) of the cell containing a point"""
+    rows, columns = grid_size(precision)
+    return (min(int((latitude + 90) / 180 * rows), rows - 1),
+            min(int((longitude + 180) / 360 * columns), columns - 1))
+
+
+def cell_hash(row, column, precision):
+    """Geohash of a cell: column and row bits interleaved, column first, in base 32"""
+    lat_bits, lon_bits = (5 * precision) // 2, (5 * precision + 1) // 2
+    value = 0
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            value = value << 1 | (column >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (row >> lat_bits) & 1
+    return ''.join(_base32[value >> 5 * (precision - 1 - i) & 31] for i in range(precision))
+
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point, or None without coordinates"""
+    if latitude is None or longitude is None:
+        return None
+    return cell_hash(*cell_of(latitude, longitude, precision), precision)
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) boxes covering the circle, split at the antimeridian"""
+    angle = radius_km / EARTH_RADIUS_KM
+    min_lat = latitude - math.degrees(angle)
+    max_lat = latitude + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle covers a pole, so every longitude is in range
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    # Widest longitude offset, reached where the meridians touch the circle
+    delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+    min_lon, max_lon = longitude - delta, longitude + delta
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def covering_cells(boxes):
+    """Geohash prefixes of the finest cells that cover the boxes in at most MAX_COVER_CELLS"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        ranges = [(cell_of(min_lat, min_lon, precision), cell_of(max_lat, max_lon, precision))
+                  for min_lat, max_lat, min_lon, max_lon in boxes]
+        count = sum((last_row - first_row + 1) * (last_column - first_column + 1)
+                    for (first_row, first_column), (last_row, last_column) in ranges)
+        if count <= MAX_COVER_CELLS or precision == 1:
+            return sorted({cell_hash(row, column, precision)
+                           for (first_row, first_column), (last_row, last_column) in ranges
+                           for row in range(first_row, last_row + 1)
+                           for column in range(first_column, last_column + 1)})
+
+
+def ensure_math_functions(conn):
+    """Register Python versions of the SQL math functions on SQLite builds compiled without them"""
+    try:
+        conn.execute('SELECT sin(0), cos(0), radians(0)')
+    except sqlite3.OperationalError:
+        for name, function in (('sin', math.sin), ('cos', math.cos), ('radians', math.radians)):
+            conn.create_function(name, 1, function, deterministic=True)
+
+
+def candidates_sql(kind, cell_count):
+    """Points in the cells, nearest first, by the haversine term
+
+    hav = sin²(Δφ/2) + cos φ0 · cos φ · sin²(Δλ/2) grows with distance, so
+    comparing and sorting on it is exact without taking the arcsine per row.
+    """
+    table = LOCATION_KINDS[kind][0]
+    # Every geohash character sorts before '{', so prefix <= geohash < prefix || '{' is one range scan
+    cells = ' UNION ALL '.join(f'''
+        SELECT id, product_id, latitude, longitude FROM {table}
+        WHERE geohash >= :cell{i} AND geohash < :cell{i} || '{{' ''' for i in range(cell_count))
+    return f'''SELECT id, product_id, hav
+               FROM (SELECT id, product_id,
+                            sin((radians(latitude) - :lat) / 2) * sin((radians(latitude) - :lat) / 2)
+                            + :cos_lat * cos(radians(latitude))
+                              * sin((radians(longitude) - :lon) / 2) * sin((radians(longitude) - :lon) / 2) AS hav
+                     FROM ({cells}))
+               WHERE hav <= :max_hav
+               ORDER BY hav, id
+               LIMIT :fetch'''
+
+
+def nearest_records(conn, kind, latitude, longitude, radius_km, limit):
+    """[(record id, hav)] of the nearest record of up to `limit` products within radius_km
+
+    A product with several records of this kind counts once, at its nearest;
+    candidates are fetched in growing batches until duplicates are accounted for.
+    """
+    cells = covering_cells(bounding_boxes(latitude, longitude, radius_km))
+    params = {'lat': math.radians(latitude), 'lon': math.radians(longitude),
+              'cos_lat': math.cos(math.radians(latitude)),
+              'max_hav': math.sin(radius_km / EARTH_RADIUS_KM / 2) ** 2, 'fetch': limit}
+    params.update({f'cell{i}': cell for i, cell in enumerate(cells)})
+    sql = candidates_sql(kind, len(cells))
+    while True:
+        rows = conn.execute(sql, params).fetchall()
+        nearest = {}
+        for record_id, product_id, hav in rows:
+            if product_id not in nearest:
+                nearest[product_id] = (record_id, hav)
+        if len(nearest) >= limit or len(rows) < params['fetch']:
+            return list(nearest.values())[:limit]
+        params['fetch'] *= 4
+
+
+def nearby(conn, kind, latitude, longitude, radius_km, limit):
+    """Products whose `kind` location lies within radius_km of a point, nearest first
+
+    Searching a small circle first and doubling it keeps dense regions cheap:
+    once a circle holds `limit` products they are the nearest in any larger one.
+    """
+    ensure_math_functions(conn)
+    search_km = min(NEARBY_START_KM, radius_km)
+    while True:
+        nearest = nearest_records(conn, kind, latitude, longitude, search_km, limit)
+        if len(nearest) >= limit or search_km >= radius_km:
+            break
+        search_km = min(search_km * 2, radius_km)
+    if not nearest:
+        return []
+
+    table, location_column, extra_columns = LOCATION_KINDS[kind]
+    placeholders = ','.join('?' * len(nearest))
+    rows = {row['id']: row for row in conn.execute(f'''
+        SELECT r.id, p.qr_code, p.product_name, p.category, p.current_stage,
+               r.{location_column} AS location, {extra_columns}, r.latitude, r.longitude
+        FROM {table} r JOIN products p ON p.id = r.product_id
+        WHERE r.id IN ({placeholders})''', [record_id for record_id, _ in nearest])}
+
+    results = []
+    for record_id, hav in nearest:
+        result = dict(rows[record_id])
+        del result['id']
+        result['distance_km'] = round(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(max(hav, 0.0), 1.0))), 3)
+        results.append(result)
+    return results
+
+
+def rebuild_geohashes(conn):
+    """Recompute every record's geohash from its coordinates in one transaction; returns {kind: changed}"""
+    conn.create_function('point_geohash', 2, geohash, deterministic=True)
+    changed = {}
+    for kind, (table, _, _) in LOCATION_KINDS.items():
+        changed[kind] = conn.execute(f'''UPDATE {table} SET geohash = point_geohash(latitude, longitude)
+                                         WHERE geohash IS NOT point_geohash(latitude, longitude)''').rowcount
+    conn.commit()
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain location index maintenance')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = connect(args.database)
+    changed = rebuild_geohashes(conn)
+    conn.close()
+    print(f"✅ Recomputed geohashes ({', '.join(f'{kind}: {count:,} changed' for kind, count in changed.items())}) "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
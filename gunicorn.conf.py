@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+# Bind to the platform-provided port (Railway, Heroku, ...)
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# One process per core plus threads: handlers mostly wait on SQLite I/O,
+# and WAL lets readers in every worker proceed alongside a single writer
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Every open /api/events/stream holds one of these threads for up to
+# KRISHICHAIN_EVENTS_MAX_SECONDS, so streams may take at most half of them and
+# API requests never queue behind dashboards. Serve many dashboards from
+# gunicorn_stream.conf.py instead.
+os.environ.setdefault('KRISHICHAIN_EVENTS_MAX_STREAMS', str(max(1, threads // 2)))
+
+# Import the app (and initialize the schema) once in the master, then fork
+preload_app = True
+
+# Recycle workers periodically to bound memory growth; jitter avoids restarting all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    # Flush buffered verification logs before the worker goes away
+    from write_behind import verification_log
+    verification_log.close()
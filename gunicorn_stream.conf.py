@@ -0,0 +1,39 @@
+import os
+
+# Serves /api/events/stream for many concurrent dashboards. An SSE client keeps
+# its connection open for minutes, which would pin a gthread worker thread, so
+# streams get their own gunicorn with gevent workers, where an open stream is a
+# greenlet. Route the path here from the reverse proxy:
+#   gunicorn -c gunicorn_stream.conf.py wsgi:app
+bind = f"0.0.0.0:{os.environ.get('STREAM_PORT', 5001)}"
+
+# Each worker runs one shared event tail however many clients it serves, so a
+# couple of workers is plenty
+workers = int(os.environ.get('STREAM_WEB_CONCURRENCY', 2))
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('STREAM_WORKER_CONNECTIONS', 1000))
+
+# Streams per worker; beyond this new ones get a 503 with Retry-After
+os.environ.setdefault('KRISHICHAIN_EVENTS_MAX_STREAMS', str(worker_connections - 50))
+
+# The ledger sealer and expiry scheduler write under sqlite's busy timeout,
+# which blocks without yielding to gevent and would stall every open stream in
+# the worker. They keep running in the gthread app workers (gunicorn.conf.py).
+raw_env = ['KRISHICHAIN_LEDGER_SEAL_INTERVAL=0', 'KRISHICHAIN_EXPIRY_MAX_SLEEP=0']
+
+# gevent must patch the standard library before the app creates its locks and
+# threads, so each worker imports the app itself instead of inheriting it
+preload_app = False
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    # Flush buffered verification logs before the worker goes away
+    from write_behind import verification_log
+    verification_log.close()
@@ -1,14 +1,27 @@
 
+import argparse
 import sqlite3
 import hashlib
 import json
-from datetime import datetime, date
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import analytics
+from database import DATABASE
+import geo
+import ledger
+import migrate
+import search
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def insert_sample_data():
-    conn = sqlite3.connect('krishichain.db')
+def insert_sample_data(database=DATABASE):
+    conn = sqlite3.connect(database)
 
     # Sample users
     users = [
@@ -122,6 +135,7 @@ def insert_sample_data():
                         (product_id, retailer['retailer_id'], retailer['shop_name'],
                          retailer['final_price'], retailer['retail_location'], retailer['display_date']))
 
+    ledger.chain_events(conn)
     conn.commit()
     conn.close()
     print("✅ Sample data inserted successfully!")
@@ -134,5 +148,323 @@ def insert_sample_data():
     print("- QR-RICE001: Basmati Rice (Complete supply chain)")
     print("- QR-WHEAT002: Wheat (Farmer + Distributor stages)")
 
+
+# Large-scale synthetic data for benchmarking
+STAGES = ['farmer', 'distributor', 'retailer', 'customer']
+DEFAULT_STAGE_MIX = 'farmer=0.15,distributor=0.25,retailer=0.35,customer=0.25'
+ROLE_MIX = [('farmer', 0.45), ('distributor', 0.1), ('retailer', 0.25), ('customer', 0.2)]
+SEED_TABLES = ['users', 'products', 'farmer_records', 'distributor_records',
+               'retailer_records', 'customer_transactions', 'supply_chain_tracking']
+SEED_EPOCH = datetime(2025, 1, 1)
+
+CROPS = [
+    ('Basmati Rice', 'Grains', 60, 140), ('Wheat', 'Grains', 20, 35), ('Maize', 'Grains', 15, 30),
+    ('Toor Dal', 'Pulses', 80, 160), ('Chana', 'Pulses', 50, 90), ('Moong', 'Pulses', 70, 130),
+    ('Onion', 'Vegetables', 10, 45), ('Tomato', 'Vegetables', 8, 60), ('Potato', 'Vegetables', 10, 30),
+    ('Alphonso Mango', 'Fruits', 150, 600), ('Banana', 'Fruits', 20, 50), ('Pomegranate', 'Fruits', 60, 180),
+    ('Turmeric', 'Spices', 70, 160), ('Cardamom', 'Spices', 900, 2200), ('Cotton', 'Fibre', 55, 75),
+]
+FARM_LOCATIONS = ['Ludhiana, Punjab', 'Karnal, Haryana', 'Nashik, Maharashtra', 'Guntur, Andhra Pradesh',
+                  'Indore, Madhya Pradesh', 'Ratnagiri, Maharashtra', 'Erode, Tamil Nadu',
+                  'Idukki, Kerala', 'Bardhaman, West Bengal', 'Kota, Rajasthan']
+STORAGE_LOCATIONS = ['Delhi Warehouse', 'Gurgaon Hub', 'Mumbai Cold Store', 'Bengaluru DC',
+                     'Kolkata Depot', 'Hyderabad Hub', 'Chennai Cold Chain', 'Ahmedabad Depot']
+RETAIL_LOCATIONS = ['Mumbai Central', 'Andheri, Mumbai', 'Connaught Place, Delhi', 'Koramangala, Bengaluru',
+                    'Salt Lake, Kolkata', 'T Nagar, Chennai', 'Banjara Hills, Hyderabad', 'Navrangpura, Ahmedabad']
+# Approximate coordinates of each place; seeded records are scattered around them
+PLACE_COORDINATES = {
+    'Ludhiana, Punjab': (30.90, 75.85), 'Karnal, Haryana': (29.69, 76.99),
+    'Nashik, Maharashtra': (19.99, 73.79), 'Guntur, Andhra Pradesh': (16.31, 80.44),
+    'Indore, Madhya Pradesh': (22.72, 75.86), 'Ratnagiri, Maharashtra': (16.99, 73.31),
+    'Erode, Tamil Nadu': (11.34, 77.72), 'Idukki, Kerala': (9.85, 76.97),
+    'Bardhaman, West Bengal': (23.23, 87.86), 'Kota, Rajasthan': (25.18, 75.83),
+    'Delhi Warehouse': (28.70, 77.10), 'Gurgaon Hub': (28.46, 77.03), 'Mumbai Cold Store': (19.08, 72.88),
+    'Bengaluru DC': (12.97, 77.59), 'Kolkata Depot': (22.57, 88.36), 'Hyderabad Hub': (17.39, 78.49),
+    'Chennai Cold Chain': (13.08, 80.27), 'Ahmedabad Depot': (23.02, 72.57),
+    'Mumbai Central': (18.97, 72.82), 'Andheri, Mumbai': (19.12, 72.85),
+    'Connaught Place, Delhi': (28.63, 77.22), 'Koramangala, Bengaluru': (12.93, 77.63),
+    'Salt Lake, Kolkata': (22.58, 88.41), 'T Nagar, Chennai': (13.04, 80.23),
+    'Banjara Hills, Hyderabad': (17.41, 78.44), 'Navrangpura, Ahmedabad': (23.04, 72.56),
+}
+FARMING_METHODS = ['Organic', 'Traditional', 'Natural', 'Hydroponic', 'Integrated']
+TRANSPORT_METHODS = ['Refrigerated Truck', 'Standard Truck', 'Rail', 'Tempo']
+
+
+def parse_stage_mix(text):
+    """Parse 'farmer=0.2,distributor=0.3,...' into cumulative weights over STAGES"""
+    weights = dict.fromkeys(STAGES, 0.0)
+    for part in text.split(','):
+        stage, _, weight = part.partition('=')
+        stage = stage.strip()
+        if stage not in weights:
+            raise ValueError(f"Unknown stage in --stage-mix: {stage!r}")
+        weights[stage] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError('--stage-mix weights must add up to more than zero')
+    return [weights[stage] / total for stage in STAGES]
+
+
+def timestamp(moment):
+    return moment.isoformat(' ', 'seconds')
+
+
+def day(moment):
+    return moment.date().isoformat()
+
+
+def scatter(rng, place, spread):
+    """(latitude, longitude, geohash) of a point up to `spread` degrees from a place"""
+    latitude, longitude = PLACE_COORDINATES[place]
+    latitude = round(latitude + rng.uniform(-spread, spread), 5)
+    longitude = round(longitude + rng.uniform(-spread, spread), 5)
+    return latitude, longitude, geo.geohash(latitude, longitude)
+
+
+def generate_users(rng, count, first_id):
+    """Yield user rows (with explicit ids) split across roles by ROLE_MIX"""
+    password_hash = hash_password('password123')
+    roles = [role for role, _ in ROLE_MIX]
+    weights = [weight for _, weight in ROLE_MIX]
+    by_role = {role: [] for role in roles}
+    rows = []
+    for offset in range(count):
+        user_id = first_id + offset
+        # Guarantee every role exists even for tiny user counts
+        role = roles[offset] if offset < len(roles) else rng.choices(roles, weights)[0]
+        by_role[role].append(user_id)
+        username = f'seed_{role}_{user_id}'
+        rows.append((user_id, username, f'{username}@seed.krishichain.com', password_hash, role,
+                     f'Seed {role.title()} {user_id}', f'9{rng.randrange(10 ** 9):09d}',
+                     rng.choice(FARM_LOCATIONS if role == 'farmer' else RETAIL_LOCATIONS)))
+    return rows, by_role
+
+
+def generate_product_batch(seed, first_id, count, by_role, stage_weights, days):
+    """Build the rows of every table for one batch of products
+
+    Each batch has its own RNG derived from (seed, first_id), so output does not
+    depend on how batches are spread over worker processes.
+    """
+    rng = random.Random(f'{seed}:{first_id}')
+    batch = {table: [] for table in SEED_TABLES if table != 'users'}
+    for product_id in range(first_id, first_id + count):
+        stage = rng.choices(STAGES, stage_weights)[0]
+        depth = STAGES.index(stage)
+        crop, category, low_price, high_price = rng.choice(CROPS)
+        farmer_id = rng.choice(by_role['farmer'])
+        harvested = SEED_EPOCH + timedelta(days=rng.uniform(0, days))
+        registered = harvested + timedelta(hours=rng.uniform(1, 48))
+        updated = registered
+        farmer_price = round(rng.uniform(low_price, high_price), 2)
+        farm_location = rng.choice(FARM_LOCATIONS)
+        quantity = str(rng.choice([50, 100, 200, 250, 500, 1000]))
+        method = rng.choice(FARMING_METHODS)
+        qr_code = f'QR-S{product_id:011X}'
+
+        farmer_details = {'product_name': crop, 'quantity': quantity, 'unit': 'kg',
+                          'farmer_price': farmer_price, 'farm_location': farm_location,
+                          'harvest_date': day(harvested), 'category': category,
+                          'farming_method': method}
+        batch['farmer_records'].append((product_id, farmer_id, quantity, 'kg', farmer_price, farm_location,
+                                        farmer_details['harvest_date'], method, timestamp(registered),
+                                        *scatter(rng, farm_location, 0.5)))
+        batch['supply_chain_tracking'].append((product_id, 'farmer', farmer_id, 'Product Registered',
+                                               json.dumps(farmer_details), timestamp(registered)))
+
+        if depth >= 1:
+            distributor_id = rng.choice(by_role['distributor'])
+            shipped = registered + timedelta(days=rng.uniform(0.5, 5))
+            margin = round(farmer_price * rng.uniform(0.05, 0.3), 2)
+            details = {'qr_code': qr_code, 'distributor_name': f'Distributor {distributor_id}',
+                       'storage_location': rng.choice(STORAGE_LOCATIONS), 'distributor_margin': margin,
+                       'transport_date': day(shipped),
+                       'transport_method': rng.choice(TRANSPORT_METHODS)}
+            batch['distributor_records'].append((product_id, distributor_id, details['distributor_name'],
+                                                 details['storage_location'], margin, details['transport_date'],
+                                                 details['transport_method'], timestamp(shipped),
+                                                 *scatter(rng, details['storage_location'], 0.05)))
+            batch['supply_chain_tracking'].append((product_id, 'distributor', distributor_id,
+                                                   'Distributor Record Added', json.dumps(details),
+                                                   timestamp(shipped)))
+            updated = shipped
+
+            if depth >= 2:
+                retailer_id = rng.choice(by_role['retailer'])
+                shelved = shipped + timedelta(days=rng.uniform(0.5, 4))
+                final_price = round((farmer_price + margin) * rng.uniform(1.1, 1.6), 2)
+                details = {'qr_code': qr_code, 'shop_name': f'Shop {retailer_id}',
+                           'final_price': final_price, 'retail_location': rng.choice(RETAIL_LOCATIONS)}
+                batch['retailer_records'].append((product_id, retailer_id, details['shop_name'], final_price,
+                                                  details['retail_location'],
+                                                  day(shelved + timedelta(days=rng.randint(5, 180))),
+                                                  day(shelved), timestamp(shelved),
+                                                  *scatter(rng, details['retail_location'], 0.05)))
+                batch['supply_chain_tracking'].append((product_id, 'retailer', retailer_id,
+                                                       'Retailer Record Added', json.dumps(details),
+                                                       timestamp(shelved)))
+                updated = shelved
+
+                if depth >= 3:
+                    for _ in range(rng.randint(1, 3)):
+                        scanned = shelved + timedelta(days=rng.uniform(0, 10))
+                        batch['customer_transactions'].append((product_id, rng.choice(by_role['customer']),
+                                                               timestamp(scanned)))
+
+        batch['products'].append((product_id, qr_code, crop, category, stage,
+                                  timestamp(registered), timestamp(updated)))
+
+    # Hash-chain each product's events here so the writer only has to insert them
+    latest = {}
+    tracking = []
+    for product_id, stage, user_id, action, details, at in batch['supply_chain_tracking']:
+        prev_hash = latest.get(product_id, ledger.GENESIS_HASH)
+        latest[product_id] = ledger.event_hash(prev_hash, product_id, stage, user_id, action, details, at)
+        tracking.append((product_id, stage, user_id, action, details, at, prev_hash, latest[product_id]))
+    batch['supply_chain_tracking'] = tracking
+    return batch
+
+
+SEED_INSERTS = {
+    'products': '''INSERT INTO products (id, qr_code, product_name, category, current_stage, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+    'farmer_records': '''INSERT INTO farmer_records (product_id, farmer_id, quantity, unit, farmer_price,
+                          farm_location, harvest_date, farming_method, created_at, latitude, longitude,
+                          geohash)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'distributor_records': '''INSERT INTO distributor_records (product_id, distributor_id, distributor_name,
+                               storage_location, distributor_margin, transport_date, transport_method, created_at,
+                               latitude, longitude, geohash)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'retailer_records': '''INSERT INTO retailer_records (product_id, retailer_id, shop_name, final_price,
+                            retail_location, expiry_date, display_date, created_at, latitude, longitude,
+                            geohash)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'customer_transactions': '''INSERT INTO customer_transactions (product_id, customer_id, verification_date)
+                                VALUES (?, ?, ?)''',
+    'supply_chain_tracking': '''INSERT INTO supply_chain_tracking (product_id, stage, user_id, action, details,
+                                 timestamp, prev_hash, event_hash)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+}
+
+
+def write_batch(conn, batch):
+    """Insert one generated batch in a single transaction; returns the row count"""
+    rows_written = 0
+    for table, rows in batch.items():
+        conn.executemany(SEED_INSERTS[table], rows)
+        rows_written += len(rows)
+    conn.commit()
+    return rows_written
+
+
+def seed_database(database, users, products, stage_mix=DEFAULT_STAGE_MIX, seed=42, days=365,
+                  batch_size=20000, workers=None):
+    """Bulk-load synthetic users and supply chains; deterministic for a given seed"""
+    rng = random.Random(seed)
+    stage_weights = parse_stage_mix(stage_mix)
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(database)
+    # Relaxed durability while loading; the file is fsynced once at the end
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+    # Defer secondary index maintenance until all rows are in
+    indexes = conn.execute(f'''SELECT name, sql FROM sqlite_master
+                              WHERE type = 'index' AND sql IS NOT NULL
+                              AND tbl_name IN ({','.join('?' * len(SEED_TABLES))})''',
+                           SEED_TABLES).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+
+    # Summary triggers would look up rows through the dropped indexes; rebuild the summaries instead
+    triggers = conn.execute(f'''SELECT name, sql FROM sqlite_master WHERE type = 'trigger'
+                               AND tbl_name IN ({','.join('?' * len(SEED_TABLES))})''',
+                            SEED_TABLES).fetchall()
+    for name, _ in triggers:
+        conn.execute(f'DROP TRIGGER {name}')
+
+    try:
+        first_user_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        user_rows, by_role = generate_users(rng, users, first_user_id)
+        conn.executemany('''INSERT INTO users (id, username, email, password_hash, role, full_name, phone, address)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', user_rows)
+        conn.commit()
+
+        rows_written = len(user_rows)
+        first_product_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM products').fetchone()[0]
+        batch_starts = range(first_product_id, first_product_id + products, batch_size)
+        last_product_id = first_product_id + products
+
+        # Generate batches in worker processes while this one writes them in order,
+        # keeping only a few batches in flight to bound memory
+        workers = workers or os.cpu_count() or 1
+        pending = deque()
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for start in batch_starts:
+                pending.append(executor.submit(generate_product_batch, seed, start,
+                                               min(batch_size, last_product_id - start),
+                                               by_role, stage_weights, days))
+                while len(pending) > 2 * workers or (pending and start == batch_starts[-1]):
+                    batch = pending.popleft().result()
+                    rows_written += write_batch(conn, batch)
+                    done += len(batch['products'])
+                    print(f"  {done:,}/{products:,} products ({rows_written:,} rows, "
+                          f"{time.perf_counter() - started:.1f}s)")
+
+        # Lots past their expiry date are loaded as already marked, as of the day they became due
+        conn.execute('''UPDATE retailer_records SET expired_at = datetime(expiry_date, '+1 day')
+                        WHERE expired_at IS NULL AND expiry_date < date('now')''')
+        conn.commit()
+    finally:
+        # Rebuild the deferred indexes in one sorted pass each
+        for name, sql in indexes:
+            print(f"  building {name}")
+            conn.execute(sql)
+        for name, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+        print("  rebuilding markup summaries")
+        analytics.rebuild_markup_summary(conn)
+        print("  rebuilding search index")
+        search.rebuild_search_index(conn)
+        print("  sealing ledger batches")
+        while ledger.seal(conn, min_age=0) >= ledger.SEAL_CHUNK:
+            pass
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('ANALYZE')
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Seeded {users:,} users and {products:,} products ({rows_written:,} rows) "
+          f"in {elapsed:.1f}s ({rows_written / elapsed:,.0f} rows/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Insert KrishiChain sample data, or seed a large synthetic dataset')
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    parser.add_argument('--users', type=int, help='number of synthetic users to create')
+    parser.add_argument('--products', type=int, help='number of synthetic products to create')
+    parser.add_argument('--stage-mix', default=DEFAULT_STAGE_MIX,
+                        help='weights of the final stage each product reaches (default: %(default)s)')
+    parser.add_argument('--days', type=int, default=365, help='spread harvest dates over this many days')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=20000, help='products per transaction')
+    parser.add_argument('--workers', type=int, help='processes generating rows (default: CPU count)')
+    args = parser.parse_args()
+
+    migrate.migrate(args.database)
+    if args.users is None and args.products is None:
+        insert_sample_data(args.database)
+        return
+
+    seed_database(args.database, max(args.users or 1000, len(ROLE_MIX)), args.products or 0,
+                  stage_mix=args.stage_mix, seed=args.seed, days=args.days, batch_size=args.batch_size,
+                  workers=args.workers)
+
+
 if __name__ == '__main__':
-    insert_sample_data()
+    main()
@@ -0,0 +1,314 @@
+"""Tamper-evident ledger over supply_chain_tracking.
+
+Every tracking event carries event_hash = SHA-256 of its canonical content and
+the prev_hash of the previous event for the same product, so editing or
+removing an event breaks that product's chain. Events are also sealed, in id
+order, into batches whose Merkle root is stored in ledger_batches; proving an
+event belongs to a batch takes log2(batch size) sibling hashes, however large
+the ledger grows.
+
+Writers call chain_events() for the products they touched before committing.
+A background sealer in each process chains anything left over (seeded or
+pre-ledger rows) and seals new batches; sealing can also run from cron:
+
+    python ledger.py seal
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import archive
+from cache import TTLCache
+from database import DATABASE, connect
+
+GENESIS_HASH = '0' * 64
+BATCH_SIZE = int(os.environ.get('KRISHICHAIN_LEDGER_BATCH_SIZE', 1024))
+SEAL_INTERVAL = float(os.environ.get('KRISHICHAIN_LEDGER_SEAL_INTERVAL', 30))
+SEAL_CHUNK = int(os.environ.get('KRISHICHAIN_LEDGER_SEAL_CHUNK', 50000))
+
+# Sealed batches never change, so their trees can be kept indefinitely
+tree_cache = TTLCache(maxsize=int(os.environ.get('KRISHICHAIN_LEDGER_TREE_CACHE_SIZE', 256)),
+                      ttl=float('inf'))
+
+_event_columns = 'id, product_id, stage, user_id, action, details, timestamp'
+
+
+def event_hash(prev_hash, product_id, stage, user_id, action, details, timestamp):
+    """SHA-256 of an event's canonical JSON form, linked to the previous event of its product"""
+    canonical = json.dumps([prev_hash, product_id, stage, user_id, action, details, timestamp],
+                           separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def chain_events(conn, product_ids=None, limit=None):
+    """Hash unchained events in id order; returns how many were chained
+
+    With product_ids, only those products' events are chained (the write path);
+    otherwise the oldest unchained events of any product, up to limit.
+    """
+    if product_ids is not None:
+        rows = []
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), 500):
+            chunk = product_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows.extend(conn.execute(f'''SELECT {_event_columns} FROM supply_chain_tracking
+                                        WHERE product_id IN ({placeholders}) AND event_hash IS NULL''',
+                                     chunk).fetchall())
+        rows.sort(key=lambda row: row[0])
+    else:
+        rows = conn.execute(f'''SELECT {_event_columns} FROM supply_chain_tracking
+                               WHERE event_hash IS NULL ORDER BY id LIMIT ?''',
+                            (limit or -1,)).fetchall()
+
+    latest = {}
+    updates = []
+    for event_id, product_id, stage, user_id, action, details, timestamp in rows:
+        prev_hash = latest.get(product_id)
+        if prev_hash is None:
+            prev = conn.execute('''SELECT event_hash FROM supply_chain_tracking
+                                   WHERE product_id = ? AND id < ? ORDER BY id DESC LIMIT 1''',
+                                (product_id, event_id)).fetchone()
+            prev_hash = prev[0] if prev else GENESIS_HASH
+        latest[product_id] = event_hash(prev_hash, product_id, stage, user_id, action, details, timestamp)
+        updates.append((prev_hash, latest[product_id], event_id))
+
+    conn.executemany('UPDATE supply_chain_tracking SET prev_hash = ?, event_hash = ? WHERE id = ?', updates)
+    return len(updates)
+
+
+# Merkle trees; leaves and inner nodes are domain-separated so one cannot pose as the other
+def leaf_hash(event_hash_hex):
+    return hashlib.sha256(b'\x00' + bytes.fromhex(event_hash_hex)).hexdigest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def merkle_levels(event_hashes):
+    """All levels of the tree, leaves first; an odd node out is carried up unchanged"""
+    levels = [[leaf_hash(h) for h in event_hashes]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                       for i in range(0, len(level), 2)])
+    return levels
+
+
+def merkle_proof(levels, index):
+    """Sibling hashes from leaf `index` up to the root"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({'position': 'left' if sibling < index else 'right', 'hash': level[sibling]})
+        index //= 2
+    return proof
+
+
+def verify_proof(event_hash_hex, proof, root):
+    """Recompute the root from an event hash and its proof"""
+    current = leaf_hash(event_hash_hex)
+    for step in proof:
+        if step['position'] == 'left':
+            current = node_hash(step['hash'], current)
+        else:
+            current = node_hash(current, step['hash'])
+    return current == root
+
+
+def seal(conn, batch_size=BATCH_SIZE, max_events=SEAL_CHUNK, min_age=SEAL_INTERVAL):
+    """Chain leftover events and seal new Merkle batches in one transaction; returns events sealed
+
+    Full batches are sealed right away. A trailing partial batch is only sealed
+    once min_age seconds have passed since the last seal, so frequent calls from
+    several workers do not fragment the ledger into tiny batches.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        chain_events(conn, limit=max_events)
+        last_sealed = conn.execute('SELECT COALESCE(MAX(last_event_id), 0) FROM ledger_batches').fetchone()[0]
+        seal_partial = conn.execute("SELECT COALESCE(MAX(sealed_at) <= datetime('now', ?), 1) FROM ledger_batches",
+                                    (f'-{min_age} seconds',)).fetchone()[0]
+
+        sealed = 0
+        while sealed < max_events:
+            rows = conn.execute('''SELECT id, event_hash FROM supply_chain_tracking
+                                   WHERE id > ? ORDER BY id LIMIT ?''', (last_sealed, batch_size)).fetchall()
+            # Stop at the first event that is not chained yet; batches must be contiguous
+            for index, row in enumerate(rows):
+                if row[1] is None:
+                    rows = rows[:index]
+                    break
+            if not rows or (len(rows) < batch_size and not seal_partial):
+                break
+            levels = merkle_levels([row[1] for row in rows])
+            conn.execute('''INSERT INTO ledger_batches (first_event_id, last_event_id, event_count, merkle_root)
+                            VALUES (?, ?, ?, ?)''', (rows[0][0], rows[-1][0], len(rows), levels[-1][0]))
+            last_sealed = rows[-1][0]
+            sealed += len(rows)
+            if len(rows) < batch_size:
+                break
+        conn.commit()
+        return sealed
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def sealed_events(conn, first_event_id, last_event_id):
+    """(id, event_hash) of the events in an id range, archived ones included"""
+    if not archive.attach(conn):
+        return conn.execute('''SELECT id, event_hash FROM supply_chain_tracking
+                               WHERE id BETWEEN ? AND ? ORDER BY id''', (first_event_id, last_event_id)).fetchall()
+    # UNION also drops the duplicate left by an interrupted archival run
+    return conn.execute('''SELECT id, event_hash FROM main.supply_chain_tracking WHERE id BETWEEN ? AND ?
+                           UNION
+                           SELECT id, event_hash FROM archive.supply_chain_tracking WHERE id BETWEEN ? AND ?
+                           ORDER BY id''', (first_event_id, last_event_id) * 2).fetchall()
+
+
+def batch_levels(conn, batch):
+    """Merkle levels of a sealed batch, rebuilt from its events on a cache miss"""
+    levels = tree_cache.get(batch['id'])
+    if levels is None:
+        hashes = [row[1] for row in sealed_events(conn, batch['first_event_id'], batch['last_event_id'])]
+        levels = merkle_levels(hashes)
+        tree_cache.set(batch['id'], levels)
+    return levels
+
+
+def event_proof(conn, event_id):
+    """Inclusion proof for one event; None if it does not exist
+
+    Returns the event's hashes, whether its content still matches event_hash,
+    and, once sealed, its batch and the proof against the batch's Merkle root.
+    """
+    event = conn.execute(f'SELECT {_event_columns}, prev_hash, event_hash FROM supply_chain_tracking WHERE id = ?',
+                         (event_id,)).fetchone()
+    if event is None and archive.attach(conn):
+        event = conn.execute(f'''SELECT {_event_columns}, prev_hash, event_hash FROM archive.supply_chain_tracking
+                                 WHERE id = ?''', (event_id,)).fetchone()
+    if event is None:
+        return None
+    event_id, product_id, stage, user_id, action, details, timestamp, prev_hash, stored_hash = event
+    result = {
+        'event_id': event_id,
+        'product_id': product_id,
+        'prev_hash': prev_hash,
+        'event_hash': stored_hash,
+        'content_valid': stored_hash is not None and stored_hash == event_hash(
+            prev_hash, product_id, stage, user_id, action, details, timestamp),
+        'sealed': False,
+    }
+
+    batch = conn.execute('''SELECT id, first_event_id, last_event_id, event_count, merkle_root, sealed_at
+                            FROM ledger_batches WHERE last_event_id >= ?
+                            ORDER BY last_event_id LIMIT 1''', (event_id,)).fetchone()
+    if batch is None or batch[1] > event_id or stored_hash is None:
+        return result
+    batch = dict(zip(['id', 'first_event_id', 'last_event_id', 'event_count', 'merkle_root', 'sealed_at'], batch))
+
+    levels = batch_levels(conn, batch)
+    index = len(sealed_events(conn, batch['first_event_id'], event_id - 1))
+    proof = merkle_proof(levels, index)
+    result.update({
+        'sealed': True,
+        'batch': batch,
+        'leaf_index': index,
+        'proof': proof,
+        # Rows added to or removed from a sealed range change the rebuilt root
+        'proof_valid': len(levels[0]) == batch['event_count'] and verify_proof(stored_hash, proof,
+                                                                                batch['merkle_root']),
+    })
+    return result
+
+
+def verify_chain(conn, product_id, schema='main'):
+    """Recompute a product's hash chain (schema='archive' for archived products); returns its events"""
+    events = []
+    expected_prev = GENESIS_HASH
+    for row in conn.execute(f'''SELECT {_event_columns}, prev_hash, event_hash FROM {schema}.supply_chain_tracking
+                               WHERE product_id = ? ORDER BY id''', (product_id,)):
+        event_id, product_id, stage, user_id, action, details, timestamp, prev_hash, stored_hash = row
+        valid = (stored_hash is not None and prev_hash == expected_prev and
+                 stored_hash == event_hash(prev_hash, product_id, stage, user_id, action, details, timestamp))
+        events.append({'event_id': event_id, 'stage': stage, 'action': action, 'timestamp': timestamp,
+                       'prev_hash': prev_hash, 'event_hash': stored_hash, 'valid': valid})
+        expected_prev = stored_hash
+    return events
+
+
+class LedgerSealer:
+    """Background thread that periodically chains and seals the ledger"""
+
+    def __init__(self, interval=SEAL_INTERVAL):
+        self.interval = interval
+        self.sealed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        # The sealer thread does not survive a fork, so start one per process
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            threading.Thread(target=self._run, name='ledger-sealer', daemon=True).start()
+
+    def _run(self):
+        conn = connect()
+        try:
+            while not self._stopping.wait(self.interval):
+                try:
+                    # Keep going while there is a backlog, one short transaction at a time
+                    while True:
+                        sealed = seal(conn)
+                        self.sealed += sealed
+                        if sealed < SEAL_CHUNK:
+                            break
+                except sqlite3.Error as e:
+                    self.failed += 1
+                    print(f"Ledger seal failed: {e}")
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stopping.set()
+
+
+sealer = LedgerSealer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain ledger maintenance')
+    parser.add_argument('command', choices=['seal'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    conn = connect(args.database)
+    total = 0
+    while True:
+        sealed = seal(conn, min_age=0)
+        total += sealed
+        if sealed < SEAL_CHUNK:
+            break
+        print(f"  sealed {total:,} events")
+    batches = conn.execute('SELECT COUNT(*) FROM ledger_batches').fetchone()[0]
+    conn.close()
+    print(f"✅ Sealed {total:,} events ({batches:,} batches in the ledger)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
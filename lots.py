@@ -0,0 +1,142 @@
+"""Lot lineage: splits, merges and the closure table behind provenance and recall.
+
+A lot (one row of products) can be split into smaller lots or merged with
+others into a new one. lot_links records every parent -> child edge and a
+trigger keeps lot_lineage, the transitive closure of those edges, current (see
+migrations/0009_lot_lineage.sql), so all ancestors or all descendants of a lot
+are one index range scan. A lot that has been split or merged is consumed:
+it takes no new stage records and cannot be split or merged again. Links are
+only ever added by the app; after editing
+lot_links by hand, recompute the closure with:
+
+    python lots.py rebuild
+"""
+import argparse
+import sys
+import time
+
+from database import DATABASE, connect
+
+
+def find_lots(conn, qr_codes):
+    """Look up lots by QR code; returns {qr_code: row}"""
+    found = {}
+    for start in range(0, len(qr_codes), 500):
+        chunk = qr_codes[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'''SELECT id, qr_code, product_name, category, description, current_stage,
+                                           consumed_at
+                                    FROM products WHERE qr_code IN ({placeholders})''', chunk):
+            found[row['qr_code']] = row
+    return found
+
+
+def creates_cycle(conn, parent_id, child_id):
+    """Whether linking parent_id -> child_id would make a lot its own ancestor"""
+    return parent_id == child_id or conn.execute(
+        'SELECT 1 FROM lot_lineage WHERE ancestor_id = ? AND descendant_id = ?',
+        (child_id, parent_id)).fetchone() is not None
+
+
+def related_lots(conn, product_ids):
+    """Whether any of the lots was made, directly or not, from another of them"""
+    placeholders = ','.join('?' * len(product_ids))
+    return conn.execute(f'''SELECT 1 FROM lot_lineage
+                            WHERE ancestor_id IN ({placeholders}) AND descendant_id IN ({placeholders})
+                            LIMIT 1''', list(product_ids) * 2).fetchone() is not None
+
+
+def parse_quantity(value):
+    """A positive lot quantity as a float, or None"""
+    try:
+        quantity = float(value)
+    except (TypeError, ValueError):
+        return None
+    # Written so NaN and infinity fail too
+    return quantity if 0 < quantity < float('inf') else None
+
+
+def lot_quantity(conn, product_id):
+    """How much a lot holds: its farmer record's quantity, else what its parents put in; None if unknown"""
+    row = conn.execute('SELECT quantity FROM farmer_records WHERE product_id = ? ORDER BY id LIMIT 1',
+                       (product_id,)).fetchone()
+    if row:
+        return parse_quantity(row[0])
+    quantities = [parse_quantity(row[0]) for row in
+                  conn.execute('SELECT quantity FROM lot_links WHERE child_id = ?', (product_id,))]
+    if not quantities or None in quantities:
+        return None
+    return sum(quantities)
+
+
+def consume_lots(conn, product_ids):
+    """Mark lots as used up by a split or merge; returns False if one already was
+
+    Checked under the write lock, so of two concurrent splits of a lot only one
+    succeeds; the caller rolls back on False.
+    """
+    consumed = 0
+    for product_id in product_ids:
+        consumed += conn.execute('''UPDATE products SET consumed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                                    WHERE id = ? AND consumed_at IS NULL''', (product_id,)).rowcount
+    return consumed == len(product_ids)
+
+
+def link_lots(conn, child_id, parents):
+    """Record that child_id was made from parents, a list of (parent_id, quantity)"""
+    conn.executemany('''INSERT INTO lot_links (parent_id, child_id, quantity) VALUES (?, ?, ?)
+                        ON CONFLICT (parent_id, child_id) DO NOTHING''',
+                     [(parent_id, child_id, quantity) for parent_id, quantity in parents])
+
+
+def descendant_qr_codes(conn, product_id):
+    """QR codes of every lot made, directly or not, from a lot"""
+    return [row[0] for row in conn.execute('''SELECT p.qr_code FROM lot_lineage l
+                                              JOIN products p ON p.id = l.descendant_id
+                                              WHERE l.ancestor_id = ?''', (product_id,))]
+
+
+def recall(conn, product_id, stage=None):
+    """The lot and every lot made from it, nearest first, with the shop each one reached"""
+    params = [product_id, product_id]
+    where = ''
+    if stage:
+        where = 'WHERE p.current_stage = ?'
+        params.append(stage)
+    rows = conn.execute(f'''SELECT p.qr_code, p.product_name, p.category, p.current_stage, l.depth,
+                                   rr.shop_name, rr.retail_location
+                            FROM (SELECT ? AS id, 0 AS depth
+                                  UNION ALL
+                                  SELECT descendant_id, depth FROM lot_lineage WHERE ancestor_id = ?) l
+                            JOIN products p ON p.id = l.id
+                            LEFT JOIN retailer_records rr ON rr.id = (
+                                SELECT id FROM retailer_records WHERE product_id = p.id ORDER BY id LIMIT 1)
+                            {where}
+                            ORDER BY l.depth, p.id''', params).fetchall()
+    return [dict(row) for row in rows]
+
+
+def rebuild_lineage(conn):
+    """Recompute lot_lineage from lot_links in one transaction; returns the row count"""
+    conn.execute('DELETE FROM lot_lineage')
+    conn.execute('INSERT INTO lot_lineage SELECT * FROM lot_lineage_source')
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM lot_lineage').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain lot lineage maintenance')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = connect(args.database)
+    rows = rebuild_lineage(conn)
+    conn.close()
+    print(f"✅ Rebuilt lot_lineage ({rows:,} ancestor/descendant pairs) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Versioned schema migrations.
+
+Migrations are the numbered SQL files in migrations/ (NNNN_description.sql).
+The schema version lives in PRAGMA user_version, so checking whether a database
+is current is a single header read. Each migration normally runs in one
+transaction together with its version bump. A file containing the directive
+
+    -- migrate: no-transaction
+
+instead runs statement by statement, each committed on its own. Index builds
+use this so a large table only holds the write lock for one index at a time
+(WAL readers are never blocked); such files must be idempotent (IF NOT EXISTS)
+so an interrupted run can simply be repeated.
+
+    python migrate.py status
+    python migrate.py migrate
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from database import DATABASE, connect, file_lock
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+NO_TRANSACTION = '-- migrate: no-transaction'
+
+_migration_file = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def read(self):
+        with open(self.path, 'r') as f:
+            return f.read()
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """Numbered migrations in version order"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _migration_file.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort(key=lambda migration: migration.version)
+    for expected, migration in enumerate(migrations, start=1):
+        if migration.version != expected:
+            raise RuntimeError(f"Migration {expected:04d} is missing (found {migration.version:04d})")
+    return migrations
+
+
+MIGRATIONS = load_migrations()
+LATEST_VERSION = MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def split_statements(sql):
+    """Split a SQL script into complete statements (triggers keep their inner semicolons)"""
+    statements = []
+    current = ''
+    for line in sql.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ''
+    if current.strip() and not all(l.strip().startswith('--') or not l.strip() for l in current.splitlines()):
+        statements.append(current.strip())
+    return statements
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def apply_migration(conn, migration):
+    sql = migration.read()
+    if NO_TRANSACTION in sql:
+        for statement in split_statements(sql):
+            conn.execute(statement)
+            conn.commit()
+        conn.execute(f'PRAGMA user_version = {migration.version}')
+        conn.commit()
+    else:
+        # One transaction for the whole file and its version bump
+        try:
+            conn.executescript(f'BEGIN;\n{sql}\n;PRAGMA user_version = {migration.version};\nCOMMIT;')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+
+def pending_migrations(path=None):
+    """Migrations not yet applied to the database"""
+    conn = connect(path)
+    try:
+        version = schema_version(conn)
+    finally:
+        conn.close()
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def migrate(path=None, verbose=False):
+    """Apply pending migrations; returns how many were applied
+
+    The common case, an up-to-date database, is one PRAGMA read without locking.
+    """
+    path = path or DATABASE
+    conn = connect(path)
+    try:
+        if schema_version(conn) >= LATEST_VERSION:
+            return 0
+    finally:
+        conn.close()
+
+    # Only one process migrates; the others wait and then find nothing to do
+    with file_lock(path + '.init.lock'):
+        conn = connect(path)
+        applied = 0
+        try:
+            for migration in MIGRATIONS:
+                if migration.version <= schema_version(conn):
+                    continue
+                started = time.perf_counter()
+                apply_migration(conn, migration)
+                applied += 1
+                if verbose:
+                    print(f"Applied {migration.version:04d}_{migration.name} "
+                          f"in {time.perf_counter() - started:.2f}s")
+            if applied:
+                conn.execute('PRAGMA optimize')
+        finally:
+            conn.close()
+        return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain schema migrations')
+    parser.add_argument('command', choices=['status', 'migrate'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        pending = pending_migrations(args.database)
+        print(f"Schema version {LATEST_VERSION - len(pending)} of {LATEST_VERSION}")
+        for migration in pending:
+            print(f"  pending: {migration.version:04d}_{migration.name}")
+        return 0
+
+    applied = migrate(args.database, verbose=True)
+    print(f"✅ {applied} migration(s) applied" if applied else "✅ Schema is up to date")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
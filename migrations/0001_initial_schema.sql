@@ -1,12 +1,14 @@
 
 -- KrishiChain Database Schema
+-- Migration 0001: base tables. IF NOT EXISTS lets it complete databases created
+-- by the old init, whose ENUM columns left some tables missing.
 -- Users table for authentication
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username VARCHAR(100) UNIQUE NOT NULL,
     email VARCHAR(255) UNIQUE NOT NULL,
     password_hash VARCHAR(255) NOT NULL,
-    role ENUM('farmer', 'distributor', 'retailer', 'customer') NOT NULL,
+    role TEXT NOT NULL CHECK(role IN ('farmer', 'distributor', 'retailer', 'customer')),
     full_name VARCHAR(255) NOT NULL,
     phone VARCHAR(20),
     address TEXT,
@@ -14,19 +16,19 @@ CREATE TABLE users (
 );
 
 -- Products table for basic product information
-CREATE TABLE products (
+CREATE TABLE IF NOT EXISTS products (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     qr_code VARCHAR(50) UNIQUE NOT NULL,
     product_name VARCHAR(255) NOT NULL,
     category VARCHAR(100),
     description TEXT,
-    current_stage ENUM('farmer', 'distributor', 'retailer', 'customer') DEFAULT 'farmer',
+    current_stage TEXT DEFAULT 'farmer' CHECK(current_stage IN ('farmer', 'distributor', 'retailer', 'customer')),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Farmer records table
-CREATE TABLE farmer_records (
+CREATE TABLE IF NOT EXISTS farmer_records (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     product_id INTEGER NOT NULL,
     farmer_id INTEGER NOT NULL,
@@ -44,7 +46,7 @@ CREATE TABLE farmer_records (
 );
 
 -- Distributor records table
-CREATE TABLE distributor_records (
+CREATE TABLE IF NOT EXISTS distributor_records (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     product_id INTEGER NOT NULL,
     distributor_id INTEGER NOT NULL,
@@ -61,7 +63,7 @@ CREATE TABLE distributor_records (
 );
 
 -- Retailer records table
-CREATE TABLE retailer_records (
+CREATE TABLE IF NOT EXISTS retailer_records (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     product_id INTEGER NOT NULL,
     retailer_id INTEGER NOT NULL,
@@ -77,12 +79,12 @@ CREATE TABLE retailer_records (
 );
 
 -- Customer transactions table
-CREATE TABLE customer_transactions (
+CREATE TABLE IF NOT EXISTS customer_transactions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     product_id INTEGER NOT NULL,
     customer_id INTEGER,
     verification_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    purchase_status ENUM('verified', 'purchased') DEFAULT 'verified',
+    purchase_status TEXT DEFAULT 'verified' CHECK(purchase_status IN ('verified', 'purchased')),
     feedback_rating INTEGER CHECK(feedback_rating >= 1 AND feedback_rating <= 5),
     feedback_comment TEXT,
     FOREIGN KEY (product_id) REFERENCES products(id),
@@ -90,7 +92,7 @@ CREATE TABLE customer_transactions (
 );
 
 -- Supply chain tracking table
-CREATE TABLE supply_chain_tracking (
+CREATE TABLE IF NOT EXISTS supply_chain_tracking (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     product_id INTEGER NOT NULL,
     stage VARCHAR(50) NOT NULL,
@@ -103,8 +105,8 @@ CREATE TABLE supply_chain_tracking (
 );
 
 -- Indexes for better performance
-CREATE INDEX idx_products_qr_code ON products(qr_code);
-CREATE INDEX idx_products_stage ON products(current_stage);
-CREATE INDEX idx_users_role ON users(role);
-CREATE INDEX idx_supply_chain_product ON supply_chain_tracking(product_id);
-CREATE INDEX idx_supply_chain_stage ON supply_chain_tracking(stage);
+CREATE INDEX IF NOT EXISTS idx_products_qr_code ON products(qr_code);
+CREATE INDEX IF NOT EXISTS idx_products_stage ON products(current_stage);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users(role);
+CREATE INDEX IF NOT EXISTS idx_supply_chain_product ON supply_chain_tracking(product_id);
+CREATE INDEX IF NOT EXISTS idx_supply_chain_stage ON supply_chain_tracking(stage);
@@ -0,0 +1,9 @@
+-- Migration 0002: indexes behind the single-statement verify-product query
+-- migrate: no-transaction
+CREATE INDEX IF NOT EXISTS idx_supply_chain_product_time ON supply_chain_tracking(product_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_farmer_records_product ON farmer_records(product_id);
+CREATE INDEX IF NOT EXISTS idx_distributor_records_product ON distributor_records(product_id);
+CREATE INDEX IF NOT EXISTS idx_retailer_records_product ON retailer_records(product_id);
+
+-- Superseded by idx_supply_chain_product_time
+DROP INDEX IF EXISTS idx_supply_chain_product;
@@ -0,0 +1,5 @@
+-- Migration 0003: covering indexes for the keyset-paginated dashboards
+-- migrate: no-transaction
+CREATE INDEX IF NOT EXISTS idx_farmer_records_dashboard ON farmer_records(farmer_id, created_at, id, product_id, quantity, farmer_price, harvest_date);
+CREATE INDEX IF NOT EXISTS idx_distributor_records_dashboard ON distributor_records(distributor_id, created_at, id, product_id, distributor_name, transport_date, storage_location);
+CREATE INDEX IF NOT EXISTS idx_retailer_records_dashboard ON retailer_records(retailer_id, created_at, id, product_id, shop_name, final_price, retail_location);
@@ -0,0 +1,15 @@
+-- Migration 0004: hash-chained tracking events and sealed Merkle batches
+ALTER TABLE supply_chain_tracking ADD COLUMN prev_hash TEXT;
+ALTER TABLE supply_chain_tracking ADD COLUMN event_hash TEXT;
+
+-- Contiguous id ranges of tracking events sealed under one Merkle root
+CREATE TABLE IF NOT EXISTS ledger_batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_event_id INTEGER NOT NULL,
+    last_event_id INTEGER NOT NULL,
+    event_count INTEGER NOT NULL,
+    merkle_root TEXT NOT NULL,
+    sealed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ledger_batches_last_event ON ledger_batches(last_event_id);
@@ -0,0 +1,3 @@
+-- Migration 0005: find events that still need hashing without scanning the table
+-- migrate: no-transaction
+CREATE INDEX IF NOT EXISTS idx_supply_chain_unchained ON supply_chain_tracking(id) WHERE event_hash IS NULL;
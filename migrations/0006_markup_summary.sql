@@ -0,0 +1,86 @@
+-- Migration 0006: farm-to-shelf markup summaries, maintained by triggers
+-- Keyed by product category, farm region (the last comma-separated part of
+-- farm_location) and harvest month, which are all known from the farmer record,
+-- so every later stage of a product updates the same row.
+CREATE TABLE IF NOT EXISTS markup_summary (
+    category VARCHAR(100) NOT NULL,
+    region VARCHAR(255) NOT NULL,
+    month CHAR(7) NOT NULL,
+    farmer_count INTEGER NOT NULL DEFAULT 0,
+    farmer_price_sum REAL NOT NULL DEFAULT 0,
+    distributor_count INTEGER NOT NULL DEFAULT 0,
+    distributor_margin_sum REAL NOT NULL DEFAULT 0,
+    -- Products that reached a retailer, with the prices along their whole chain
+    retailer_count INTEGER NOT NULL DEFAULT 0,
+    retail_farmer_price_sum REAL NOT NULL DEFAULT 0,
+    retail_margin_sum REAL NOT NULL DEFAULT 0,
+    final_price_sum REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, region, month)
+) WITHOUT ROWID;
+
+-- The farmer record of each product with its summary key
+CREATE VIEW IF NOT EXISTS markup_keys AS
+SELECT fr.product_id,
+       COALESCE(p.category, '') AS category,
+       trim(substr(fr.farm_location, length(rtrim(fr.farm_location, replace(fr.farm_location, ',', ''))) + 1)) AS region,
+       substr(fr.harvest_date, 1, 7) AS month,
+       fr.farmer_price
+FROM farmer_records fr
+JOIN products p ON p.id = fr.product_id;
+
+-- Full recomputation, used to backfill and by `python analytics.py rebuild`
+CREATE VIEW IF NOT EXISTS markup_summary_source AS
+SELECT k.category, k.region, k.month,
+       COUNT(*) AS farmer_count,
+       SUM(k.farmer_price) AS farmer_price_sum,
+       COUNT(d.margin) AS distributor_count,
+       COALESCE(SUM(d.margin), 0) AS distributor_margin_sum,
+       COUNT(r.final_price) AS retailer_count,
+       COALESCE(SUM(CASE WHEN r.final_price IS NOT NULL THEN k.farmer_price END), 0) AS retail_farmer_price_sum,
+       COALESCE(SUM(CASE WHEN r.final_price IS NOT NULL THEN COALESCE(d.margin, 0) END), 0) AS retail_margin_sum,
+       COALESCE(SUM(r.final_price), 0) AS final_price_sum
+FROM markup_keys k
+LEFT JOIN (SELECT product_id, MIN(id), distributor_margin AS margin
+           FROM distributor_records GROUP BY product_id) d ON d.product_id = k.product_id
+LEFT JOIN (SELECT product_id, MIN(id), final_price
+           FROM retailer_records GROUP BY product_id) r ON r.product_id = k.product_id
+GROUP BY k.category, k.region, k.month;
+
+CREATE TRIGGER IF NOT EXISTS markup_farmer_insert AFTER INSERT ON farmer_records
+BEGIN
+    INSERT INTO markup_summary (category, region, month, farmer_count, farmer_price_sum)
+    SELECT COALESCE(p.category, ''),
+           trim(substr(NEW.farm_location, length(rtrim(NEW.farm_location, replace(NEW.farm_location, ',', ''))) + 1)),
+           substr(NEW.harvest_date, 1, 7), 1, NEW.farmer_price
+    FROM products p WHERE p.id = NEW.product_id
+    ON CONFLICT (category, region, month) DO UPDATE SET
+        farmer_count = farmer_count + 1,
+        farmer_price_sum = farmer_price_sum + excluded.farmer_price_sum;
+END;
+
+CREATE TRIGGER IF NOT EXISTS markup_distributor_insert AFTER INSERT ON distributor_records
+WHEN NOT EXISTS (SELECT 1 FROM distributor_records WHERE product_id = NEW.product_id AND id < NEW.id)
+BEGIN
+    UPDATE markup_summary SET
+        distributor_count = distributor_count + 1,
+        distributor_margin_sum = distributor_margin_sum + NEW.distributor_margin
+    WHERE (category, region, month) = (SELECT category, region, month FROM markup_keys
+                                       WHERE product_id = NEW.product_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS markup_retailer_insert AFTER INSERT ON retailer_records
+WHEN NOT EXISTS (SELECT 1 FROM retailer_records WHERE product_id = NEW.product_id AND id < NEW.id)
+BEGIN
+    UPDATE markup_summary SET
+        retailer_count = retailer_count + 1,
+        retail_farmer_price_sum = retail_farmer_price_sum +
+            (SELECT farmer_price FROM markup_keys WHERE product_id = NEW.product_id),
+        retail_margin_sum = retail_margin_sum + COALESCE(
+            (SELECT distributor_margin FROM distributor_records WHERE product_id = NEW.product_id
+             ORDER BY id LIMIT 1), 0),
+        final_price_sum = final_price_sum + NEW.final_price
+    WHERE (category, region, month) = (SELECT category, region, month FROM markup_keys
+                                       WHERE product_id = NEW.product_id);
+END;
+
+INSERT OR REPLACE INTO markup_summary SELECT * FROM markup_summary_source;
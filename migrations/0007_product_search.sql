@@ -0,0 +1,51 @@
+-- Migration 0007: full-text product search
+-- One FTS5 row per product (rowid = products.id) holding the product's text
+-- and its farmer record's location and farming method.
+CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+    product_name, category, description, farm_location, farming_method,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- Names weigh most in the ranking, then categories
+INSERT INTO product_search (product_search, rank) VALUES ('rank', 'bm25(10.0, 5.0, 2.0, 1.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON products
+BEGIN
+    INSERT INTO product_search (rowid, product_name, category, description)
+    VALUES (NEW.id, NEW.product_name, NEW.category, NEW.description);
+END;
+
+-- Stage changes touch products on every hand-off; only reindex when the text changes
+CREATE TRIGGER IF NOT EXISTS product_search_update AFTER UPDATE OF product_name, category, description ON products
+BEGIN
+    UPDATE product_search SET product_name = NEW.product_name, category = NEW.category,
+                              description = NEW.description
+    WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON products
+BEGIN
+    DELETE FROM product_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_search_farmer_insert AFTER INSERT ON farmer_records
+BEGIN
+    UPDATE product_search SET farm_location = NEW.farm_location, farming_method = NEW.farming_method
+    WHERE rowid = NEW.product_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_search_farmer_update AFTER UPDATE OF farm_location, farming_method ON farmer_records
+BEGIN
+    UPDATE product_search SET farm_location = NEW.farm_location, farming_method = NEW.farming_method
+    WHERE rowid = NEW.product_id;
+END;
+
+-- Full index contents, used to backfill and by `python search.py rebuild`
+CREATE VIEW IF NOT EXISTS product_search_source AS
+SELECT p.id, p.product_name, p.category, p.description, fr.farm_location, fr.farming_method
+FROM products p
+LEFT JOIN farmer_records fr ON fr.id = (SELECT MIN(id) FROM farmer_records WHERE product_id = p.id);
+
+INSERT INTO product_search (rowid, product_name, category, description, farm_location, farming_method)
+SELECT * FROM product_search_source;
@@ -0,0 +1,3 @@
+-- Migration 0008: walk tracking history in time order for exports
+-- migrate: no-transaction
+CREATE INDEX IF NOT EXISTS idx_supply_chain_timestamp ON supply_chain_tracking(timestamp);
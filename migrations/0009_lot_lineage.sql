@@ -0,0 +1,59 @@
+-- Migration 0009: lot split/merge lineage
+-- lot_links holds the lots each lot was split or merged from; lot_lineage is
+-- its transitive closure, kept current by trigger, so upstream provenance and
+-- downstream recall are each one index range scan however deep the graph gets.
+CREATE TABLE IF NOT EXISTS lot_links (
+    parent_id INTEGER NOT NULL,
+    child_id INTEGER NOT NULL,
+    -- Amount of the parent lot that went into the child, in the parent's unit
+    quantity VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (parent_id, child_id),
+    FOREIGN KEY (parent_id) REFERENCES products(id),
+    FOREIGN KEY (child_id) REFERENCES products(id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_lot_links_child ON lot_links(child_id);
+
+-- Every (ancestor, descendant) pair, with the length of the shortest path between them
+CREATE TABLE IF NOT EXISTS lot_lineage (
+    ancestor_id INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_lot_lineage_descendant ON lot_lineage(descendant_id, depth);
+
+-- Full recomputation from the links, used by `python lots.py rebuild`
+CREATE VIEW IF NOT EXISTS lot_lineage_source AS
+WITH RECURSIVE paths(ancestor_id, descendant_id, depth) AS (
+    SELECT parent_id, child_id, 1 FROM lot_links
+    UNION
+    SELECT paths.ancestor_id, l.child_id, paths.depth + 1
+    FROM paths JOIN lot_links l ON l.parent_id = paths.descendant_id
+)
+SELECT ancestor_id, descendant_id, MIN(depth) AS depth
+FROM paths GROUP BY ancestor_id, descendant_id;
+
+CREATE TRIGGER IF NOT EXISTS lot_links_acyclic BEFORE INSERT ON lot_links
+WHEN NEW.parent_id = NEW.child_id
+  OR EXISTS (SELECT 1 FROM lot_lineage WHERE ancestor_id = NEW.child_id AND descendant_id = NEW.parent_id)
+BEGIN
+    SELECT RAISE(ABORT, 'A lot cannot descend from itself');
+END;
+
+-- Connect the parent and everything above it to the child and everything below it
+CREATE TRIGGER IF NOT EXISTS lot_lineage_insert AFTER INSERT ON lot_links
+BEGIN
+    INSERT INTO lot_lineage (ancestor_id, descendant_id, depth)
+    SELECT up.id, down.id, up.depth + down.depth + 1
+    FROM (SELECT NEW.parent_id AS id, 0 AS depth
+          UNION ALL
+          SELECT ancestor_id, depth FROM lot_lineage WHERE descendant_id = NEW.parent_id) up,
+         (SELECT NEW.child_id AS id, 0 AS depth
+          UNION ALL
+          SELECT descendant_id, depth FROM lot_lineage WHERE ancestor_id = NEW.child_id) down
+    WHERE true
+    ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = min(depth, excluded.depth);
+END;
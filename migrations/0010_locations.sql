@@ -0,0 +1,13 @@
+-- Migration 0010: coordinates for farm, storage and retail locations
+-- Stage records can carry an optional latitude/longitude, stored with the
+-- point's geohash (see geo.py). Points close together share geohash prefixes,
+-- so with an index on it a proximity query is a few index range scans.
+ALTER TABLE farmer_records ADD COLUMN latitude REAL;
+ALTER TABLE farmer_records ADD COLUMN longitude REAL;
+ALTER TABLE farmer_records ADD COLUMN geohash TEXT;
+ALTER TABLE distributor_records ADD COLUMN latitude REAL;
+ALTER TABLE distributor_records ADD COLUMN longitude REAL;
+ALTER TABLE distributor_records ADD COLUMN geohash TEXT;
+ALTER TABLE retailer_records ADD COLUMN latitude REAL;
+ALTER TABLE retailer_records ADD COLUMN longitude REAL;
+ALTER TABLE retailer_records ADD COLUMN geohash TEXT;
@@ -0,0 +1,11 @@
+-- Migration 0011: geohash indexes for proximity search
+-- migrate: no-transaction
+-- Covering, so candidate points are read from the index alone; records without coordinates are left out
+CREATE INDEX IF NOT EXISTS idx_farmer_records_geohash
+ON farmer_records(geohash, latitude, longitude, product_id) WHERE geohash IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_distributor_records_geohash
+ON distributor_records(geohash, latitude, longitude, product_id) WHERE geohash IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_retailer_records_geohash
+ON retailer_records(geohash, latitude, longitude, product_id) WHERE geohash IS NOT NULL;
@@ -0,0 +1,4 @@
+-- Migration 0012: expiry tracking for retail lots
+-- expired_at is set by the expiry scheduler (expiry.py) once a record's
+-- expiry_date has passed; until then the record waits in the due-queue index.
+ALTER TABLE retailer_records ADD COLUMN expired_at TIMESTAMP;
@@ -0,0 +1,7 @@
+-- Migration 0013: due-queue and per-retailer expiry indexes
+-- migrate: no-transaction
+-- Only lots still waiting to expire: the next due date is the first entry, and the due rows are a prefix
+CREATE INDEX IF NOT EXISTS idx_retailer_records_expiry_due
+ON retailer_records(expiry_date) WHERE expired_at IS NULL AND expiry_date IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_retailer_records_retailer_expiry ON retailer_records(retailer_id, expiry_date);
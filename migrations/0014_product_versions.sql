@@ -0,0 +1,12 @@
+-- Migration 0014: per-product version counter
+-- Bumped by trigger on every update of a product row, however many happen in
+-- the same second (updated_at only has second resolution). Workers compare it
+-- before serving a cached verify-product payload, so a write made through any
+-- worker is seen by all of them at once.
+ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS product_version_update AFTER UPDATE ON products
+WHEN NEW.version = OLD.version
+BEGIN
+    UPDATE products SET version = OLD.version + 1 WHERE id = NEW.id;
+END;
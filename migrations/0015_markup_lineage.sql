@@ -0,0 +1,120 @@
+-- Migration 0015: markup summaries for split and merged lots
+-- Lots made by a split or merge have no farmer record of their own, so their
+-- distributor and retailer records matched no summary key and were never
+-- counted. markup_lot_keys gives every lot a key: that of its own farmer
+-- record, or else of its nearest upstream lot with one (the oldest of equally
+-- near parents of a merge). A retail lot's distributor margin is resolved the
+-- same way, so a lot split after distribution keeps the margin it moved at.
+CREATE VIEW IF NOT EXISTS markup_lot_keys AS
+SELECT product_id, category, region, month, farmer_price FROM markup_keys
+UNION ALL
+SELECT l.descendant_id AS product_id, k.category, k.region, k.month, k.farmer_price
+FROM lot_lineage l
+JOIN markup_keys k ON k.product_id = l.ancestor_id
+WHERE NOT EXISTS (SELECT 1 FROM farmer_records WHERE product_id = l.descendant_id)
+  AND l.ancestor_id = (SELECT up.ancestor_id FROM lot_lineage up
+                       WHERE up.descendant_id = l.descendant_id
+                         AND EXISTS (SELECT 1 FROM farmer_records WHERE product_id = up.ancestor_id)
+                       ORDER BY up.depth, up.ancestor_id LIMIT 1);
+
+-- The first distributor margin of each lot, its own or its nearest upstream lot's
+CREATE VIEW IF NOT EXISTS markup_lot_margins AS
+SELECT p.id AS product_id,
+       COALESCE((SELECT distributor_margin FROM distributor_records WHERE product_id = p.id
+                 ORDER BY id LIMIT 1),
+                (SELECT dr.distributor_margin FROM lot_lineage l
+                 JOIN distributor_records dr ON dr.product_id = l.ancestor_id
+                 WHERE l.descendant_id = p.id
+                 ORDER BY l.depth, dr.id LIMIT 1)) AS margin
+FROM products p;
+
+DROP TRIGGER IF EXISTS markup_distributor_insert;
+CREATE TRIGGER markup_distributor_insert AFTER INSERT ON distributor_records
+WHEN NOT EXISTS (SELECT 1 FROM distributor_records WHERE product_id = NEW.product_id AND id < NEW.id)
+BEGIN
+    UPDATE markup_summary SET
+        distributor_count = distributor_count + 1,
+        distributor_margin_sum = distributor_margin_sum + NEW.distributor_margin
+    WHERE (category, region, month) = (SELECT category, region, month FROM markup_lot_keys
+                                       WHERE product_id = NEW.product_id);
+END;
+
+DROP TRIGGER IF EXISTS markup_retailer_insert;
+CREATE TRIGGER markup_retailer_insert AFTER INSERT ON retailer_records
+WHEN NOT EXISTS (SELECT 1 FROM retailer_records WHERE product_id = NEW.product_id AND id < NEW.id)
+BEGIN
+    UPDATE markup_summary SET
+        retailer_count = retailer_count + 1,
+        retail_farmer_price_sum = retail_farmer_price_sum +
+            (SELECT farmer_price FROM markup_lot_keys WHERE product_id = NEW.product_id),
+        retail_margin_sum = retail_margin_sum + COALESCE(
+            (SELECT margin FROM markup_lot_margins WHERE product_id = NEW.product_id), 0),
+        final_price_sum = final_price_sum + NEW.final_price
+    WHERE (category, region, month) = (SELECT category, region, month FROM markup_lot_keys
+                                       WHERE product_id = NEW.product_id);
+END;
+
+-- Totals as the previous definition computes them, to apply only the difference below
+CREATE TEMP TABLE markup_summary_before AS SELECT * FROM markup_summary_source;
+
+-- Farmer totals still count each farmer record once; stage totals count every lot
+DROP VIEW IF EXISTS markup_summary_source;
+CREATE VIEW markup_summary_source AS
+SELECT category, region, month,
+       SUM(farmer_count) AS farmer_count,
+       SUM(farmer_price_sum) AS farmer_price_sum,
+       SUM(distributor_count) AS distributor_count,
+       SUM(distributor_margin_sum) AS distributor_margin_sum,
+       SUM(retailer_count) AS retailer_count,
+       SUM(retail_farmer_price_sum) AS retail_farmer_price_sum,
+       SUM(retail_margin_sum) AS retail_margin_sum,
+       SUM(final_price_sum) AS final_price_sum
+FROM (
+    SELECT category, region, month, 1 AS farmer_count, farmer_price AS farmer_price_sum,
+           0 AS distributor_count, 0 AS distributor_margin_sum, 0 AS retailer_count,
+           0 AS retail_farmer_price_sum, 0 AS retail_margin_sum, 0 AS final_price_sum
+    FROM markup_keys
+    UNION ALL
+    SELECT k.category, k.region, k.month, 0, 0,
+           d.margin IS NOT NULL, COALESCE(d.margin, 0),
+           r.final_price IS NOT NULL,
+           CASE WHEN r.final_price IS NOT NULL THEN k.farmer_price ELSE 0 END,
+           CASE WHEN r.final_price IS NOT NULL
+                THEN COALESCE((SELECT margin FROM markup_lot_margins WHERE product_id = k.product_id), 0)
+                ELSE 0 END,
+           COALESCE(r.final_price, 0)
+    FROM markup_lot_keys k
+    LEFT JOIN (SELECT product_id, MIN(id), distributor_margin AS margin
+               FROM distributor_records GROUP BY product_id) d ON d.product_id = k.product_id
+    LEFT JOIN (SELECT product_id, MIN(id), final_price
+               FROM retailer_records GROUP BY product_id) r ON r.product_id = k.product_id
+    WHERE d.margin IS NOT NULL OR r.final_price IS NOT NULL
+)
+GROUP BY category, region, month;
+
+-- Add what the new definition counts on top of the old one instead of recomputing
+-- the table, which would drop the totals of chains moved to an archive (see archive.py)
+INSERT INTO markup_summary
+SELECT category, region, month,
+       SUM(farmer_count), SUM(farmer_price_sum), SUM(distributor_count), SUM(distributor_margin_sum),
+       SUM(retailer_count), SUM(retail_farmer_price_sum), SUM(retail_margin_sum), SUM(final_price_sum)
+FROM (
+    SELECT * FROM markup_summary_source
+    UNION ALL
+    SELECT category, region, month, -farmer_count, -farmer_price_sum, -distributor_count,
+           -distributor_margin_sum, -retailer_count, -retail_farmer_price_sum, -retail_margin_sum,
+           -final_price_sum
+    FROM markup_summary_before
+)
+GROUP BY category, region, month
+ON CONFLICT (category, region, month) DO UPDATE SET
+    farmer_count = farmer_count + excluded.farmer_count,
+    farmer_price_sum = farmer_price_sum + excluded.farmer_price_sum,
+    distributor_count = distributor_count + excluded.distributor_count,
+    distributor_margin_sum = distributor_margin_sum + excluded.distributor_margin_sum,
+    retailer_count = retailer_count + excluded.retailer_count,
+    retail_farmer_price_sum = retail_farmer_price_sum + excluded.retail_farmer_price_sum,
+    retail_margin_sum = retail_margin_sum + excluded.retail_margin_sum,
+    final_price_sum = final_price_sum + excluded.final_price_sum;
+
+DROP TABLE markup_summary_before;
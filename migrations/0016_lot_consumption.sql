@@ -0,0 +1,8 @@
+-- Migration 0016: lots used up by a split or merge
+-- consumed_at is set on a lot once it has been split, or merged into another
+-- lot; from then on only the lots made from it take new stage records.
+ALTER TABLE products ADD COLUMN consumed_at TIMESTAMP;
+
+-- Lots split or merged before this migration are used up already
+UPDATE products SET consumed_at = CURRENT_TIMESTAMP
+WHERE id IN (SELECT parent_id FROM lot_links);
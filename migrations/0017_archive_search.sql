@@ -0,0 +1,15 @@
+-- Migration 0017: archived products stay searchable
+-- archive.py deletes the products it moved from the hot tables, which fired
+-- product_search_delete and dropped them from search. While it deletes them
+-- it holds a row in archive_moves, inside its own transaction so no other
+-- connection ever sees one, and the trigger leaves their index rows alone.
+CREATE TABLE IF NOT EXISTS archive_moves (
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+DROP TRIGGER IF EXISTS product_search_delete;
+CREATE TRIGGER product_search_delete AFTER DELETE ON products
+WHEN NOT EXISTS (SELECT 1 FROM archive_moves)
+BEGIN
+    DELETE FROM product_search WHERE rowid = OLD.id;
+END;
@@ -0,0 +1,162 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import qrcode
+import qrcode.image.svg
+
+from cache import TTLCache
+
+QR_CACHE_DIR = os.environ.get('KRISHICHAIN_QR_CACHE_DIR', 'qr_cache')
+QR_DISK_CACHE_MAX_FILES = int(os.environ.get('KRISHICHAIN_QR_DISK_CACHE_MAX_FILES', 100000))
+DEFAULT_BOX_SIZE = 10
+MIN_BOX_SIZE = 1
+MAX_BOX_SIZE = 40
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Rendered images never change, so entries only leave the cache by LRU eviction
+memory_cache = TTLCache(
+    maxsize=int(os.environ.get('KRISHICHAIN_QR_CACHE_SIZE', 2048)),
+    ttl=float('inf'),
+)
+
+_disk_writes = 0
+_disk_lock = threading.Lock()
+
+
+def render_qr(qr_text, fmt='png', box_size=DEFAULT_BOX_SIZE):
+    """Render a QR code to PNG or SVG bytes"""
+    if fmt == 'svg':
+        qr = qrcode.QRCode(version=1, box_size=box_size, border=5,
+                           image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        qr = qrcode.QRCode(version=1, box_size=box_size, border=5)
+    qr.add_data(qr_text)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    if fmt == 'svg':
+        img.save(img_buffer)
+    else:
+        img.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+
+def disk_path(qr_text, fmt, box_size):
+    return os.path.join(QR_CACHE_DIR, f"{qr_text}-{box_size}.{fmt}")
+
+
+def prune_disk_cache():
+    """Drop the oldest files once the disk cache grows past its bound"""
+    try:
+        entries = [entry for entry in os.scandir(QR_CACHE_DIR) if entry.is_file()]
+    except FileNotFoundError:
+        return
+    excess = len(entries) - QR_DISK_CACHE_MAX_FILES
+    if excess <= 0:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def write_disk_cache(path, data):
+    """Atomically persist a rendered image, pruning the directory now and then"""
+    global _disk_writes
+    try:
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        return
+    with _disk_lock:
+        _disk_writes += 1
+        should_prune = _disk_writes % 256 == 0
+    if should_prune:
+        prune_disk_cache()
+
+
+def get_qr_image(qr_text, fmt='png', box_size=DEFAULT_BOX_SIZE, render=True):
+    """Return (bytes, etag) for a QR image from memory, disk, or a fresh render
+
+    With render=False only already-rendered images are returned, otherwise None.
+    """
+    if fmt == 'svg':
+        box_size = DEFAULT_BOX_SIZE
+    key = (qr_text, fmt, box_size)
+    cached = memory_cache.get(key)
+    if cached is not None:
+        return cached
+
+    path = disk_path(qr_text, fmt, box_size)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        if not render:
+            return None
+        data = render_qr(qr_text, fmt, box_size)
+        write_disk_cache(path, data)
+
+    image = (data, hashlib.sha256(data).hexdigest()[:32])
+    memory_cache.set(key, image)
+    return image
+
+
+_render_pool = None
+_prerender_queue = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Lazily start the process pool used for batch renders
+
+    Workers come from a forkserver rather than a fork of this process: forking
+    a threaded web worker can copy locks other threads hold (logging, the
+    connection pool, the caches) into the child, where nothing releases them.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            workers = int(os.environ.get('KRISHICHAIN_QR_RENDER_WORKERS', os.cpu_count() or 1))
+            _render_pool = ProcessPoolExecutor(max_workers=workers,
+                                               mp_context=multiprocessing.get_context('forkserver'))
+        return _render_pool
+
+
+def prerender_qr_images(qr_texts):
+    """Render many PNGs in parallel worker processes and store them in the cache"""
+    qr_texts = list(qr_texts)
+    if not qr_texts:
+        return
+    chunksize = max(1, len(qr_texts) // (4 * (os.cpu_count() or 1)))
+    rendered = get_render_pool().map(render_qr, qr_texts, chunksize=chunksize)
+    for qr_text, data in zip(qr_texts, rendered):
+        write_disk_cache(disk_path(qr_text, 'png', DEFAULT_BOX_SIZE), data)
+        memory_cache.set((qr_text, 'png', DEFAULT_BOX_SIZE),
+                         (data, hashlib.sha256(data).hexdigest()[:32]))
+
+
+def prerender_in_background(qr_texts):
+    """Queue a batch pre-render and return at once; batches run one at a time"""
+    global _prerender_queue
+    with _render_pool_lock:
+        if _prerender_queue is None:
+            _prerender_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qr-prerender')
+    future = _prerender_queue.submit(prerender_qr_images, list(qr_texts))
+    future.add_done_callback(_report_prerender_failure)
+    return future
+
+
+def _report_prerender_failure(future):
+    if future.exception() is not None:
+        print(f"QR pre-render failed: {future.exception()}")
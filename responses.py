@@ -0,0 +1,103 @@
+"""Compact JSON responses: fast encoding, field selection, ETags and gzip.
+
+orjson is used when installed and the standard library otherwise; output is
+always compact UTF-8. Large JSON and text responses are gzipped for clients
+that accept it, and JSON GET responses without an ETag of their own get one
+from their body so repeat requests can be answered with 304.
+"""
+import gzip
+import hashlib
+import os
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the standard library encoder
+    orjson = None
+
+GZIP_MIN_SIZE = int(os.environ.get('KRISHICHAIN_GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('KRISHICHAIN_GZIP_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain',
+                          'image/svg+xml'}
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Compact UTF-8 JSON, encoded with orjson when available"""
+
+    ensure_ascii = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        # Datetimes go through Flask's default so the output matches the stdlib encoder
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME).decode()
+
+
+def parse_fields(spec):
+    """Parse ?fields=a,b.c,b.d into a tree {'a': {}, 'b': {'c': {}, 'd': {}}}; None selects everything"""
+    if not spec:
+        return None
+    tree = {}
+    for path in spec.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree or None
+
+
+def requested_fields():
+    return parse_fields(request.args.get('fields'))
+
+
+def select_fields(value, fields):
+    """Keep only the selected fields of a record, descending into nested objects and lists"""
+    if not fields:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {name: select_fields(value[name], nested) for name, nested in fields.items() if name in value}
+
+
+def etag_for(*parts):
+    """ETag value derived from the inputs of a representation rather than its bytes"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:32]
+
+
+def finalize_response(response):
+    """after_request hook: add a body ETag to JSON GET responses, answer 304s, then gzip"""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+
+    if (request.method == 'GET' and response.status_code == 200 and 'ETag' not in response.headers
+            and response.mimetype == 'application/json'):
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest()[:32], weak=True)
+        response = response.make_conditional(request)
+
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings or response.content_length is None \
+            or response.content_length < GZIP_MIN_SIZE:
+        return response
+
+    response.set_data(gzip.compress(response.get_data(), GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The compressed bytes differ, so a strong validator no longer applies
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.json = JSONProvider(app)
+    app.after_request(finalize_response)
@@ -0,0 +1,125 @@
+"""Full-text product search.
+
+product_search is an FTS5 index with one row per product, kept in sync by
+triggers on products and farmer_records (see migrations/0007_product_search.sql).
+Archived products keep their rows and are resolved from the archive (see
+archive.py). After a bulk load with the triggers dropped, repopulate it with:
+
+    python search.py rebuild
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import archive
+from database import DATABASE, connect
+
+# Ranking scores every match, so broader queries come back newest first instead
+RANK_CANDIDATES = int(os.environ.get('KRISHICHAIN_SEARCH_RANK_CANDIDATES', 1000))
+
+_term = re.compile(r'\w+', re.UNICODE)
+
+# product_search_source over archived products, which a view in the hot database cannot reference
+ARCHIVED_SOURCE_SQL = '''
+    SELECT p.id, p.product_name, p.category, p.description, fr.farm_location, fr.farming_method
+    FROM archive.products p
+    LEFT JOIN archive.farmer_records fr ON fr.id = (SELECT MIN(id) FROM archive.farmer_records
+                                                    WHERE product_id = p.id)
+    WHERE NOT EXISTS (SELECT 1 FROM main.products hp WHERE hp.id = p.id)'''
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query requiring every word; None if it has no words
+
+    The last word matches as a prefix so results follow the user as they type.
+    User input is never passed through as FTS5 syntax, so quotes, operators and
+    column filters in it cannot cause syntax errors.
+    """
+    terms = _term.findall(text or '')
+    if not terms:
+        return None
+    return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+def product_join(conn):
+    """Join of index rows `s` to their product, hot or archived; returns (join, qr_code column, stage column)"""
+    if archive.attach(conn):
+        return ('''LEFT JOIN main.products p ON p.id = s.rowid
+                   LEFT JOIN archive.products a ON p.id IS NULL AND a.id = s.rowid''',
+                'COALESCE(p.qr_code, a.qr_code)', 'COALESCE(p.current_stage, a.current_stage)')
+    return 'JOIN products p ON p.id = s.rowid', 'p.qr_code', 'p.current_stage'
+
+
+def search_products(conn, text, limit, offset=0):
+    """Products matching every word of `text`; returns (results, order)
+
+    Walking matches in rowid order is cheap, so the newest RANK_CANDIDATES + 1
+    are fetched first. If that is all of them they are ranked by relevance;
+    otherwise the query is too broad to rank quickly and matches come newest first.
+    """
+    query = fts_query(text)
+    if query is None:
+        return [], 'relevance'
+    candidates = [row[0] for row in conn.execute('''SELECT rowid FROM product_search
+                                                    WHERE product_search MATCH ?
+                                                    ORDER BY rowid DESC LIMIT ?''',
+                                                 (query, RANK_CANDIDATES + 1))]
+
+    join, qr_code, stage = product_join(conn)
+    if len(candidates) <= RANK_CANDIDATES:
+        rows = conn.execute(f'''SELECT {qr_code} AS qr_code, s.product_name, s.category, {stage} AS current_stage,
+                                       s.farm_location, s.farming_method, s.score
+                                FROM (SELECT rowid, product_name, category, farm_location, farming_method,
+                                             rank AS score
+                                      FROM product_search WHERE product_search MATCH ?
+                                      ORDER BY rank LIMIT ? OFFSET ?) s
+                                {join}
+                                ORDER BY s.score''', (query, limit, offset)).fetchall()
+        return [dict(row) for row in rows], 'relevance'
+
+    page = candidates[offset:offset + limit]
+    if not page:
+        return [], 'newest'
+    placeholders = ','.join('?' * len(page))
+    rows = conn.execute(f'''SELECT {qr_code} AS qr_code, s.product_name, s.category, {stage} AS current_stage,
+                                   s.farm_location, s.farming_method, NULL AS score
+                            FROM product_search s
+                            {join}
+                            WHERE s.rowid IN ({placeholders})
+                            ORDER BY s.rowid DESC''', page).fetchall()
+    return [dict(row) for row in rows], 'newest'
+
+
+def rebuild_search_index(conn):
+    """Repopulate product_search from the products, hot and archived, in one transaction; returns the row count"""
+    conn.execute('DELETE FROM product_search')
+    conn.execute('''INSERT INTO product_search (rowid, product_name, category, description,
+                                                farm_location, farming_method)
+                    SELECT * FROM product_search_source''')
+    if archive.attach(conn):
+        conn.execute(f'''INSERT INTO product_search (rowid, product_name, category, description,
+                                                     farm_location, farming_method) {ARCHIVED_SOURCE_SQL}''')
+    # Merge the index segments written by the bulk insert
+    conn.execute("INSERT INTO product_search (product_search) VALUES ('optimize')")
+    conn.commit()
+    return conn.execute('SELECT COUNT(*) FROM product_search').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KrishiChain product search index maintenance')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--database', default=DATABASE, help='SQLite database file (default: %(default)s)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = connect(args.database)
+    rows = rebuild_search_index(conn)
+    conn.close()
+    print(f"✅ Rebuilt product_search ({rows:,} products) in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Opt-in slow-query log with EXPLAIN QUERY PLAN capture.
+
+Enable by setting KRISHICHAIN_SLOW_QUERY_MS. Statements slower than the
+threshold are logged with their normalized text, parameter shape, duration and
+endpoint. The first time each statement shape is seen slow, its query plan is
+captured and any full table scans are flagged. Set KRISHICHAIN_SLOW_QUERY_LOG
+to also append JSON lines to a file, which this module summarizes as a CLI:
+
+    python slow_queries.py slow_queries.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from flask import has_request_context, request
+
+SLOW_QUERY_MS = os.environ.get('KRISHICHAIN_SLOW_QUERY_MS')
+SLOW_QUERY_LOG = os.environ.get('KRISHICHAIN_SLOW_QUERY_LOG')
+
+logger = logging.getLogger('krishichain.slow_query')
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r'\b\d+(?:\.\d+)?\b')
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals so equivalent statements share one shape"""
+    sql = _string_literal.sub('?', sql)
+    sql = _number_literal.sub('?', sql)
+    return _whitespace.sub(' ', sql).strip()
+
+
+def params_shape(params):
+    """Describe bound parameters by type only, never by value"""
+    if params is None:
+        return 'executemany'
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+
+
+def full_scans(plan):
+    """Plan steps that walk a whole table instead of seeking an index"""
+    # Scans of subquery results (co-routines, materialized views) are not table scans
+    derived = {step.split()[-1] for step in plan if step.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    return [step for step in plan
+            if step.startswith('SCAN ') and 'COVERING INDEX' not in step
+            and 'CONSTANT ROW' not in step and step.split()[1] not in derived]
+
+
+class SlowQueryLog:
+    """Collects statements over a latency threshold, grouped by normalized shape"""
+
+    def __init__(self, threshold_ms, log_path=None):
+        self.threshold = threshold_ms / 1000.0
+        self.log_path = log_path
+        self.shapes = {}
+        self._lock = threading.Lock()
+
+    def explain(self, conn, sql, params):
+        if params is None:
+            return ['(plan not captured for executemany)']
+        if not sql.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')):
+            return []
+        try:
+            # Bypass the instrumented execute() so the EXPLAIN is not itself observed
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error as e:
+            return [f'(plan unavailable: {e})']
+        return [row[3] for row in rows]
+
+    def observe(self, conn, sql, params, seconds):
+        """Statement observer registered with database.statement_observers"""
+        if seconds < self.threshold:
+            return
+        shape = normalize_sql(sql)
+        endpoint = request.url_rule.rule if has_request_context() and request.url_rule else None
+
+        with self._lock:
+            entry = self.shapes.get(shape)
+            first_seen = entry is None
+            if first_seen:
+                entry = self.shapes[shape] = {
+                    'sql': shape, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'params': params_shape(params), 'endpoints': [], 'plan': None, 'full_scans': [],
+                }
+            entry['count'] += 1
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+            if endpoint and endpoint not in entry['endpoints']:
+                entry['endpoints'].append(endpoint)
+
+        if first_seen:
+            plan = self.explain(conn, sql, params)
+            with self._lock:
+                entry['plan'] = plan
+                entry['full_scans'] = full_scans(plan)
+
+        record = {'time': time.time(), 'sql': shape, 'params': params_shape(params),
+                  'duration_ms': round(seconds * 1000, 3), 'endpoint': endpoint}
+        if first_seen:
+            record['plan'] = entry['plan']
+        logger.warning('slow query %.1fms [%s] %s params=%s', seconds * 1000, endpoint, shape,
+                       record['params'])
+        if self.log_path:
+            try:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+            except OSError:
+                pass
+
+    def summary(self):
+        """Slow statement shapes, worst total time first"""
+        with self._lock:
+            entries = [dict(entry, total_ms=round(entry['total_ms'], 3), max_ms=round(entry['max_ms'], 3))
+                       for entry in self.shapes.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+
+# Disabled unless a threshold is configured
+slow_query_log = SlowQueryLog(float(SLOW_QUERY_MS), SLOW_QUERY_LOG) if SLOW_QUERY_MS else None
+
+
+def summarize_log(path):
+    """Aggregate a JSON-lines slow query log by statement shape"""
+    shapes = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            entry = shapes.setdefault(record['sql'], {
+                'sql': record['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'endpoints': set(), 'plan': None})
+            entry['count'] += 1
+            entry['total_ms'] += record['duration_ms']
+            entry['max_ms'] = max(entry['max_ms'], record['duration_ms'])
+            if record.get('endpoint'):
+                entry['endpoints'].add(record['endpoint'])
+            if record.get('plan') and entry['plan'] is None:
+                entry['plan'] = record['plan']
+    return sorted(shapes.values(), key=lambda entry: entry['total_ms'], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a KrishiChain slow query log')
+    parser.add_argument('log', nargs='?', default=SLOW_QUERY_LOG, help='JSON-lines slow query log')
+    parser.add_argument('--top', type=int, default=20, help='number of statement shapes to show')
+    args = parser.parse_args()
+    if not args.log:
+        parser.error('no log file given and KRISHICHAIN_SLOW_QUERY_LOG is not set')
+
+    for entry in summarize_log(args.log)[:args.top]:
+        print(f"{entry['total_ms']:10.1f}ms total  {entry['count']:6d}x  max {entry['max_ms']:.1f}ms  "
+              f"{', '.join(sorted(entry['endpoints'])) or '-'}")
+        print(f"    {entry['sql']}")
+        scans = full_scans(entry['plan'] or [])
+        for step in entry['plan'] or []:
+            marker = '  <-- full scan' if step in scans else ''
+            print(f"      {step}{marker}")
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from database import connect
+
+FLUSH_SIZE = int(os.environ.get('KRISHICHAIN_WRITE_BEHIND_FLUSH_SIZE', 500))
+FLUSH_INTERVAL = float(os.environ.get('KRISHICHAIN_WRITE_BEHIND_FLUSH_INTERVAL', 1.0))
+MAX_PENDING = int(os.environ.get('KRISHICHAIN_WRITE_BEHIND_MAX_PENDING', 100000))
+
+
+class WriteBehindBuffer:
+    """Buffers rows for one INSERT statement and flushes them in batches from a background thread"""
+
+    def __init__(self, sql, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_pending=MAX_PENDING):
+        self.sql = sql
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def _start(self):
+        # The writer thread does not survive a fork, so start one per process
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def put(self, row):
+        """Enqueue a parameter tuple without blocking; counts it as dropped when the buffer is full"""
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _take_batch(self):
+        """Wait for a batch to fill or the flush interval to pass"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        # Pick up anything else already waiting without sleeping again
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn, batch):
+        try:
+            conn.executemany(self.sql, batch)
+            conn.commit()
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            conn.rollback()
+            self.failed += len(batch)
+            print(f"Write-behind flush failed: {e}")
+
+    def _run(self):
+        conn = connect()
+        try:
+            while not self._stopping.is_set():
+                batch = self._take_batch()
+                if batch:
+                    self._write(conn, batch)
+            # Drain whatever is left on shutdown
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def close(self, timeout=10.0):
+        """Stop the writer thread after it has flushed every pending row"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'pending': self.pending(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+# Customer verification audit rows, taken off the verify-product critical path
+verification_log = WriteBehindBuffer('''INSERT INTO customer_transactions
+                                        (product_id, customer_id, verification_date)
+                                        VALUES (?, ?, ?)''')
+atexit.register(verification_log.close)